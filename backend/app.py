@@ -1,153 +1,94 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, g, request, jsonify, stream_with_context, url_for
 from flask_cors import CORS
-import sqlite3
-import pandas as pd
-import requests
-import folium
-import matplotlib.pyplot as plt
 import io
-import base64
-from math import radians, sin, cos, sqrt, atan2
-from geopy.geocoders import Nominatim
+import json
+import math
 import os
-import sqlite3
+import time
 
-app = Flask(__name__)
-CORS(app)
+import numpy as np
 
-def get_db_connection():
-    """
-    Establishes a connection to the SQLite database.
-    
-    Returns:
-        sqlite3.Connection: A connection object to the database
-        
-    Raises:
-        FileNotFoundError: If the database file is not found
-        sqlite3.Error: If there's an error connecting to the database
-    """
-    base_dir = os.path.abspath(os.path.dirname(__file__))
-    db_path = os.path.join(base_dir, 'database_py', 'database', 'carbon.db')
-
-    # print(" Absolute path to DB:", db_path)
-    # print(" DB exists?", os.path.exists(db_path))
+import config
+from batch import MAX_BATCH_SIZE, calculate_batch, parse_ndjson, stream_batch
+from catalog import get_catalog
+from database_py import summary
+from db import get_database
+from depots import get_depot_index
+from emissions import calc_emission, lifecycle_emissions
+from factors import get_factor_registry
+from fleet import get_fleet
+from geo import iter_haversine_matrix
+from geocode import get_geocoder
+from jobs import FINISHED, JobLimitError, get_job_queue
+from logistics import geography, distribution_centre, resolve_legs, resolve_points
+from maps import encode_map_id, get_map_html, map_cache_stats, route_locations, to_geojson
+from metrics import observe_request, render as render_metrics
+from multimodal import get_hub_graph, hub_graph_stats, plan_route
+from reports import ReportUnavailableError, get_report_renderer
+from result_cache import get_result_cache
+from routing import get_route_service
+import serving
+from timing import end_request, server_timing, stage, start_request
+from upstream import UpstreamError, collect_fallbacks, upstream_stats
+import whatif
 
-    if not os.path.exists(db_path):
-        raise FileNotFoundError(f"Database not found at {db_path}")
+api = Blueprint('api', __name__)
 
-    try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
-    except sqlite3.Error as e:
-        print("SQLite error:", e)
-        raise
 
-def geography(name):
-    """
-    Converts a location name to its geographical coordinates.
-    
-    Args:
-        name (str): The name of the location to geocode
-        
-    Returns:
-        tuple: A tuple containing (latitude, longitude)
-        
-    Raises:
-        Exception: If geocoding fails
+def create_app(preload=False):
     """
-    geolocator = Nominatim(user_agent="user1", timeout=20)
-    location = geolocator.geocode(name)
-    return (location.latitude, location.longitude)
+    Builds the Flask application.
 
-def haversine(lat1, lon1, lat2, lon2):
-    """
-    Calculates the great-circle distance between two points on the Earth's surface.
-    
     Args:
-        lat1 (float): Latitude of first point in degrees
-        lon1 (float): Longitude of first point in degrees
-        lat2 (float): Latitude of second point in degrees
-        lon2 (float): Longitude of second point in degrees
-        
-    Returns:
-        float: Distance between points in kilometers
-    """
-    R = 6371  # Earth's radius in kilometers
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
+        preload (bool): Warm up before returning and release connections and
+            threads for forking workers (production, see wsgi.py). Otherwise
+            warm-up runs on a background thread and the server starts at once
 
-def distribution_centre(pickup, delivery, mode=""):
-    """
-    Calculates distribution information between pickup and delivery locations.
-    
-    Args:
-        pickup (str): Name of the pickup location
-        delivery (str): Name of the delivery location
-        mode (str): Transport mode - "local" or "global"
-        
     Returns:
-        dict: Dictionary containing:
-            - Olat: Origin latitude
-            - Olon: Origin longitude
-            - Dlat: Destination latitude
-            - Dlon: Destination longitude
-            - distance: Distance in kilometers
-            - duration: Duration in hours
-            
-    Raises:
-        ValueError: If mode is not "local" or "global"
+        Flask: The application
     """
-    origin = geography(pickup)
-    destination = geography(delivery)
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(api)
+    if preload:
+        serving.warm_up()
+        serving.before_fork()
+    else:
+        serving.start_warm_up()
+    return app
 
-    result = {
-        "Olat": origin[0],
-        "Olon": origin[1],
-        "Dlat": destination[0],
-        "Dlon": destination[1],
-        "distance": None,
-        "duration": None
-    }
 
-    if mode == "local":
-        origin_str = f"{origin[1]},{origin[0]}"
-        destination_str = f"{destination[1]},{destination[0]}"
-        url = f"http://router.project-osrm.org/route/v1/driving/{origin_str};{destination_str}?overview=false"
-        response = requests.get(url)
-        data = response.json()
-
-        if 'routes' in data and len(data['routes']) > 0:
-            route = data['routes'][0]
-            result["distance"] = route['distance'] / 1000
-            result["duration"] = route['duration'] / 3600
-        else:
-            result["distance"] = haversine(*origin, *destination)
-            result["duration"] = result["distance"] / 50
-    elif mode == "global":
-        result["distance"] = haversine(*origin, *destination)
-        result["duration"] = result["distance"] / 830
-    else:
-        raise ValueError("Invalid transport mode")
+@api.before_app_request
+def start_timers():
+    if config.METRICS_ENABLED or config.SERVER_TIMING:
+        g.timings = start_request()
+        g.started = time.perf_counter()
 
-    return result
 
-def calc_emission(weight, distance, fuel_factor=3.27):
+@api.after_app_request
+def record_timings(response):
     """
-    Calculates carbon emissions for a given weight and distance.
-    
-    Args:
-        weight (float): Weight of the cargo in kg
-        distance (float): Distance in kilometers
-        fuel_factor (float, optional): Fuel emission factor. Defaults to 3.27
-        
-    Returns:
-        float: Total emissions in kg CO2
+    Adds the Server-Timing header and feeds the request and stage histograms.
+
+    For streamed responses the total covers the time until the body starts.
     """
-    return weight * fuel_factor * distance
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    total = time.perf_counter() - g.started
+    if config.SERVER_TIMING:
+        response.headers['Server-Timing'] = server_timing(timings, total)
+    if config.METRICS_ENABLED:
+        # Label by view name alone ("calculate_emissions", not "api.calculate_emissions").
+        endpoint = request.endpoint.rpartition('.')[2] if request.endpoint else 'unmatched'
+        observe_request(endpoint, response.status_code, total, timings)
+    return response
+
+
+@api.teardown_app_request
+def stop_timers(exception):
+    if g.pop('timings', None) is not None:
+        end_request()
 
 def get_chart_data(global_emission, local_emission):
     """
@@ -167,7 +108,33 @@ def get_chart_data(global_emission, local_emission):
     }
 
 
-@app.route('/api/parts', methods=['GET'])
+def catalog_response(catalog, payload):
+    """
+    Builds a revalidatable response for catalog data.
+
+    The body is only built when the client's ETag is stale; otherwise a 304
+    is returned straight away.
+
+    Args:
+        catalog (InventoryCatalog): Catalog the payload is read from
+        payload (callable): Returns the JSON-serializable body
+
+    Returns:
+        Response: 200 with ETag and Last-Modified headers, or 304
+    """
+    catalog.refresh()
+    etag = catalog.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload())
+    response.set_etag(etag)
+    response.last_modified = catalog.last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+@api.route('/api/parts', methods=['GET'])
 def get_part_names():
     """
     API endpoint to get part names for a specific manufacturer.
@@ -180,6 +147,7 @@ def get_part_names():
         
     Status Codes:
         200: Success
+        304: Catalog unchanged since the client's ETag
         400: Missing manufacturer parameter
     """
     manufacturer = request.args.get('manufacturer')
@@ -188,30 +156,73 @@ def get_part_names():
 
     print(f"/api/parts route was hit with manufacturer: {manufacturer}")
 
-    conn = get_db_connection()
-    query = 'SELECT DISTINCT part_name, serial_id FROM inventory_parts WHERE manufacturer = ?'
-    rows = conn.execute(query, (manufacturer,)).fetchall()
-    conn.close()
-
-    part_info = [{"part_name": row['part_name'], "serial_id": row['serial_id']} for row in rows]
-    return jsonify(part_info)
+    catalog = get_catalog()
+    return catalog_response(catalog, lambda: catalog.parts(manufacturer))
 
 
-@app.route('/api/manufacturers', methods=['GET'])
+@api.route('/api/manufacturers', methods=['GET'])
 def get_manufacturers():
     """
     API endpoint to get list of all manufacturers.
     
     Returns:
         JSON: List of manufacturer names
+
+    Status Codes:
+        200: Success
+        304: Catalog unchanged since the client's ETag
+    """
+    catalog = get_catalog()
+    return catalog_response(catalog, catalog.manufacturers)
+
+
+@api.route('/api/summary', methods=['GET'])
+def get_summary():
     """
-    conn = get_db_connection()
-    rows = conn.execute('SELECT DISTINCT manufacturer FROM inventory_parts').fetchall()
-    conn.close()
-    return jsonify([row['manufacturer'] for row in rows])
+    API endpoint returning fleet totals by manufacturer, drive type and fuel type.
+
+    Totals come from the trigger-maintained inventory_summary table, so the
+    cost depends on the number of groups, not the number of parts. Responses
+    share the catalog ETag and can be revalidated with If-None-Match.
+
+    Query Parameters:
+        by (str, optional): "manufacturer", "drive_type" or "fuel_type" to return only that grouping
 
+    Returns:
+        JSON: Dictionary containing:
+            - total: Fleet totals (parts count plus the sum of weight, used_hours, each
+              material and its emissions, manufacturing_emission, and
+              weighted_manufacturing_emission = sum of manufacturing_emission x weight)
+            - by_manufacturer, by_drive_type, by_fuel_type: Lists of the same totals
+              per group, with the group value under the dimension name (null when unset)
 
-@app.route('/api/calculate', methods=['POST'])
+    Status Codes:
+        200: Success
+        304: Not modified
+        400: Unknown grouping
+    """
+    by = request.args.get('by')
+    if by is not None and by not in summary.DIMENSIONS:
+        return jsonify({"error": f"by must be one of: {', '.join(summary.DIMENSIONS)}"}), 400
+    dimensions = (by,) if by else summary.DIMENSIONS
+
+    def payload():
+        rows = get_database().fetchall(
+            f"SELECT dimension, value, {', '.join(summary.COLUMNS)} FROM inventory_summary ORDER BY dimension, value")
+        result = {'total': dict.fromkeys(summary.COLUMNS, 0)}
+        result.update({f'by_{dimension}': [] for dimension in dimensions})
+        for row in rows:
+            totals = {column: row[column] for column in summary.COLUMNS}
+            if row['dimension'] == summary.FLEET:
+                result['total'] = totals
+            elif row['dimension'] in dimensions:
+                result[f"by_{row['dimension']}"].append({row['dimension']: row['value'] or None, **totals})
+        return result
+
+    return catalog_response(get_catalog(), payload)
+
+
+@api.route('/api/calculate', methods=['POST'])
 def calculate_emissions():
     """
     API endpoint to calculate emissions for a part's transportation.
@@ -222,10 +233,18 @@ def calculate_emissions():
         serial_id (str): Serial ID of the part
         equipment_type (str): Type of equipment ('Old' or 'New')
         pickup (str): Local pickup location
-        delivery (str): Local delivery location
+        delivery (str, optional): Local delivery location; defaults to the depot
+            nearest the pickup, reported as logistics_info.depot
         G_pickup (str, optional): Global pickup location
         G_delivery (str, optional): Global delivery location
+        map (str, optional): "html" (default) embeds the rendered map; "geojson"
+            returns compact markers and polyline plus a /api/map URL; "none" omits the map
         
+    Identical requests (same part, locations and map option) against the same
+    inventory and emission factors are answered from a result cache; the
+    X-Cache response header says HIT or MISS. Results built from an upstream
+    fallback (stale geocode, estimated route) are not cached.
+
     Returns:
         JSON: Dictionary containing:
             - weight: Part weight
@@ -239,11 +258,20 @@ def calculate_emissions():
             - created_emission: Manufacturing emissions
             - logistics_info: Local logistics information
             - G_logistics_info: Global logistics information (if provided)
-            - map_html: HTML representation of the route map
+            - factors_version: Version of the emission factors the figures were computed with
+            - provisional: True when the local leg is an estimate because the router
+              missed CARBON_ROUTE_HEDGE_DEADLINE; logistics_info.refine_url then
+              serves the real route once it arrives, and such results are not cached
+            - map_html: HTML representation of the route map (map="html")
+            - map_geojson, map_id, map_url: Route as GeoJSON and where to fetch its
+              rendered map (map="geojson")
             
     Status Codes:
         200: Success
+        400: A location could not be geocoded, or an invalid map option
         404: Part not found
+        503: Geocoding upstream unavailable and the location was never cached
+        504: Geocoding or routing missed the CARBON_LOOKUP_DEADLINE
     """
     data = request.get_json()
 
@@ -253,38 +281,47 @@ def calculate_emissions():
     equipment_type = data['equipment_type']
 
     L_pickup = data['pickup']
-    L_delivery = data['delivery']
+    L_delivery = data.get('delivery') or None # Optional, nearest depot
     G_pickup = data.get('G_pickup') # Optional
     G_delivery = data.get('G_delivery') # Optional
+    map_mode = data.get('map', 'html')
+    if map_mode not in ('html', 'geojson', 'none'):
+        return jsonify({"error": 'map must be "html", "geojson" or "none"'}), 400
+
+    catalog = get_catalog()
+    with stage('catalog'):
+        catalog.refresh()
+    # One snapshot for the whole calculation, even if the factor file is reloaded meanwhile.
+    factors = get_factor_registry().current()
+    result_cache = get_result_cache()
+    versions = (catalog.etag, factors.version)
+    if L_delivery is None:
+        versions += (get_depot_index().version,)
+    cache_key = result_cache.make_key(data, *versions)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        response = jsonify(cached)
+        response.headers['X-Cache'] = 'HIT'
+        return response
 
-    conn = get_db_connection()
-    part = conn.execute('SELECT * FROM inventory_parts WHERE manufacturer=? AND part_name=? AND serial_id=?',
-                        (manufacturer, part_name, serial_id)).fetchone()
-    conn.close()
+    with stage('catalog'):
+        part = catalog.get_part(manufacturer, part_name, serial_id)
 
     if part is None:
         return jsonify({"error": "Part not found"}), 404
 
-    # Calculate manufacturing emissions
+    # Calculate manufacturing and usage emissions
     manufacturing_emission = part['manufacturing_emission']
     weight = part['weight']
     used_hours = part['used_hours']
-    lifetime_emissions = 16000
 
-    created_emissions = (manufacturing_emission * weight) + (60000 * 3.27) - (5000 * 3.27)
-
-    # Calculate usage emissions
-    emission_rate_per_hour = 0.05
-    emissions_already_used = used_hours * emission_rate_per_hour
-    old_total_emissions = created_emissions - (lifetime_emissions - emissions_already_used)
-    new_total_emissions = created_emissions
+    created_emissions, old_total_emissions, new_total_emissions = lifecycle_emissions(
+        manufacturing_emission, weight, used_hours, factors, part['fuel_type'])
 
     if equipment_type == 'Old':
-        emission_rate_per_hour = 0.05
-        emissions_already_used = used_hours * emission_rate_per_hour
-        total_emissions = created_emissions - (lifetime_emissions - emissions_already_used)
+        total_emissions = old_total_emissions
     else:
-        total_emissions = created_emissions
+        total_emissions = new_total_emissions
 
     component_chart_data = {
     "labels": ["Steel", "Aluminum", "Rubber"],
@@ -299,51 +336,37 @@ def calculate_emissions():
 
     ##local $$ global declarations##
 
-    logistics_info = distribution_centre(L_pickup, L_delivery, mode="local")
-    local_emission = calc_emission(weight, logistics_info["distance"])
+    legs = [(L_pickup, L_delivery, "local")]
+    if G_pickup and G_delivery:
+        legs.append((G_pickup, G_delivery, "global"))
+
+    with collect_fallbacks() as fallbacks:
+        resolved = resolve_legs(legs)
+    failed = next((leg for leg in resolved if isinstance(leg, Exception)), None)
+    if isinstance(failed, TimeoutError):
+        return jsonify({"error": str(failed)}), 504
+    if isinstance(failed, ValueError):
+        return jsonify({"error": str(failed)}), 400
+    if isinstance(failed, UpstreamError):
+        return jsonify({"error": str(failed)}), 503
+    if failed is not None:
+        raise failed
+
+    logistics_info = resolved[0]
+    local_emission = calc_emission(weight, logistics_info["distance"], factors.transport('Local'))
 
     global_emission = 0
     G_logistics_info = None
-    if G_pickup and G_delivery:
-        G_logistics_info = distribution_centre(G_pickup, G_delivery, mode="global")
-        global_emission = calc_emission(weight, G_logistics_info["distance"])
+    if len(resolved) > 1:
+        G_logistics_info = resolved[1]
+        global_emission = calc_emission(weight, G_logistics_info["distance"], factors.transport('Global'))
 
     # Calculate total emissions
     total_emissions = total_emissions + local_emission + global_emission
     old_total_emissions = old_total_emissions + local_emission + global_emission
     new_total_emissions = new_total_emissions + local_emission + global_emission
 
-    # Generate map
-    map_object = folium.Map([logistics_info["Olat"], logistics_info["Olon"]], zoom_start=5)
-    kw = {"opacity": 1.0, "weight": 6}
-
-    locations = [
-        (logistics_info["Olat"], logistics_info["Olon"], "Local Pickup"),
-        (logistics_info["Dlat"], logistics_info["Dlon"], "Local Delivery")
-    ]
-
-    if G_logistics_info:
-        locations.extend([
-            (G_logistics_info["Olat"], G_logistics_info["Olon"], "Global Pickup"),
-            (G_logistics_info["Dlat"], G_logistics_info["Dlon"], "Global Delivery")
-        ])
-
-    for lat, lon, label in locations:
-        folium.Marker(
-            location=[lat, lon],
-            popup=label,
-            icon=folium.Icon(color="blue" if "Pickup" in label else "green")
-        ).add_to(map_object)
-
-    folium.PolyLine(
-        locations=[(lat, lon) for lat, lon, _ in locations],
-        tooltip="Route",
-        color="red",
-        line_cap="round",
-        **kw,
-    ).add_to(map_object)
-
-    return jsonify({
+    result = {
         "weight": weight,
         "manufacturer": manufacturer,
         "part_name": part_name,
@@ -355,11 +378,894 @@ def calculate_emissions():
         'created_emission': created_emissions,
         'logistics_info': logistics_info,
         'G_logistics_info': G_logistics_info,
-        'map_html': map_object._repr_html_(),
         'chart_data': get_chart_data(global_emission, local_emission),
-        'component_chart': component_chart_data
+        'component_chart': component_chart_data,
+        'factors_version': factors.version
+    }
+
+    # Generate map
+    with stage('map'):
+        locations = route_locations(logistics_info, G_logistics_info)
+        map_id = encode_map_id(locations)
+        if map_mode == 'html':
+            result['map_html'] = get_map_html(map_id)
+        elif map_mode == 'geojson':
+            result['map_geojson'] = to_geojson(locations)
+            result['map_id'] = map_id
+            result['map_url'] = url_for('.get_map', map_id=map_id)
+
+    if logistics_info.get('provisional'):
+        # The local leg is an estimate while the router finishes; the next request gets the real route.
+        result['provisional'] = True
+        logistics_info['refine_url'] = url_for(
+            '.get_refined_route', origin=f"{logistics_info['Olat']},{logistics_info['Olon']}",
+            destination=f"{logistics_info['Dlat']},{logistics_info['Dlon']}")
+    elif not fallbacks:
+        # A stale geocode or a route estimated because the router failed is served, not memoized.
+        result_cache.set(cache_key, result)
+    with stage('json'):
+        response = jsonify(result)
+    response.headers['X-Cache'] = 'MISS'
+    return response
+
+
+@api.route('/api/map/<map_id>', methods=['GET'])
+def get_map(map_id):
+    """
+    API endpoint serving the rendered route map of a location set.
+
+    The id (from a calculate response) encodes the locations, so the content
+    never changes for a given URL and browsers may cache it.
+
+    Returns:
+        HTML: folium map document
+
+    Status Codes:
+        200: Success
+        304: Client already has this map
+        400: Malformed map id
+    """
+    if request.if_none_match.contains(map_id):
+        response = Response(status=304)
+    else:
+        try:
+            response = Response(get_map_html(map_id), mimetype='text/html')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    response.set_etag(map_id)
+    response.cache_control.public = True
+    response.cache_control.max_age = config.MAP_MAX_AGE
+    return response
+
+
+def report_response(render, mimetype, filename=None):
+    """
+    Runs a report render and wraps the file it returns.
+
+    Rendered files are addressed by a hash of their content, so the hash is
+    the ETag and a client that already has the file gets a 304.
+
+    Args:
+        render (callable): Returns (bytes, etag) or raises ValueError / ReportUnavailableError
+        mimetype (str): Content type of the file
+        filename (str, optional): Offered as a download under this name
+
+    Returns:
+        Response: The file, 304, or a JSON error with status 400 or 503
+    """
+    try:
+        content, etag = render()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ReportUnavailableError as e:
+        return jsonify({'error': str(e)}), 503
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(content, mimetype=mimetype)
+        if filename:
+            response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.set_etag(etag)
+    return response
+
+
+@api.route('/api/report', methods=['POST'])
+def get_report():
+    """
+    API endpoint rendering the PDF emissions report of a calculation.
+
+    Request Body:
+        The /api/calculate response: final_emission, weight, old_total_emissions,
+        new_total_emissions, component_chart and chart_data are required;
+        manufacturer, part_name, serial_id and equipment_type are printed if present.
+
+    Returns:
+        PDF: One A4 page with the summary, material breakdown and delivery charts
+
+    Status Codes:
+        200: Success
+        304: Client already has this report
+        400: Missing or malformed summary or chart data
+        503: Rendering timed out or its worker crashed
+    """
+    data = request.get_json(silent=True) or {}
+    return report_response(lambda: get_report_renderer().pdf(data), 'application/pdf', 'emissions-report.pdf')
+
+
+@api.route('/api/report/charts', methods=['POST'])
+def get_report_charts():
+    """
+    API endpoint rendering every report chart as an embeddable image.
+
+    Request Body:
+        The /api/calculate response (component_chart and chart_data are used).
+
+    Returns:
+        JSON: Chart kind ("material", "delivery") -> {etag, image}, where image
+        is a PNG data URI
+
+    Status Codes:
+        200: Success
+        400: Missing or malformed chart data
+        503: Rendering timed out or its worker crashed
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(get_report_renderer().chart_data_uris(data))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ReportUnavailableError as e:
+        return jsonify({'error': str(e)}), 503
+
+
+@api.route('/api/report/charts/<kind>.png', methods=['POST'])
+def get_report_chart(kind):
+    """
+    API endpoint rendering one report chart as a PNG.
+
+    Args:
+        kind (str): "material" (bar chart of component_chart) or "delivery"
+            (pie chart of chart_data)
+
+    Request Body:
+        The /api/calculate response, or just the chart's field.
+
+    Returns:
+        PNG: The chart image
+
+    Status Codes:
+        200: Success
+        304: Client already has this chart
+        400: Unknown chart or malformed chart data
+        503: Rendering timed out or its worker crashed
+    """
+    data = request.get_json(silent=True) or {}
+    return report_response(lambda: get_report_renderer().chart(data, kind), 'image/png')
+
+
+@api.route('/api/calculate/cache', methods=['DELETE'])
+def clear_calculate_cache():
+    """
+    API endpoint to drop every cached calculate result.
+
+    Returns:
+        JSON: Result cache statistics after the invalidation
+    """
+    result_cache = get_result_cache()
+    result_cache.invalidate()
+    return jsonify(result_cache.stats())
+
+
+@api.route('/api/calculate/batch', methods=['POST'])
+def calculate_emissions_batch():
+    """
+    API endpoint to calculate emissions for many shipments in one request.
+
+    Request Body:
+        shipments (list): Shipment records with the same fields as /api/calculate.
+            A bare JSON list of records is accepted too.
+
+    Returns:
+        JSON: Dictionary containing:
+            - results: One entry per shipment, in request order. Successful entries
+              carry the /api/calculate fields (without map and charts) plus
+              local_emission and global_emission; failed entries carry "error".
+            - count: Number of shipments
+            - errors: Number of failed shipments
+
+    Status Codes:
+        200: Success (individual shipments may still have failed)
+        400: Body is not a list of shipments
+        413: More than CARBON_BATCH_MAX_SIZE shipments
+    """
+    data = request.get_json(silent=True)
+    shipments = data.get('shipments') if isinstance(data, dict) else data
+    if not isinstance(shipments, list):
+        return jsonify({'error': 'A list of shipments is required'}), 400
+    if len(shipments) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} shipments per batch'}), 413
+
+    results = calculate_batch(shipments)
+
+    return jsonify({
+        'results': results,
+        'count': len(results),
+        'errors': sum(1 for result in results if 'error' in result),
     })
 
 
+@api.route('/api/calculate/stream', methods=['POST'])
+def calculate_emissions_stream():
+    """
+    API endpoint streaming emissions for any number of shipments as NDJSON.
+
+    The body is read line by line while results are written, and at most
+    CARBON_STREAM_MAX_IN_FLIGHT legs are resolving at any time, so a
+    million-row fleet needs no more memory or lookup threads than a hundred-row one.
+
+    Request Body:
+        Newline-delimited JSON (application/x-ndjson): one shipment per line with
+        the same fields as /api/calculate. Blank lines are skipped.
+
+    Returns:
+        NDJSON: One line per shipment in completion order, not input order. Each
+        line carries "index" (the record's position among the non-blank input
+        lines) and either the /api/calculate/batch result fields or "error".
+
+    Status Codes:
+        200: Success (individual shipments may still have failed)
+    """
+    # The raw request stream returns one byte per read when iterated by line.
+    lines = io.BufferedReader(request.stream, buffer_size=1 << 16)
+
+    def generate():
+        # A stream can run for hours; stop collecting stage timings that nobody will read.
+        end_request()
+        for result in stream_batch(parse_ndjson(lines)):
+            yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def client_id():
+    """
+    Identifies the client a job belongs to.
+
+    The per-client job limits are keyed on it, so it is the remote address
+    rather than anything the caller chooses (a fresh header value per
+    request would escape them).
+
+    Returns:
+        str: The remote address
+    """
+    return request.remote_addr or 'unknown'
+
+
+@api.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    API endpoint queuing a calculation to run in the background.
+
+    The request returns as soon as the job is stored; poll GET /api/jobs/<id>
+    or follow GET /api/jobs/<id>/events for progress and results.
+
+    Request Body:
+        shipments (list): Shipment records with the same fields as /api/calculate.
+            A bare JSON list of records is accepted too.
+
+    Returns:
+        JSON: {"id", "state", "total", "status_url", "events_url"}
+
+    Status Codes:
+        202: Job queued
+        400: Body is not a list of shipments
+        413: More than CARBON_JOB_MAX_SIZE shipments
+        429: The client (remote address) already has CARBON_JOB_MAX_ACTIVE_PER_CLIENT unfinished jobs
+    """
+    data = request.get_json(silent=True)
+    shipments = data.get('shipments') if isinstance(data, dict) else data
+    if not isinstance(shipments, list):
+        return jsonify({'error': 'A list of shipments is required'}), 400
+    if len(shipments) > config.JOB_MAX_SIZE:
+        return jsonify({'error': f'At most {config.JOB_MAX_SIZE} shipments per job'}), 413
+
+    try:
+        job_id = get_job_queue().submit(client_id(), shipments)
+    except JobLimitError as e:
+        return jsonify({'error': str(e)}), 429
+
+    status_url = url_for('.get_job', job_id=job_id)
+    response = jsonify({
+        'id': job_id,
+        'state': 'queued',
+        'total': len(shipments),
+        'status_url': status_url,
+        'events_url': url_for('.job_events', job_id=job_id),
+    })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    API endpoint reporting a job's progress, and its results once it has finished.
+
+    Query Parameters:
+        results (str, optional): "0" omits the results of a finished job
+
+    Returns:
+        JSON: id, state ("queued", "running", "done", "failed" or "cancelled"),
+        total, completed, errors, error and created_at/started_at/finished_at;
+        finished jobs add "results", in input order, shaped like the
+        /api/calculate/batch results
+
+    Status Codes:
+        200: Success
+        404: Unknown job
+    """
+    queue = get_job_queue()
+    status = queue.store.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if status['state'] in FINISHED and request.args.get('results') != '0':
+        status['results'] = queue.store.results(job_id)
+    return jsonify(status)
+
+
+@api.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """
+    API endpoint cancelling a queued or running job.
+
+    Results stored before the cancellation are kept.
+
+    Returns:
+        JSON: The job's status
+
+    Status Codes:
+        200: Cancelled (or stopping at its next progress write)
+        404: Unknown job
+        409: The job has already finished
+    """
+    queue = get_job_queue()
+    status = queue.store.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not queue.cancel(job_id):
+        return jsonify({'error': f"Job is already {status['state']}"}), 409
+    return jsonify(queue.store.status(job_id))
+
+
+@api.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    API endpoint following a job's progress as Server-Sent Events.
+
+    Sends a "progress" event with the job's status (without results) at once
+    and after every progress write, and a final "done" event when the job
+    finishes, then closes the stream; progress of a job running in another
+    worker process shows within CARBON_JOB_POLL_INTERVAL seconds. A comment
+    line is sent every CARBON_JOB_EVENTS_HEARTBEAT seconds without progress
+    to keep proxies from dropping the connection.
+
+    Returns:
+        text/event-stream: Events whose data is the job status as JSON
+
+    Status Codes:
+        200: Success
+        404: Unknown job
+    """
+    queue = get_job_queue()
+    if queue.store.status(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        end_request()
+        version, last, sent = 0, None, time.monotonic()
+        while True:
+            # The job may run in another worker process, so the database is re-read at least every
+            # CARBON_JOB_POLL_INTERVAL seconds; progress made in this process wakes the loop at once.
+            status = queue.store.status(job_id)
+            finished = status['state'] in FINISHED
+            if finished or status != last:
+                yield f"event: {'done' if finished else 'progress'}\ndata: {json.dumps(status)}\n\n"
+                if finished:
+                    return
+                last, sent = status, time.monotonic()
+            elif time.monotonic() - sent >= config.JOB_EVENTS_HEARTBEAT:
+                yield ': keep-alive\n\n'
+                sent = time.monotonic()
+            version = queue.wait(job_id, version, config.JOB_POLL_INTERVAL)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api.route('/api/distance-matrix', methods=['POST'])
+def distance_matrix():
+    """
+    API endpoint returning great-circle distances between every origin and destination.
+
+    The matrix is computed in bounded-memory blocks and streamed, so large
+    requests (10k x 10k) never hold the whole result in memory.
+
+    Request Body:
+        origins (list): Location names, [lat, lon] pairs or {"lat", "lon"} objects
+        destinations (list): Same formats as origins
+        format (str, optional): "json" (default) or "binary"
+
+    Returns:
+        JSON: {"origins": N, "destinations": M, "distances": [[km, ...], ...]}, one row per origin
+        binary: Row-major little-endian float32 values, shape in the X-Matrix-Shape header
+
+    Status Codes:
+        200: Success
+        400: Missing or invalid points
+        413: More than CARBON_DISTANCE_MATRIX_MAX_POINTS origins or destinations
+    """
+    data = request.get_json(silent=True) or {}
+    origins = data.get('origins')
+    destinations = data.get('destinations')
+    output_format = data.get('format', 'json')
+    if not isinstance(origins, list) or not isinstance(destinations, list) or not origins or not destinations:
+        return jsonify({'error': 'origins and destinations are required'}), 400
+    if output_format not in ('json', 'binary'):
+        return jsonify({'error': 'format must be "json" or "binary"'}), 400
+    limit = config.DISTANCE_MATRIX_MAX_POINTS
+    if len(origins) > limit or len(destinations) > limit:
+        return jsonify({'error': f'At most {limit} origins and {limit} destinations'}), 413
+
+    try:
+        lat1, lon1 = resolve_points(origins)
+        lat2, lon2 = resolve_points(destinations)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if output_format == 'binary':
+        def generate_binary():
+            for _, block in iter_haversine_matrix(lat1, lon1, lat2, lon2, dtype=np.dtype('<f4')):
+                yield block.tobytes()
+
+        response = Response(stream_with_context(generate_binary()), mimetype='application/octet-stream')
+        response.headers['X-Matrix-Shape'] = f'{len(lat1)},{len(lat2)}'
+        response.headers['X-Matrix-Dtype'] = 'float32'
+        return response
+
+    def generate_json():
+        yield json.dumps({'origins': len(lat1), 'destinations': len(lat2)})[:-1] + ', "distances": ['
+        first = True
+        for _, block in iter_haversine_matrix(lat1, lon1, lat2, lon2):
+            for row in block.tolist():
+                yield ('' if first else ',') + json.dumps(row)
+                first = False
+        yield ']}'
+
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
+
+
+@api.route('/api/route/refined', methods=['GET'])
+def get_refined_route():
+    """
+    API endpoint long-polling for the real route of a leg answered provisionally.
+
+    Query Parameters:
+        origin (str): "lat,lon" of the start
+        destination (str): "lat,lon" of the end
+        wait (float, optional): Seconds to wait for the router (default 10, at most 30)
+
+    Returns:
+        JSON: {"distance", "duration", "source"} of the cached route
+
+    Status Codes:
+        200: Success
+        202: The router has not answered yet (or failed); try again later
+        400: Missing or invalid coordinates
+    """
+    try:
+        origin = tuple(float(c) for c in request.args['origin'].split(','))
+        destination = tuple(float(c) for c in request.args['destination'].split(','))
+        wait = min(max(float(request.args.get('wait', 10)), 0.0), 30.0)
+        if len(origin) != 2 or len(destination) != 2:
+            raise ValueError
+    except (KeyError, ValueError):
+        return jsonify({'error': 'origin and destination must be "lat,lon"'}), 400
+
+    route = get_route_service().refined(origin, destination, timeout=wait)
+    if route is None:
+        return jsonify({'provisional': True}), 202
+    return jsonify(route)
+
+
+@api.route('/api/route/multimodal', methods=['POST'])
+def multimodal_route():
+    """
+    API endpoint finding the lowest-emission road/rail/sea/air path between two places.
+
+    The path runs over the hub graph in data/hubs.json, whose link distances
+    are precomputed, so only the pickup and delivery are looked up per request.
+
+    Request Body:
+        pickup: Location name, [lat, lon] pair or {"lat", "lon"} object
+        delivery: Same formats as pickup
+        weight (float, optional): Cargo weight; required unless the part is given
+        manufacturer, part_name, serial_id (str, optional): Part whose weight is used
+        modes (list, optional): Modes allowed between hubs, e.g. ["road", "rail", "sea"];
+            road is always allowed for the first and last mile
+
+    Returns:
+        JSON: Dictionary containing:
+            - legs: from, to, mode, Olat/Olon/Dlat/Dlon, distance (km), duration (h) and
+              emission of each leg, in travel order
+            - distance, duration, emission: Totals of the legs
+            - direct: The all-road leg, for comparison (null beyond CARBON_MULTIMODAL_DIRECT_MAX_KM)
+            - saving: direct emission minus the path's emission (null without direct)
+            - weight, factors_version, graph_version
+
+    Status Codes:
+        200: Success
+        400: Missing or invalid locations, weight or modes, or no path between them
+        404: Part not found
+    """
+    data = request.get_json(silent=True) or {}
+    if not data.get('pickup') or not data.get('delivery'):
+        return jsonify({'error': 'pickup and delivery are required'}), 400
+
+    graph = get_hub_graph()
+    modes = data.get('modes')
+    if modes is not None:
+        if not isinstance(modes, list) or not set(modes) <= set(graph.modes):
+            return jsonify({'error': f"modes must be a list drawn from {', '.join(graph.modes)}"}), 400
+
+    weight = data.get('weight')
+    if weight is None:
+        part = get_catalog().get_part(data.get('manufacturer'), data.get('part_name'), data.get('serial_id'))
+        if part is None:
+            return jsonify({'error': 'Part not found'}), 404
+        weight = part['weight']
+    try:
+        weight = float(weight)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'weight must be a number'}), 400
+    try:
+        (o_lat, d_lat), (o_lon, d_lon) = resolve_points([data['pickup'], data['delivery']])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    factors = get_factor_registry().current()
+    try:
+        with stage('multimodal'):
+            plan = plan_route(graph, (o_lat, o_lon), (d_lat, d_lon), weight, factors, modes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    plan['saving'] = plan['direct']['emission'] - plan['emission'] if plan['direct'] else None
+    plan['weight'] = weight
+    plan['factors_version'] = factors.version
+    plan['graph_version'] = graph.version
+    return jsonify(plan)
+
+
+@api.route('/api/depots/nearest', methods=['GET'])
+def nearest_depots():
+    """
+    API endpoint listing the depots closest to a location.
+
+    Query Parameters:
+        location (str, optional): Location name to geocode
+        lat, lon (float, optional): Coordinates, instead of location
+        k (int, optional): Maximum number of depots (default 5, at most CARBON_DEPOTS_MAX_RESULTS)
+        radius_km (float, optional): Only depots within this great-circle distance
+
+    Returns:
+        JSON: {"lat", "lon", "version", "depots": [{id, name, lat, lon, distance}, ...]}, nearest first
+
+    Status Codes:
+        200: Success
+        400: Missing or invalid location, k or radius
+    """
+    try:
+        k = int(request.args.get('k', 5))
+        radius_km = request.args.get('radius_km', type=float)
+    except ValueError:
+        return jsonify({'error': 'k must be an integer and radius_km a number'}), 400
+    if k < 1 or (radius_km is not None and not (math.isfinite(radius_km) and radius_km >= 0)):
+        return jsonify({'error': 'k must be positive and radius_km non-negative'}), 400
+    if request.args.get('location'):
+        try:
+            lat, lon = geography(request.args['location'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        try:
+            lat, lon = float(request.args['lat']), float(request.args['lon'])
+        except KeyError:
+            return jsonify({'error': 'location or lat and lon are required'}), 400
+        except ValueError:
+            lat = lon = math.nan
+        if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+            return jsonify({'error': 'lat must be a number in [-90, 90] and lon in [-180, 180]'}), 400
+
+    index = get_depot_index()
+    with stage('depot_lookup'):
+        depots = index.nearest(lat, lon, min(k, config.DEPOTS_MAX_RESULTS), radius_km)
+    return jsonify({'lat': lat, 'lon': lon, 'version': index.version, 'depots': depots})
+
+
+@api.route('/api/whatif', methods=['POST'])
+def whatif_sweep():
+    """
+    API endpoint sweeping the reuse-or-replace decision over parameter grids.
+
+    Every part of the catalog (or of one manufacturer) is evaluated at every
+    combination of the grid values; reusing the old unit wins where its used
+    hours are below the break-even (lifetime + weight x f x (new_distance -
+    old_distance)) / rate, f being the transport factor of the mode.
+
+    Request Body:
+        grid (dict, optional): Axes, each a list of numbers or {"start", "stop", "num"}:
+            used_hours (defaults to each part's own used hours), lifetime and rate
+            (default to the current constants), old_distance and new_distance in km
+            (default 0)
+        mode (str, optional): Transport factor of the distances (default "Local")
+        manufacturer (str, optional): Only this manufacturer's parts
+        detail (bool, optional): Add every part's break-even grid, shaped
+            (lifetime, rate, old_distance, new_distance)
+
+    Returns:
+        JSON: parts, cells, axes, reuse_share (of all cells),
+        reuse_share_by_used_hours (with a used_hours grid), break_even_used_hours
+        (min, median, max over the fleet), baseline_break_even_used_hours (current
+        constants, equal distances) and results per part (key, weight, used_hours,
+        break_even_used_hours min/median/max, reuse_share, reuse_now)
+
+    Status Codes:
+        200: Success
+        400: Invalid grid, mode or manufacturer
+        404: No parts (unknown manufacturer or empty inventory)
+        413: More than CARBON_WHATIF_MAX_POINTS break-even points, or detail over
+            CARBON_WHATIF_MAX_DETAIL_POINTS
+    """
+    data = request.get_json(silent=True) or {}
+    grid = data.get('grid') or {}
+    if not isinstance(grid, dict) or set(grid) - set(whatif.AXES):
+        return jsonify({'error': f"grid axes must be among {', '.join(whatif.AXES)}"}), 400
+    factors = get_factor_registry().current()
+    defaults = {
+        'lifetime': [factors.constants['lifetime_emissions']],
+        'rate': [factors.constants['emission_rate_per_hour']],
+        'old_distance': [0],
+        'new_distance': [0],
+    }
+    try:
+        axes = {name: whatif.parse_axis(name, grid.get(name, defaults.get(name)), config.WHATIF_MAX_AXIS_POINTS)
+                for name in whatif.AXES if name in grid or name in defaults}
+        transport_factor = factors.transport(data.get('mode', 'Local'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except KeyError:
+        return jsonify({'error': f"Unknown mode: {data.get('mode')}"}), 400
+
+    with stage('fleet'):
+        fleet = get_fleet()
+        where = {'manufacturer': data['manufacturer']} if data.get('manufacturer') is not None else None
+        try:
+            rows = np.flatnonzero(fleet.mask(where))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    if not rows.size:
+        return jsonify({'error': 'No parts found'}), 404
+    points = rows.size * int(np.prod([axes[name].size for name in whatif.AXES[1:]]))
+    if points > config.WHATIF_MAX_POINTS:
+        return jsonify({'error': f"{points} break-even points; at most {config.WHATIF_MAX_POINTS}"}), 413
+    if data.get('detail') and points > config.WHATIF_MAX_DETAIL_POINTS:
+        return jsonify({'error': f"detail is limited to {config.WHATIF_MAX_DETAIL_POINTS} break-even points"}), 413
+
+    with stage('whatif'):
+        weight = np.nan_to_num(fleet.numeric['weight'][rows])
+        used_hours = np.nan_to_num(fleet.numeric['used_hours'][rows])
+        swept = whatif.sweep(weight, used_hours, axes, transport_factor)
+        per_part = swept['break_even'].reshape(rows.size, -1)
+        low, median, high = per_part.min(axis=1), np.median(per_part, axis=1), per_part.max(axis=1)
+        share = swept['reuse_cells'] / swept['cells_per_part']
+        baseline = whatif.break_even_hours(0, *defaults['lifetime'], *defaults['rate'], 0, 0, transport_factor)
+
+    keys = zip(*(fleet.decode(name, fleet.codes[name][rows]) for name in ('manufacturer', 'part_name', 'serial_id')))
+    results = []
+    for i, (manufacturer, part_name, serial_id) in enumerate(keys):
+        result = {
+            'manufacturer': manufacturer,
+            'part_name': part_name,
+            'serial_id': serial_id,
+            'weight': float(weight[i]),
+            'used_hours': float(used_hours[i]),
+            'break_even_used_hours': {'min': float(low[i]), 'median': float(median[i]), 'max': float(high[i])},
+            'reuse_share': float(share[i]),
+            'reuse_now': bool(used_hours[i] < baseline),
+        }
+        if data.get('detail'):
+            result['break_even_grid'] = swept['break_even'][i].tolist()
+        results.append(result)
+
+    cells = rows.size * swept['cells_per_part']
+    response = {
+        'parts': int(rows.size),
+        'cells': cells,
+        'mode': data.get('mode', 'Local'),
+        'transport_factor': transport_factor,
+        'factors_version': factors.version,
+        'axes': {name: values.tolist() for name, values in axes.items()},
+        'reuse_share': float(swept['reuse_cells'].sum() / cells),
+        'break_even_used_hours': {'min': float(low.min()), 'median': float(np.median(per_part)),
+                                  'max': float(high.max())},
+        'baseline_break_even_used_hours': float(baseline),
+        'results': results,
+    }
+    if 'reuse_by_used_hours' in swept:
+        response['reuse_share_by_used_hours'] = (swept['reuse_by_used_hours'] / per_part.size).tolist()
+    return jsonify(response)
+
+
+@api.route('/api/fleet/query', methods=['POST'])
+def fleet_query():
+    """
+    API endpoint filtering, grouping and aggregating the inventory.
+
+    Runs on the columnar fleet model, so a query over the whole inventory
+    costs a few array passes and no database access.
+
+    Request Body:
+        where (dict, optional): Column -> condition; a text column (manufacturer,
+            part_name, serial_id, drive_type, fuel_type) takes a value or a list of
+            values, a numeric column a number or {"min": ..., "max": ...}
+        group_by (list, optional): Text columns to group by; omitted for fleet-wide totals
+        aggregates (list, optional): "count" or "<sum|mean|min|max>:<numeric column>",
+            e.g. "sum:weight" (default ["count"])
+        order_by (str, optional): Group column or aggregate field ("sum_weight") to
+            sort by, "-" prefixed for descending (default: largest groups first)
+        limit (int, optional): Maximum number of groups (at most CARBON_FLEET_MAX_GROUPS)
+
+    Returns:
+        JSON: rows (matching parts), groups (total number of groups), truncated and
+        results, one dict per group with its group_by values and aggregate fields
+
+    Status Codes:
+        200: Success
+        400: Unknown column, aggregate or order_by field, or malformed condition
+    """
+    data = request.get_json(silent=True) or {}
+    where = data.get('where') or {}
+    group_by = data.get('group_by') or []
+    aggregates = data.get('aggregates') or ['count']
+    limit = data.get('limit', config.FLEET_MAX_GROUPS)
+    if not isinstance(where, dict):
+        return jsonify({'error': 'where must be an object'}), 400
+    if not isinstance(group_by, list) or not isinstance(aggregates, list) or \
+            not all(isinstance(item, str) for item in group_by + aggregates):
+        return jsonify({'error': 'group_by and aggregates must be lists of strings'}), 400
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= config.FLEET_MAX_GROUPS:
+        return jsonify({'error': f"limit must be between 1 and {config.FLEET_MAX_GROUPS}"}), 400
+
+    with stage('fleet'):
+        fleet = get_fleet()
+        try:
+            selected = fleet.mask(where)
+            results = fleet.query(selected, group_by, aggregates, data.get('order_by'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'rows': int(np.count_nonzero(selected)),
+        'groups': len(results),
+        'truncated': len(results) > limit,
+        'results': results[:limit],
+    })
+
+
+@api.route('/api/factors', methods=['GET'])
+def get_factors():
+    """
+    API endpoint listing the emission factors currently in use.
+
+    Returns:
+        JSON: version plus constants, fuels (kg CO2 per unit of fuel) and modes (multipliers)
+
+    Status Codes:
+        200: Success
+        304: Client already has this version
+    """
+    factors = get_factor_registry().current()
+    if request.if_none_match.contains(factors.version):
+        response = Response(status=304)
+    else:
+        response = jsonify(factors.to_dict())
+    response.set_etag(factors.version)
+    response.cache_control.no_cache = True
+    return response
+
+
+@api.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Liveness probe: answers as soon as the process serves requests.
+
+    Returns:
+        JSON: {"status": "ok", "pid": ...}
+    """
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+
+@api.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    Readiness probe: answers 200 only once the startup warm-up has loaded the
+    catalog, factors, depots, hub graph and geocode snapshot.
+
+    Returns:
+        JSON: ready, state, per-step seconds and sizes, error, seconds and pid
+
+    Status Codes:
+        200: Ready for traffic
+        503: Still warming up, or a warm-up step failed
+    """
+    return jsonify(serving.status()), 200 if serving.is_ready() else 503
+
+
+@api.route('/api/stats', methods=['GET'])
+def get_stats():
+    """
+    API endpoint exposing geocode, routing, database, catalog and cache statistics.
+
+    Returns:
+        JSON: Dictionary of statistics per subsystem (geocode and route caches, router calls, database pool and query times, catalog, map and result caches, ...)
+    """
+    return jsonify(collect_stats())
+
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus scrape endpoint.
+
+    Serves request and per-stage duration histograms plus the /api/stats
+    counters (upstream calls and errors, cache hits and hit ratios, database
+    timings) in the text exposition format.
+
+    Status Codes:
+        200: Success
+        404: Metrics are disabled (CARBON_METRICS=0)
+    """
+    if not config.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(render_metrics(collect_stats()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def collect_stats():
+    """
+    Gathers the statistics of every subsystem.
+
+    Returns:
+        dict: Subsystem name -> statistics dict
+    """
+    return {
+        'geocode': get_geocoder().stats(),
+        'routing': get_route_service().stats(),
+        'database': get_database().stats_dict(),
+        'catalog': get_catalog().stats(),
+        'fleet': get_fleet().stats(),
+        'maps': map_cache_stats(),
+        'results': get_result_cache().stats(),
+        'reports': get_report_renderer().stats(),
+        'factors': get_factor_registry().stats(),
+        'hubs': hub_graph_stats(),
+        'depots': get_depot_index().stats(),
+        'jobs': get_job_queue().stats(),
+        'upstreams': upstream_stats(),
+        'serving': serving.status(),
+    }
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
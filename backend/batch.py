@@ -0,0 +1,394 @@
+"""
+Fleet-sized emission calculation.
+
+``calculate_batch`` prices many shipments in one pass: each distinct part is
+looked up once in the inventory catalog, each distinct leg is geocoded and routed
+once (a few legs at a time, concurrently), and the emission math runs as NumPy array operations. A shipment that
+fails (missing field, unknown part, unresolvable location) gets an inline
+error and does not affect the others.
+
+``stream_batch`` is the unbounded counterpart: a generator pipeline (parse,
+part lookup, leg resolution, emission math) that keeps at most
+``max_in_flight`` legs resolving and yields each result as soon as its legs
+resolve, so memory and lookup pool use stay flat however long the input is.
+"""
+import json
+import queue
+import threading
+import time
+
+import config
+from catalog import get_catalog
+from emissions import fleet_emissions
+from factors import current_factors
+from geocode import normalize_query
+from logistics import resolve_legs, submit_leg
+from lru import LRUCache
+
+MAX_BATCH_SIZE = config.BATCH_MAX_SIZE
+REQUIRED_FIELDS = ('manufacturer', 'part_name', 'serial_id', 'equipment_type', 'pickup')
+# Fields used as lookup keys; anything but a string (a list, say) would break the lookups.
+TEXT_FIELDS = ('manufacturer', 'part_name', 'serial_id', 'pickup', 'delivery', 'G_pickup', 'G_delivery')
+
+# Geocode futures remembered by a stream so repeated names in flight share one lookup.
+STREAM_GEOCODE_FUTURES = 4096
+
+def lookup_parts(keys):
+    """
+    Looks up many inventory parts in the in-memory catalog.
+
+    Args:
+        keys (iterable): (manufacturer, part_name, serial_id) tuples
+
+    Returns:
+        dict: Rows keyed by (manufacturer, part_name, serial_id); unknown keys are absent
+    """
+    catalog = get_catalog()
+    parts = {}
+    for key in dict.fromkeys(keys):
+        part = catalog.get_part(*key)
+        if part is not None:
+            parts[key] = part
+    return parts
+
+
+def leg_key(pickup, delivery, mode):
+    """
+    Builds the deduplication key of a leg.
+
+    Args:
+        pickup (str): Pickup location name
+        delivery (str): Delivery location name, or None for the nearest depot
+        mode (str): "local" or "global"
+
+    Returns:
+        tuple: Normalized (pickup, delivery, mode)
+    """
+    return (normalize_query(pickup), None if delivery is None else normalize_query(delivery), mode)
+
+
+def resolve_batch_legs(legs, max_in_flight=config.BATCH_MAX_IN_FLIGHT):
+    """
+    Resolves a batch's legs in groups of ``max_in_flight``, each group with its own lookup deadline.
+
+    Submitting every leg at once would put the whole batch under one
+    deadline (cold names queue behind Nominatim's rate limit and time out)
+    and fill the lookup pool ahead of interactive requests. Names already
+    geocoded by an earlier group come from the geocode cache.
+
+    Args:
+        legs (dict): Leg key -> (pickup, delivery, mode)
+        max_in_flight (int): Legs resolving at once
+
+    Returns:
+        dict: Leg key -> distribution_centre() dict or the exception that prevented resolving it
+    """
+    items = list(legs.items())
+    resolved = {}
+    for start in range(0, len(items), max(1, max_in_flight)):
+        group = items[start:start + max_in_flight]
+        resolved.update(zip((key for key, _ in group), resolve_legs([leg for _, leg in group])))
+    return resolved
+
+
+def calculate_batch(shipments):
+    """
+    Calculates emissions for a list of shipments.
+
+    Args:
+        shipments (list): Shipment dicts with the /api/calculate request fields
+
+    Returns:
+        list: One result dict per shipment, in input order. Failed shipments
+        hold "index" and "error" instead of the emission fields.
+    """
+    results = [None] * len(shipments)
+    pending = []
+    legs = {}
+
+    for index, shipment in enumerate(shipments):
+        error = check_shipment(index, shipment)
+        if error is not None:
+            results[index] = error
+            continue
+        local_key = leg_key(shipment['pickup'], shipment.get('delivery'), 'local')
+        legs.setdefault(local_key, (shipment['pickup'], shipment.get('delivery'), 'local'))
+        global_key = None
+        if shipment.get('G_pickup') and shipment.get('G_delivery'):
+            global_key = leg_key(shipment['G_pickup'], shipment['G_delivery'], 'global')
+            legs.setdefault(global_key, (shipment['G_pickup'], shipment['G_delivery'], 'global'))
+        pending.append((index, shipment, local_key, global_key))
+
+    parts = lookup_parts([(s['manufacturer'], s['part_name'], s['serial_id']) for _, s, _, _ in pending])
+    resolved = resolve_batch_legs(legs)
+
+    rows = []
+    for index, shipment, local_key, global_key in pending:
+        part = parts.get((shipment['manufacturer'], shipment['part_name'], shipment['serial_id']))
+        if part is None:
+            results[index] = {'index': index, 'error': 'Part not found'}
+            continue
+        logistics_info = resolved[local_key]
+        G_logistics_info = resolved[global_key] if global_key else None
+        failed = next((leg for leg in (logistics_info, G_logistics_info) if isinstance(leg, Exception)), None)
+        if failed is not None:
+            results[index] = {'index': index, 'error': str(failed)}
+            continue
+        rows.append((index, shipment, part, logistics_info, G_logistics_info))
+
+    for result in emission_results(rows):
+        results[result['index']] = result
+    return results
+
+
+def check_shipment(index, shipment):
+    """
+    Validates the shape of one shipment record.
+
+    Args:
+        index (int): Position of the shipment in the input
+        shipment: Parsed record
+
+    Returns:
+        dict | None: An inline error result, or None if the record is usable
+    """
+    if isinstance(shipment, Exception):
+        return {'index': index, 'error': str(shipment)}
+    if not isinstance(shipment, dict):
+        return {'index': index, 'error': 'Shipment must be an object'}
+    missing = [field for field in REQUIRED_FIELDS if not shipment.get(field)]
+    if missing:
+        return {'index': index, 'error': f"Missing fields: {', '.join(missing)}"}
+    invalid = [field for field in TEXT_FIELDS
+               if shipment.get(field) is not None and not isinstance(shipment[field], str)]
+    if invalid:
+        return {'index': index, 'error': f"Fields must be strings: {', '.join(invalid)}"}
+    return None
+
+
+def emission_results(rows):
+    """
+    Runs the vectorized emission math for shipments whose part and legs are known.
+
+    Args:
+        rows (list): (index, shipment, part, logistics_info, G_logistics_info) tuples
+
+    Returns:
+        list: One result dict per row, in row order
+    """
+    if not rows:
+        return []
+
+    factors = current_factors()
+    totals = fleet_emissions(
+        manufacturing_emission=[part['manufacturing_emission'] for _, _, part, _, _ in rows],
+        weight=[part['weight'] for _, _, part, _, _ in rows],
+        used_hours=[part['used_hours'] for _, _, part, _, _ in rows],
+        is_old=[shipment['equipment_type'] == 'Old' for _, shipment, _, _, _ in rows],
+        local_distance=[local['distance'] for _, _, _, local, _ in rows],
+        global_distance=[glob['distance'] if glob else 0.0 for _, _, _, _, glob in rows],
+        factors=factors,
+        fuel_type=[part['fuel_type'] for _, _, part, _, _ in rows],
+    )
+    columns = {field: values.tolist() for field, values in totals.items()}
+
+    results = []
+    for position, (index, shipment, part, logistics_info, G_logistics_info) in enumerate(rows):
+        result = {
+            'index': index,
+            'weight': part['weight'],
+            'manufacturer': shipment['manufacturer'],
+            'part_name': shipment['part_name'],
+            'serial_id': shipment['serial_id'],
+            'equipment_type': shipment['equipment_type'],
+            'logistics_info': logistics_info,
+            'G_logistics_info': G_logistics_info,
+            'factors_version': factors.version,
+        }
+        for field, values in columns.items():
+            result[field] = values[position]
+        results.append(result)
+    return results
+
+
+def parse_ndjson(lines):
+    """
+    Parses newline-delimited JSON records lazily.
+
+    Args:
+        lines (iterable): Lines as bytes or str; blank lines are skipped
+
+    Yields:
+        tuple: (index, record), where record is a ValueError for a line that is not valid JSON
+    """
+    index = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = ValueError('Invalid JSON')
+        yield index, record
+        index += 1
+
+
+def stream_batch(records, max_in_flight=config.STREAM_MAX_IN_FLIGHT, timeout=config.LOOKUP_DEADLINE):
+    """
+    Calculates emissions for a stream of shipments, yielding results as they complete.
+
+    Records are consumed on a reader thread, and only while fewer than
+    ``max_in_flight`` legs are unfinished (a leg has at most two tasks on the
+    lookup pool); the generator itself waits on one queue for both new
+    records and resolved legs, so a result is yielded as soon as its legs
+    resolve even if the input is slow. Each shipment's lookups must finish
+    within ``timeout`` seconds of being started: past that its lookups that
+    have not started are cancelled and it is reported as timed out, but its
+    legs keep their slots until the lookups already running have finished.
+
+    Args:
+        records (iterable): (index, shipment) pairs, e.g. from parse_ndjson()
+        max_in_flight (int): Legs started but not yet resolved
+        timeout (float): Seconds allowed for one shipment's lookups
+
+    Yields:
+        dict: One result per shipment in completion order, shaped like the
+        calculate_batch() entries and carrying "index"
+
+    Raises:
+        Exception: Whatever reading ``records`` raised
+    """
+    catalog = get_catalog()
+    geocodes = LRUCache(STREAM_GEOCODE_FUTURES)
+    events = queue.Queue()
+    max_in_flight = max(1, max_in_flight)
+    slots = threading.Semaphore(max_in_flight)
+    stop = threading.Event()
+    in_flight = {}  # index -> (shipment, part, legs, deadline, slots held), oldest first
+    abandoned = {}  # index -> slots held by a timed-out shipment whose lookups are still running
+
+    def needed(shipment):
+        """Slots a record holds: one per leg it will start."""
+        legs = 2 if isinstance(shipment, dict) and shipment.get('G_pickup') and shipment.get('G_delivery') else 1
+        return min(legs, max_in_flight)
+
+    def read():
+        try:
+            for index, shipment in records:
+                held = needed(shipment)
+                for _ in range(held):
+                    while not slots.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                if stop.is_set():
+                    return
+                events.put(('record', (index, shipment, held)))
+        except Exception as e:
+            events.put(('failed', e))
+        finally:
+            events.put(('end', None))
+
+    def track(index, legs):
+        remaining = [len(legs)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            events.put(('resolved', index))
+
+        for leg in legs:
+            leg.add_done_callback(done)
+
+    def start(index, shipment, held):
+        """Looks up the part and submits the legs; returns an error result or None."""
+        error = check_shipment(index, shipment)
+        if error is None:
+            part = catalog.get_part(shipment['manufacturer'], shipment['part_name'], shipment['serial_id'])
+            if part is None:
+                error = {'index': index, 'error': 'Part not found'}
+        if error is not None:
+            slots.release(held)
+            return error
+        legs = [submit_leg(shipment['pickup'], shipment.get('delivery'), 'local', geocodes)]
+        if shipment.get('G_pickup') and shipment.get('G_delivery'):
+            legs.append(submit_leg(shipment['G_pickup'], shipment['G_delivery'], 'global', geocodes))
+        in_flight[index] = (shipment, part, legs, time.monotonic() + timeout, held)
+        track(index, legs)
+        return None
+
+    def finish(index, rows):
+        """Queues a resolved shipment for the emission math; returns an error result or None."""
+        if index in abandoned:
+            slots.release(abandoned.pop(index))  # already reported as timed out
+            return None
+        shipment, part, legs, _, held = in_flight.pop(index)
+        slots.release(held)
+        failed = next((leg.exception() for leg in legs if leg.exception() is not None), None)
+        if failed is not None:
+            return {'index': index, 'error': str(failed)}
+        resolved = [leg.result() for leg in legs]
+        rows.append((index, shipment, part, resolved[0], resolved[1] if len(resolved) > 1 else None))
+        return None
+
+    def expire():
+        """Abandons the shipments past their deadline; returns their error results."""
+        now = time.monotonic()
+        errors = []
+        for index, (shipment, _, legs, deadline, held) in list(in_flight.items()):
+            if deadline > now:
+                break  # started in order, so the rest are younger
+            if all(leg.done() for leg in legs):
+                continue  # resolved in time; its event is already queued
+            del in_flight[index]
+            abandoned[index] = held
+            for leg in legs:
+                leg.abandon()
+            errors.append({
+                'index': index,
+                'error': f"Lookups for {shipment['pickup']!r} -> {shipment.get('delivery') or 'nearest depot'!r} timed out",
+            })
+        return errors
+
+    reader = threading.Thread(target=read, name='stream-reader', daemon=True)
+    reader.start()
+    ended = False
+    try:
+        while not ended or in_flight or abandoned:
+            # Every pass, not only when the queue is idle: a busy stream always has another event.
+            yield from expire()
+            deadlines = [entry[3] for entry in in_flight.values() if not all(leg.done() for leg in entry[2])]
+            wait = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                batch = [events.get(timeout=wait)]
+            except queue.Empty:
+                continue
+            # Take whatever else is queued so the emission math runs once per burst.
+            while True:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+
+            rows = []
+            for kind, value in batch:
+                if kind == 'record':
+                    error = start(*value)
+                elif kind == 'resolved':
+                    error = finish(value, rows)
+                elif kind == 'failed':
+                    raise value
+                else:
+                    ended = True
+                    continue
+                if error is not None:
+                    yield error
+            yield from emission_results(rows)
+    finally:
+        stop.set()
+        # Closed early (client gone, job cancelled): nobody will read the rest.
+        for _, _, legs, _, _ in in_flight.values():
+            for leg in legs:
+                leg.abandon()
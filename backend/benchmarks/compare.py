@@ -0,0 +1,112 @@
+"""
+Compares two benchmark result files and flags regressions.
+
+Works with the JSON written by ``startup.py``, ``load.py`` and ``micro.py``.
+Timing and memory metrics (names containing ``seconds``, ``ms`` or ``mib``,
+e.g. ``p95_ms`` or ``rss_mib_median``) are better when lower; throughput
+metrics (``*_per_second``) are better when higher.
+Other numbers are shown for context but never count as regressions. The exit
+status is 1 when any metric got worse by more than ``--threshold`` percent.
+
+Usage:
+    python benchmarks/compare.py baseline.json candidate.json [--threshold 10]
+"""
+import argparse
+import json
+
+LOWER_IS_BETTER = {'seconds', 'ms', 'mib'}
+HIGHER_IS_BETTER = '_per_second'
+
+
+def flatten(data, prefix=''):
+    """
+    Flattens nested result dicts into dotted metric names.
+
+    Args:
+        data (dict): Parsed result file
+        prefix (str): Name prefix of this level
+
+    Returns:
+        dict: Metric name -> number
+    """
+    metrics = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def direction(name):
+    """
+    Tells whether a metric should go down or up.
+
+    Args:
+        name (str): Dotted metric name
+
+    Returns:
+        int: -1 if lower is better, 1 if higher is better, 0 if neither
+    """
+    metric = name.rsplit('.', 1)[-1]
+    if metric.endswith(HIGHER_IS_BETTER):
+        return 1
+    if LOWER_IS_BETTER & set(metric.split('_')):
+        return -1
+    return 0
+
+
+def compare(baseline, candidate, threshold):
+    """
+    Compares the metrics two result files have in common.
+
+    Args:
+        baseline (dict): Parsed baseline results
+        candidate (dict): Parsed candidate results
+        threshold (float): Percent change treated as a regression
+
+    Returns:
+        list: (name, baseline value, candidate value, percent change, verdict) tuples,
+        where verdict is "regression", "improvement" or ""
+    """
+    before = flatten(baseline)
+    after = flatten(candidate)
+    rows = []
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        change = (new - old) / old * 100 if old else 0.0
+        better = direction(name)
+        verdict = ''
+        if better and abs(change) > threshold:
+            verdict = 'improvement' if change * better > 0 else 'regression'
+        rows.append((name, old, new, change, verdict))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline', help='result file of the reference run')
+    parser.add_argument('candidate', help='result file of the run to check')
+    parser.add_argument('--threshold', type=float, default=10, help='percent change treated as a regression (default 10)')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline.get('benchmark') != candidate.get('benchmark'):
+        parser.error(f"cannot compare a {baseline.get('benchmark')!r} run with a {candidate.get('benchmark')!r} run")
+
+    rows = compare(baseline, candidate, args.threshold)
+    width = max((len(name) for name, *_ in rows), default=10)
+    for name, old, new, change, verdict in rows:
+        print(f"{name:<{width}}  {old:>14.6g}  {new:>14.6g}  {change:>+8.1f}%  {verdict}")
+
+    regressions = [row for row in rows if row[4] == 'regression']
+    print(f"{len(regressions)} regression(s) beyond {args.threshold:g}%")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
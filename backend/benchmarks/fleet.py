@@ -0,0 +1,210 @@
+"""
+Benchmarks the columnar fleet model against row-at-a-time SQLite access.
+
+Builds a synthetic inventory of the given size in a temporary database, then
+measures the memory held per part by a fetched list of ``sqlite3.Row`` and
+by the fleet table, the load time of both, the time to write a snapshot and
+to open it memory-mapped, and a few dashboard-style queries run as SQL and
+as fleet queries. The fleet answers are checked against SQL.
+
+Usage:
+    python benchmarks/fleet.py [--parts 200000] [--repeat 5] [--json fleet.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database_py.migrations import INVENTORY_COLUMNS
+from db import Database
+from fleet import FleetTable
+
+MANUFACTURERS = ('Caterpillar', 'Komatsu', 'Liebherr', 'Volvo', 'Hitachi', 'Doosan', 'JCB', 'Sandvik')
+PARTS = ('Haul Truck', 'Excavator', 'Wheel Loader', 'Dozer', 'Grader', 'Drill Rig', 'Crusher', 'Conveyor')
+DRIVE_TYPES = ('Hydraulic', 'Electric', 'Mechanical', None)
+FUEL_TYPES = ('Diesel', 'Diesel-electric', 'Electric', None)
+
+# (name, SQL, fleet query arguments)
+QUERIES = [
+    ('fleet_totals',
+     'SELECT COUNT(*), TOTAL(weight), AVG(used_hours) FROM inventory_parts',
+     dict(aggregates=['count', 'sum:weight', 'mean:used_hours'])),
+    ('by_manufacturer',
+     'SELECT manufacturer, COUNT(*), TOTAL(manufacturing_emission) FROM inventory_parts GROUP BY manufacturer',
+     dict(group_by=['manufacturer'], aggregates=['count', 'sum:manufacturing_emission'])),
+    ('heavy_by_drive_and_fuel',
+     'SELECT drive_type, fuel_type, COUNT(*), MAX(used_hours) FROM inventory_parts '
+     'WHERE weight BETWEEN 500 AND 2000 GROUP BY drive_type, fuel_type',
+     dict(where={'weight': {'min': 500, 'max': 2000}}, group_by=['drive_type', 'fuel_type'],
+          aggregates=['count', 'max:used_hours'])),
+    ('one_manufacturer_by_part',
+     "SELECT part_name, COUNT(*), AVG(steel) FROM inventory_parts WHERE manufacturer IN ('Komatsu', 'JCB') "
+     'GROUP BY part_name',
+     dict(where={'manufacturer': ['Komatsu', 'JCB']}, group_by=['part_name'], aggregates=['count', 'mean:steel'])),
+]
+
+
+def build_database(path, parts, seed=0):
+    """
+    Writes a synthetic inventory.
+
+    Args:
+        path (str): Database file to create
+        parts (int): Number of inventory rows
+        seed (int): Random seed
+    """
+    rng = np.random.default_rng(seed)
+    sqlite3.connect(path).close()
+    Database(path).close()  # applies the schema migrations
+    weight = rng.lognormal(6.5, 0.8, parts)
+    steel = weight * rng.uniform(0.4, 0.8, parts)
+    aluminum = weight * rng.uniform(0.0, 0.2, parts)
+    rubber = weight * rng.uniform(0.0, 0.1, parts)
+    used_hours = rng.uniform(0, 40000, parts)
+    used_hours[rng.random(parts) < 0.05] = np.nan
+    used_hours = [None if np.isnan(hours) else hours for hours in used_hours.tolist()]
+    manufacturer, part_name, drive_type, fuel_type = (
+        rng.integers(0, len(values), parts).tolist() for values in (MANUFACTURERS, PARTS, DRIVE_TYPES, FUEL_TYPES))
+    weight, steel, aluminum, rubber = (column.tolist() for column in (weight, steel, aluminum, rubber))
+    rows = (
+        (MANUFACTURERS[manufacturer[i]], PARTS[part_name[i]], f'SN-{i:08d}', weight[i], DRIVE_TYPES[drive_type[i]],
+         used_hours[i], FUEL_TYPES[fuel_type[i]], steel[i], aluminum[i], rubber[i],
+         weight[i] - steel[i] - aluminum[i] - rubber[i], steel[i] * 1.9, aluminum[i] * 8.2, rubber[i] * 2.7,
+         steel[i] * 1.9 + aluminum[i] * 8.2 + rubber[i] * 2.7)
+        for i in range(parts)
+    )
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            f"INSERT INTO inventory_parts ({', '.join(INVENTORY_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(INVENTORY_COLUMNS))})", rows)
+    conn.close()
+
+
+def _measure(func):
+    """Returns (result, seconds, bytes still allocated by func); memory is traced in a second, untimed run."""
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    result = func()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, seconds, allocated
+
+
+def _best(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _rounded(rows):
+    """Canonical, order-independent form of query results, for comparison."""
+    def value(v):
+        return round(v, 3) if isinstance(v, float) else v
+    return sorted((tuple(value(v) for v in row) for row in rows), key=repr)
+
+
+def run(parts, repeat, workdir):
+    """
+    Builds the inventory and measures loads, memory, snapshots and queries.
+
+    Args:
+        parts (int): Number of inventory rows
+        repeat (int): Runs per query; the fastest is reported
+        workdir (str): Directory for the database and the snapshot
+
+    Returns:
+        dict: Measurements
+    """
+    path = os.path.join(workdir, 'carbon.db')
+    build_database(path, parts)
+    database = Database(path)
+    columns = ', '.join(INVENTORY_COLUMNS)
+
+    def load_rows():
+        with database.reader() as conn:
+            return conn.execute(f'SELECT rowid, {columns} FROM inventory_parts').fetchall()
+
+    rows, rows_seconds, rows_bytes = _measure(load_rows)
+    del rows
+    table, fleet_seconds, fleet_bytes = _measure(lambda: FleetTable.from_database(database))
+
+    snapshot = os.path.join(workdir, 'fleet')
+    start = time.perf_counter()
+    table.save(snapshot)
+    save_seconds = time.perf_counter() - start
+    mapped, mmap_seconds, mmap_bytes = _measure(lambda: FleetTable.load(snapshot))
+
+    result = {
+        'parts': parts,
+        'sqlite_rows': {'load_seconds': rows_seconds, 'bytes_per_part': rows_bytes / parts},
+        'fleet': {'load_seconds': fleet_seconds, 'bytes_per_part': fleet_bytes / parts,
+                  'array_bytes_per_part': table.memory_bytes() / parts},
+        'snapshot': {'save_seconds': save_seconds, 'mmap_load_seconds': mmap_seconds,
+                     'mmap_heap_bytes_per_part': mmap_bytes / parts},
+        'queries': {},
+        'mismatches': 0,
+    }
+    result['fleet']['memory_ratio'] = result['fleet']['bytes_per_part'] / result['sqlite_rows']['bytes_per_part']
+
+    conn = sqlite3.connect(path)
+    for name, sql, arguments in QUERIES:
+        expected = conn.execute(sql).fetchall()
+        for candidate in (table, mapped):
+            actual = [tuple(group.values()) for group in candidate.query(**arguments)]
+            result['mismatches'] += _rounded(expected) != _rounded(actual)
+        sql_seconds = _best(lambda: conn.execute(sql).fetchall(), repeat)
+        fleet_seconds = _best(lambda: table.query(**arguments), repeat)
+        result['queries'][name] = {'sql_seconds': sql_seconds, 'fleet_seconds': fleet_seconds,
+                                   'mmap_seconds': _best(lambda: mapped.query(**arguments), repeat),
+                                   'speedup': sql_seconds / fleet_seconds}
+    conn.close()
+    database.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--parts', type=int, default=200000, help='inventory rows (default 200000)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per query, fastest kept (default 5)')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fleet-bench-')
+    try:
+        result = run(args.parts, args.repeat, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    rows, fleet, snapshot = result['sqlite_rows'], result['fleet'], result['snapshot']
+    print(f"{result['parts']} parts   mismatches {result['mismatches']}")
+    print(f"  sqlite3.Row list  load {rows['load_seconds'] * 1e3:8.1f} ms   {rows['bytes_per_part']:7.0f} B/part")
+    print(f"  fleet table       load {fleet['load_seconds'] * 1e3:8.1f} ms   {fleet['bytes_per_part']:7.0f} B/part"
+          f"   ({fleet['memory_ratio']:.1%} of rows)")
+    print(f"  snapshot          save {snapshot['save_seconds'] * 1e3:8.1f} ms   "
+          f"mmap open {snapshot['mmap_load_seconds'] * 1e3:.1f} ms")
+    for name, timing in result['queries'].items():
+        print(f"  {name:<26} sql {timing['sql_seconds'] * 1e3:8.2f} ms   fleet {timing['fleet_seconds'] * 1e3:7.2f} ms"
+              f"   mmap {timing['mmap_seconds'] * 1e3:7.2f} ms   x{timing['speedup']:.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'fleet', **result}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+Load benchmark: throughput and latency percentiles per endpoint.
+
+Starts the fake Nominatim/OSRM server (``upstreams.py``) and the backend in a
+separate process wired to it, with a throwaway copy of the inventory database
+and an empty lookup cache. Then, for each concurrency level, it drives each
+endpoint with that many client threads for a fixed time and reports
+throughput and p50/p95/p99 latency.
+
+The calculate result cache is disabled unless ``--result-cache`` is given, so
+every calculate request runs the full path. With ``--cold`` geocodes and
+routes are not cached either and every request reaches the fake upstreams.
+
+Usage:
+    python benchmarks/load.py [--concurrency 1,4,16] [--duration 10]
+        [--endpoints manufacturers,parts,calculate] [--latency 0.05] [--jitter 0.02]
+        [--error-rate 0.01] [--map html] [--cold] [--json load.json]
+    python benchmarks/load.py --url http://127.0.0.1:5000   # drive a running server instead
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config
+from upstreams import FakeUpstream
+
+BACKEND_DIR = config.BASE_DIR
+ENDPOINTS = ('manufacturers', 'parts', 'calculate')
+
+SERVER = r'''
+import sys
+from werkzeug.serving import make_server
+import app
+make_server('127.0.0.1', int(sys.argv[1]), app.create_app(), threaded=True).serve_forever()
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_backend(env, timeout=30):
+    """
+    Starts the backend in a child process and waits until it answers.
+
+    Args:
+        env (dict): Extra environment variables
+        timeout (float): Seconds to wait for the server to come up
+
+    Returns:
+        tuple: (subprocess.Popen, base URL)
+
+    Raises:
+        RuntimeError: If the server does not answer within the timeout
+    """
+    import requests
+
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER, str(port)], cwd=BACKEND_DIR, env={**os.environ, **env},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with status {process.returncode}")
+        try:
+            requests.get(f"{url}/api/manufacturers", timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Backend did not start within {timeout}s")
+
+
+class Workload:
+    """
+    Builds randomized requests for each endpoint from the live inventory.
+
+    Args:
+        url (str): Backend base URL
+        map_mode (str): "map" option sent with calculate requests
+        seed (int): Seed of the request generator
+    """
+
+    def __init__(self, url, map_mode='html', seed=0):
+        import requests
+
+        self.url = url
+        self.map_mode = map_mode
+        self.seed = seed
+        self.manufacturers = requests.get(f"{url}/api/manufacturers", timeout=10).json()
+        self.parts = [
+            (manufacturer, part['part_name'], part['serial_id'])
+            for manufacturer in self.manufacturers
+            for part in requests.get(f"{url}/api/parts", params={'manufacturer': manufacturer}, timeout=10).json()
+        ]
+        with open(config.GAZETTEER_PATH, newline='', encoding='utf-8') as f:
+            self.places = [row['name'] for row in csv.DictReader(f)]
+
+    def request(self, endpoint, rng):
+        """
+        Picks one request for an endpoint.
+
+        Args:
+            endpoint (str): "manufacturers", "parts" or "calculate"
+            rng (random.Random): Generator owned by the calling thread
+
+        Returns:
+            tuple: (method, url, keyword arguments for requests)
+        """
+        if endpoint == 'manufacturers':
+            return 'GET', f"{self.url}/api/manufacturers", {}
+        if endpoint == 'parts':
+            return 'GET', f"{self.url}/api/parts", {'params': {'manufacturer': rng.choice(self.manufacturers)}}
+        manufacturer, part_name, serial_id = rng.choice(self.parts)
+        pickup, delivery, G_pickup, G_delivery = rng.sample(self.places, 4)
+        return 'POST', f"{self.url}/api/calculate", {'json': {
+            'manufacturer': manufacturer,
+            'part_name': part_name,
+            'serial_id': serial_id,
+            'equipment_type': rng.choice(('Old', 'New')),
+            'pickup': pickup,
+            'delivery': delivery,
+            'G_pickup': G_pickup,
+            'G_delivery': G_delivery,
+            'map': self.map_mode,
+        }}
+
+
+def run_level(workload, endpoint, concurrency, duration):
+    """
+    Drives one endpoint with ``concurrency`` client threads for ``duration`` seconds.
+
+    Args:
+        workload (Workload): Request generator
+        endpoint (str): Endpoint name
+        concurrency (int): Number of client threads, each with its own keep-alive session
+        duration (float): Seconds to run
+
+    Returns:
+        dict: Request and error counts, throughput and latency percentiles in ms
+    """
+    import requests
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(index):
+        rng = random.Random(workload.seed * 1000 + index)
+        session = requests.Session()
+        mine, failed = [], 0
+        while time.perf_counter() < stop_at:
+            method, url, kwargs = workload.request(endpoint, rng)
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, timeout=60, **kwargs)
+                response.content
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            mine.append(time.perf_counter() - started)
+            failed += not ok
+        session.close()
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ms = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, (50, 95, 99)) if ms.size else (0.0, 0.0, 0.0)
+    return {
+        'requests': int(ms.size),
+        'errors': int(sum(errors)),
+        'requests_per_second': ms.size / elapsed,
+        'mean_ms': float(ms.mean()) if ms.size else 0.0,
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(ms.max()) if ms.size else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated client thread counts')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per endpoint and level (default 10)')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='comma-separated subset of ' + ', '.join(ENDPOINTS))
+    parser.add_argument('--latency', type=float, default=0.05, help='fake upstream delay in seconds (default 0.05)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random upstream delay of up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream requests failing with 503')
+    parser.add_argument('--map', default='html', choices=('html', 'geojson', 'none'), help='calculate map option')
+    parser.add_argument('--result-cache', action='store_true', help='keep the calculate result cache enabled')
+    parser.add_argument('--cold', action='store_true', help='do not cache geocodes or routes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='drive an already running backend instead of starting one')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    endpoints = [endpoint for endpoint in args.endpoints.split(',') if endpoint]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    upstream = process = workdir = None
+    try:
+        url = args.url
+        if url is None:
+            upstream = FakeUpstream(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                    seed=args.seed).start()
+            workdir = tempfile.mkdtemp(prefix='carbon-load-')
+            shutil.copy(config.DB_PATH, os.path.join(workdir, 'carbon.db'))
+            env = upstream.environ()
+            env.update({
+                'CARBON_DB_PATH': os.path.join(workdir, 'carbon.db'),
+                'CARBON_CACHE_DB_PATH': os.path.join(workdir, 'cache.db'),
+                'CARBON_NOMINATIM_RATE_LIMIT': '1000000',
+            })
+            if not args.result_cache:
+                env['CARBON_RESULT_CACHE_SIZE'] = '0'
+            if args.cold:
+                env.update({'CARBON_GEOCODE_TTL': '0', 'CARBON_GEOCODE_NEGATIVE_TTL': '0', 'CARBON_ROUTE_TTL': '0'})
+            process, url = start_backend(env)
+
+        workload = Workload(url, map_mode=args.map, seed=args.seed)
+        results = {}
+        print(f"{'endpoint':<14}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for endpoint in endpoints:
+            results[endpoint] = {}
+            for level in levels:
+                row = run_level(workload, endpoint, level, args.duration)
+                results[endpoint][str(level)] = row
+                print(f"{endpoint:<14}{level:>8}{row['requests_per_second']:>10.1f}{row['p50_ms']:>10.1f}"
+                      f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['errors']:>8}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if upstream is not None:
+            upstream.stop()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = {
+        'benchmark': 'load',
+        'settings': {
+            'duration': args.duration,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'error_rate': args.error_rate,
+            'map': args.map,
+            'result_cache': args.result_cache,
+            'cold': args.cold,
+            'url': args.url,
+        },
+        'results': results,
+    }
+    if upstream is not None:
+        summary['upstream'] = upstream.stats.as_dict()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
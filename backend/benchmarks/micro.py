@@ -0,0 +1,157 @@
+"""
+Microbenchmarks of the hot calculation paths.
+
+Times the scalar and matrix great-circle distance, the emission formulas,
+the what-if sweep, multimodal route planning and folium map rendering in-process. Each case runs ``--repeat`` rounds of an
+automatically sized number of calls and reports the best and median time per
+call.
+
+Usage:
+    python benchmarks/micro.py [--repeat 5] [--only haversine,calc_emission] [--json micro.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from emissions import calc_emission, fleet_emissions, lifecycle_emissions
+from factors import current_factors
+from geo import haversine, haversine_matrix
+from multimodal import load_hub_graph, plan_route
+from routing import EstimateRouter
+from whatif import sweep
+
+PERTH = (-31.9523, 115.8613)
+PORT_HEDLAND = (-20.3106, 118.6058)
+ROTTERDAM = (51.9244, 4.4777)
+
+
+def _matrix_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-60, 60, n), rng.uniform(-180, 180, n)
+
+
+def _fleet_inputs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        'manufacturing_emission': rng.uniform(100, 2500, n),
+        'weight': rng.uniform(40, 1000, n),
+        'used_hours': rng.uniform(4000, 5000, n),
+        'is_old': rng.random(n) < 0.5,
+        'local_distance': rng.uniform(10, 2000, n),
+        'global_distance': rng.uniform(0, 15000, n),
+    }
+
+
+def _sweep_inputs(parts, seed=0):
+    rng = np.random.default_rng(seed)
+    axes = {
+        'used_hours': np.linspace(0, 400000, 1001),
+        'lifetime': np.linspace(8000, 24000, 10),
+        'rate': np.linspace(0.02, 0.2, 10),
+        'old_distance': np.array([0.0, 100.0]),
+        'new_distance': np.linspace(0, 20000, 5),
+    }
+    return rng.uniform(40, 1000, parts), rng.uniform(0, 100000, parts), axes
+
+
+def build_cases():
+    """
+    Returns the benchmark cases.
+
+    Returns:
+        dict: Case name -> (description, zero-argument callable)
+    """
+    lat, lon = _matrix_points(1000)
+    fleet = _fleet_inputs(10000)
+    sweep_weight, sweep_hours, sweep_axes = _sweep_inputs(1000)
+
+    def render_map():
+        from maps import render_map_html
+        render_map_html([(*PERTH, 'Local Pickup'), (*PORT_HEDLAND, 'Local Delivery')])
+
+    def multimodal_route():
+        plan_route(graph, PERTH, ROTTERDAM, 400, factors)
+
+    graph = load_hub_graph(route=EstimateRouter().route)  # no network: road links estimated
+    factors = current_factors()
+
+    return {
+        'haversine': ('one scalar distance', lambda: haversine(*PERTH, *PORT_HEDLAND)),
+        'haversine_matrix_1000': ('1000 x 1000 distance matrix', lambda: haversine_matrix(lat, lon, lat, lon)),
+        'calc_emission': ('one transport emission', lambda: calc_emission(400, 1650.5)),
+        'lifecycle_emissions': ('one part lifecycle', lambda: lifecycle_emissions(981.76, 400, 5000)),
+        'fleet_emissions_10000': ('10000 shipments, vectorized', lambda: fleet_emissions(**fleet)),
+        'whatif_sweep_1g': ('1000 parts x 1001 x 1000 grid cells',
+                            lambda: sweep(sweep_weight, sweep_hours, sweep_axes, 3.27)),
+        'multimodal_route': ('lowest-emission hub path, Perth to Rotterdam', multimodal_route),
+        'render_map': ('folium map, two markers', render_map),
+    }
+
+
+def run_case(func, repeat):
+    """
+    Times a callable.
+
+    Args:
+        func (callable): Code to time
+        repeat (int): Timing rounds; each round makes enough calls to last at least 0.2 s
+
+    Returns:
+        dict: Calls per round plus best and median seconds per call
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    rounds = [seconds / number for seconds in timer.repeat(repeat=repeat, number=number)]
+    best = min(rounds)
+    return {
+        'calls_per_round': number,
+        'best_seconds': best,
+        'median_seconds': statistics.median(rounds),
+        'calls_per_second': 1 / best if best > 0 else 0.0,
+    }
+
+
+def _format_seconds(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.1f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='timing rounds per case (default 5)')
+    parser.add_argument('--only', help='comma-separated case names to run')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    cases = build_cases()
+    if args.only:
+        names = args.only.split(',')
+        unknown = set(names) - set(cases)
+        if unknown:
+            parser.error(f"unknown cases: {', '.join(sorted(unknown))}; choose from {', '.join(cases)}")
+        cases = {name: cases[name] for name in names}
+
+    results = {}
+    for name, (description, func) in cases.items():
+        func()  # warm-up: lazy imports and first-call allocations
+        results[name] = run_case(func, args.repeat)
+        results[name]['description'] = description
+        print(f"{name:<24}best {_format_seconds(results[name]['best_seconds'])}"
+              f"   median {_format_seconds(results[name]['median_seconds'])}   {description}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'micro', 'repeat': args.repeat, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
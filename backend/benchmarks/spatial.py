@@ -0,0 +1,142 @@
+"""
+Benchmarks the depot spatial index against a brute-force scan.
+
+For each size, builds clustered random depots (most of them around a few
+dozen centres, like real distribution networks), checks that the index and a
+full vectorized haversine scan return the same depots for every query, then
+times the nearest (k=1), k-nearest (k=10) and within-radius queries both ways.
+
+Usage:
+    python benchmarks/spatial.py [--sizes 100,1000,10000,100000] [--queries 500] [--radius 100]
+        [--json spatial.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from geo import haversine_matrix
+from spatial import SpatialIndex
+
+
+def clustered_points(n, seed=0, clusters=40, spread=3.0):
+    """
+    Returns random points, 90% of them scattered around cluster centres.
+
+    Args:
+        n (int): Number of points
+        seed (int): Random seed
+        clusters (int): Number of cluster centres
+        spread (float): Standard deviation around a centre, in degrees
+
+    Returns:
+        tuple: (latitudes, longitudes)
+    """
+    rng = np.random.default_rng(seed)
+    centre_lat = rng.uniform(-45, 60, clusters)
+    centre_lon = rng.uniform(-180, 180, clusters)
+    which = rng.integers(0, clusters, n)
+    lat = centre_lat[which] + rng.normal(0, spread, n)
+    lon = centre_lon[which] + rng.normal(0, spread, n)
+    scattered = rng.random(n) < 0.1
+    lat[scattered] = rng.uniform(-60, 70, scattered.sum())
+    lon[scattered] = rng.uniform(-180, 180, scattered.sum())
+    return np.clip(lat, -89.9, 89.9), (lon + 180) % 360 - 180
+
+
+def brute_nearest(lat, lon, qlat, qlon, k):
+    distances = haversine_matrix(lat, lon, [qlat], [qlon])[:, 0]
+    order = np.argsort(distances, kind='stable')[:k]
+    return order, distances[order]
+
+
+def brute_within(lat, lon, qlat, qlon, radius_km):
+    distances = haversine_matrix(lat, lon, [qlat], [qlon])[:, 0]
+    inside = np.flatnonzero(distances <= radius_km)
+    order = inside[np.argsort(distances[inside], kind='stable')]
+    return order, distances[order]
+
+
+def _same(expected, actual):
+    """Compares by distance, so ties between equidistant depots do not count as mismatches."""
+    return len(expected[1]) == len(actual[1]) and np.allclose(expected[1], actual[1], rtol=0, atol=1e-6)
+
+
+def _time(func, queries):
+    start = time.perf_counter()
+    for qlat, qlon in queries:
+        func(qlat, qlon)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def run_size(n, query_count, radius_km, seed=0):
+    """
+    Builds, verifies and times the index for one size.
+
+    Args:
+        n (int): Number of depots
+        query_count (int): Number of query points
+        radius_km (float): Radius of the within-radius queries
+        seed (int): Random seed
+
+    Returns:
+        dict: Build time, mismatches and per-query seconds of each query kind, index and brute force
+    """
+    lat, lon = clustered_points(n, seed)
+    qlat, qlon = clustered_points(query_count, seed + 1)
+    queries = list(zip(qlat.tolist(), qlon.tolist()))
+
+    start = time.perf_counter()
+    index = SpatialIndex(lat, lon)
+    build_seconds = time.perf_counter() - start
+
+    kinds = {
+        'nearest_1': (lambda a, b: index.nearest(a, b, 1), lambda a, b: brute_nearest(lat, lon, a, b, 1)),
+        'nearest_10': (lambda a, b: index.nearest(a, b, 10), lambda a, b: brute_nearest(lat, lon, a, b, 10)),
+        'within': (lambda a, b: index.within(a, b, radius_km), lambda a, b: brute_within(lat, lon, a, b, radius_km)),
+    }
+    result = {'depots': n, 'build_seconds': build_seconds, 'mismatches': 0}
+    for name, (indexed, brute) in kinds.items():
+        result['mismatches'] += sum(not _same(brute(a, b), indexed(a, b)) for a, b in queries)
+        index_seconds = _time(indexed, queries)
+        brute_seconds = _time(brute, queries)
+        result[name] = {
+            'index_seconds': index_seconds,
+            'brute_seconds': brute_seconds,
+            'index_queries_per_second': 1 / index_seconds,
+            'speedup': brute_seconds / index_seconds,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000,100000', help='comma-separated depot counts')
+    parser.add_argument('--queries', type=int, default=500, help='query points per size (default 500)')
+    parser.add_argument('--radius', type=float, default=100, help='within-radius query radius in km (default 100)')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for n in (int(size) for size in args.sizes.split(',')):
+        result = run_size(n, args.queries, args.radius)
+        results[str(n)] = result
+        print(f"{n:>8} depots   build {result['build_seconds'] * 1e3:8.2f} ms   mismatches {result['mismatches']}")
+        for name in ('nearest_1', 'nearest_10', 'within'):
+            timing = result[name]
+            print(f"         {name:<11} index {timing['index_seconds'] * 1e6:9.1f} us"
+                  f"   brute {timing['brute_seconds'] * 1e6:9.1f} us   x{timing['speedup']:.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'spatial', 'queries': args.queries, 'radius_km': args.radius,
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Startup benchmark: import time and memory of a fresh backend worker.
+
+Each run starts a new interpreter, imports ``app`` and reports the wall time
+of the import and the resident set size afterwards. Optionally it also loads
+the lazily imported features (map rendering) to show what they add.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--with-map] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PROBE = r'''
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+extra = 0.0
+if WITH_MAP:
+    started = time.perf_counter()
+    from maps import render_map_html
+    render_map_html([(-31.95, 115.86, "Local Pickup"), (-20.31, 118.61, "Local Delivery")])
+    extra = time.perf_counter() - started
+
+def rss_kib():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+print(json.dumps({
+    'import_seconds': imported,
+    'map_seconds': extra,
+    'rss_mib': rss_kib() / 1024,
+    'modules': len(sys.modules),
+    'heavy_loaded': sorted(m for m in ('pandas', 'matplotlib', 'folium', 'geopy', 'requests') if m in sys.modules),
+}))
+'''
+
+
+def run_once(with_map):
+    """
+    Imports the app in a fresh interpreter.
+
+    Args:
+        with_map (bool): Also render one map after the import
+
+    Returns:
+        dict: Measurements printed by the probe
+    """
+    code = PROBE.replace('WITH_MAP', 'True' if with_map else 'False')
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=BACKEND_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters to start (default 5)')
+    parser.add_argument('--with-map', action='store_true', help='also render a folium map in each run')
+    parser.add_argument('--json', help='write the summary to this file')
+    args = parser.parse_args()
+
+    runs = [run_once(args.with_map) for _ in range(args.runs)]
+    summary = {
+        'benchmark': 'startup',
+        'runs': args.runs,
+        'import_seconds_median': statistics.median(r['import_seconds'] for r in runs),
+        'import_seconds_min': min(r['import_seconds'] for r in runs),
+        'map_seconds_median': statistics.median(r['map_seconds'] for r in runs),
+        'rss_mib_median': statistics.median(r['rss_mib'] for r in runs),
+        'modules': runs[-1]['modules'],
+        'heavy_loaded': runs[-1]['heavy_loaded'],
+    }
+
+    print(f"import app        median {summary['import_seconds_median'] * 1000:8.1f} ms"
+          f"   min {summary['import_seconds_min'] * 1000:8.1f} ms")
+    if args.with_map:
+        print(f"first map render  median {summary['map_seconds_median'] * 1000:8.1f} ms")
+    print(f"RSS per worker    median {summary['rss_mib_median']:8.1f} MiB")
+    print(f"modules loaded    {summary['modules']}   heavy: {', '.join(summary['heavy_loaded']) or 'none'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Local stand-ins for the Nominatim geocoder and the OSRM router.
+
+One HTTP server answers both APIs with canned responses, so load tests do not
+depend on (or hammer) the public services:
+
+- ``GET /search?q=<name>&format=json`` returns the gazetteer coordinates of the
+  name, or ``[]`` when the name is not listed.
+- ``GET /route/v1/<profile>/<lon>,<lat>;<lon>,<lat>`` returns one route whose
+  distance is the great-circle distance times 1.3, at 50 km/h.
+
+Every response can be delayed (``latency`` plus up to ``jitter`` seconds) and a
+fraction ``error_rate`` of requests fail with HTTP 503. Point the backend at it
+with ``CARBON_NOMINATIM_DOMAIN``, ``CARBON_NOMINATIM_SCHEME=http`` and
+``CARBON_OSRM_URL``. To run it on its own:
+
+    python benchmarks/upstreams.py --port 8089 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config
+from geo import haversine
+from geocode import normalize_query
+
+
+class UpstreamStats:
+    """Request counters of a fake upstream, per API."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {'search': 0, 'route': 0, 'other': 0}
+        self.errors = 0
+
+    def record(self, kind, failed):
+        with self._lock:
+            self.requests[kind] += 1
+            if failed:
+                self.errors += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {'requests': dict(self.requests), 'errors': self.errors}
+
+
+class FakeUpstream:
+    """
+    Threaded HTTP server serving fake Nominatim and OSRM answers.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on; 0 picks a free one
+        latency (float): Seconds added to every response
+        jitter (float): Extra random delay of up to this many seconds
+        error_rate (float): Fraction of requests answered with HTTP 503
+        gazetteer_path (str): CSV with name,lat,lon columns used for /search
+        seed (int, optional): Seed of the delay and error generator
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 gazetteer_path=config.GAZETTEER_PATH, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stats = UpstreamStats()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._places = {}
+        with open(gazetteer_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                self._places[normalize_query(row['name'])] = (row['name'], float(row['lat']), float(row['lon']))
+
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one segment; separate small writes on a kept-alive
+            # connection stall ~40 ms on Nagle's algorithm and delayed ACKs.
+            wbufsize = 1 << 16
+
+            def do_GET(self):
+                upstream._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        """str: host:port the server listens on."""
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def url(self):
+        """str: http:// root URL of the server."""
+        return f"http://{self.address}"
+
+    def _roll(self):
+        with self._random_lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            failed = self._random.random() < self.error_rate
+        return delay, failed
+
+    def _handle(self, handler):
+        parts = urlsplit(handler.path)
+        if parts.path.rstrip('/') == '/search':
+            kind = 'search'
+        elif parts.path.startswith('/route/v1/'):
+            kind = 'route'
+        else:
+            kind = 'other'
+
+        delay, failed = self._roll()
+        if delay:
+            time.sleep(delay)
+        if kind == 'other':
+            status, body = 404, {'error': 'not found'}
+        elif failed:
+            status, body = 503, {'error': 'injected failure'}
+        elif kind == 'search':
+            status, body = 200, self._search(parse_qs(parts.query).get('q', [''])[0])
+        else:
+            status, body = self._route(parts.path)
+        self.stats.record(kind, status >= 500)
+
+        payload = json.dumps(body).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def _search(self, query):
+        place = self._places.get(normalize_query(query))
+        if place is None:
+            return []
+        name, lat, lon = place
+        return [{'lat': str(lat), 'lon': str(lon), 'display_name': name}]
+
+    def _route(self, path):
+        try:
+            coordinates = unquote(path.split('/', 4)[4]).split(';')
+            (lon1, lat1), (lon2, lat2) = (map(float, c.split(',')) for c in coordinates[:2])
+        except (IndexError, ValueError):
+            return 400, {'code': 'InvalidQuery'}
+        distance_m = haversine(lat1, lon1, lat2, lon2) * 1.3 * 1000
+        return 200, {'code': 'Ok', 'routes': [{'distance': distance_m, 'duration': distance_m / (50 / 3.6)}]}
+
+    def start(self):
+        """
+        Serves requests on a daemon thread.
+
+        Returns:
+            FakeUpstream: self, for chaining
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-upstream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def environ(self):
+        """
+        Returns the environment that points the backend at this server.
+
+        Returns:
+            dict: CARBON_* variables selecting Nominatim and OSRM on this server
+        """
+        return {
+            'CARBON_GEOCODER': 'nominatim',
+            'CARBON_NOMINATIM_DOMAIN': self.address,
+            'CARBON_NOMINATIM_SCHEME': 'http',
+            'CARBON_ROUTER': 'osrm',
+            'CARBON_OSRM_URL': self.url,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random delay of up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--seed', type=int, help='seed of the delay and error generator')
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.host, args.port, args.latency, args.jitter, args.error_rate, seed=args.seed)
+    print(f"Fake Nominatim and OSRM listening on {upstream.url}")
+    for name, value in upstream.environ().items():
+        print(f"  {name}={value}")
+    try:
+        upstream._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        upstream._server.server_close()
+        print(json.dumps(upstream.stats.as_dict()))
+
+
+if __name__ == '__main__':
+    main()
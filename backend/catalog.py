@@ -0,0 +1,200 @@
+"""
+In-memory index of the ``inventory_parts`` table.
+
+The catalog is loaded once and answers the form's manufacturer and part
+lookups, and the calculate endpoints' part lookups, from dictionaries. It
+notices table changes through SQLite's ``PRAGMA data_version`` (checked at most
+once per ``check_interval`` seconds) and reloads itself. Its ``etag`` is a
+content hash, so every worker serving the same data hands out the same ETag.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import config
+from db import get_database
+
+
+class InventoryCatalog:
+    """
+    Manufacturer -> parts -> serial index plus a part row map.
+
+    Args:
+        path (str): Inventory database file
+        check_interval (float): Minimum seconds between change checks
+    """
+
+    def __init__(self, path=config.DB_PATH, check_interval=config.CATALOG_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._watch = None
+        self._data_version = None
+        self._next_check = 0.0
+        self._load()
+
+    def _current_data_version(self):
+        if self._watch is None:
+            self._watch = sqlite3.connect(self.path, check_same_thread=False)
+        return self._watch.execute('PRAGMA data_version').fetchone()[0]
+
+    def _load(self):
+        database = get_database()
+        data_version = self._current_data_version()
+        rows = database.fetchall('SELECT * FROM inventory_parts')
+        columns = tuple(rows[0].keys()) if rows else ()
+
+        manufacturers = {}
+        parts = {}
+        digest = hashlib.sha1()
+        for row in rows:
+            values = tuple(row)
+            digest.update(repr(values).encode('utf-8'))
+            manufacturer, part_name, serial_id = row['manufacturer'], row['part_name'], row['serial_id']
+            manufacturers.setdefault(manufacturer, {}).setdefault((part_name, serial_id), None)
+            parts.setdefault((manufacturer, part_name, serial_id), values)
+
+        self.columns = columns
+        self._manufacturers = list(manufacturers)
+        self._parts_by_manufacturer = {
+            manufacturer: [{'part_name': part_name, 'serial_id': serial_id} for part_name, serial_id in pairs]
+            for manufacturer, pairs in manufacturers.items()
+        }
+        self._parts = parts
+        self.etag = digest.hexdigest()
+        self.last_modified = self._file_mtime()
+        self._data_version = data_version
+        self.reloads += 1
+        if self.reloads > 1:
+            for listener in self._listeners:
+                listener(self)
+
+    def add_listener(self, callback):
+        """
+        Registers a callback run after every reload (not the initial load).
+
+        Args:
+            callback (callable): Called with the catalog once the new data is in place
+        """
+        self._listeners.append(callback)
+
+    def _file_mtime(self):
+        mtimes = [os.path.getmtime(p) for p in (self.path, self.path + '-wal') if os.path.exists(p)]
+        return max(mtimes) if mtimes else time.time()
+
+    def refresh(self, force=False):
+        """
+        Reloads the catalog if the table changed since the last load.
+
+        Args:
+            force (bool): Reload without checking data_version
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        with self._lock:
+            if not force and now < self._next_check:
+                return
+            if force:
+                self._load()
+            else:
+                data_version = self._current_data_version()
+                if self._data_version is None and self._file_mtime() == self.last_modified:
+                    # A new watch connection (after close()) over an unchanged file: adopt its baseline.
+                    self._data_version = data_version
+                elif data_version != self._data_version:
+                    self._load()
+            self._next_check = now + self.check_interval
+
+    def manufacturers(self):
+        """
+        Returns every manufacturer, in table order.
+
+        Returns:
+            list: Manufacturer names
+        """
+        self.refresh()
+        return self._manufacturers
+
+    def parts(self, manufacturer):
+        """
+        Returns the distinct parts of a manufacturer.
+
+        Args:
+            manufacturer (str): Manufacturer name
+
+        Returns:
+            list: Dicts with "part_name" and "serial_id"; empty for an unknown manufacturer
+        """
+        self.refresh()
+        return self._parts_by_manufacturer.get(manufacturer, [])
+
+    def get_part(self, manufacturer, part_name, serial_id):
+        """
+        Looks up one inventory row.
+
+        Args:
+            manufacturer (str): Manufacturer name
+            part_name (str): Part name
+            serial_id (str): Serial ID
+
+        Returns:
+            dict | None: The row keyed by column name, or None if the part is unknown
+        """
+        self.refresh()
+        values = self._parts.get((manufacturer, part_name, serial_id))
+        if values is None:
+            return None
+        return dict(zip(self.columns, values))
+
+    def close(self):
+        """
+        Closes the change-watch connection; it reopens on next use.
+
+        The loaded data is kept: the next change check reloads only if the
+        database file was modified since the load, so a catalog loaded before
+        forking serves every worker process without reloading.
+        """
+        with self._lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+            self._next_check = 0.0
+            self._data_version = None
+
+    def stats(self):
+        """
+        Returns catalog size and reload count.
+
+        Returns:
+            dict: Catalog statistics
+        """
+        return {
+            'manufacturers': len(self._manufacturers),
+            'parts': len(self._parts),
+            'reloads': self.reloads,
+            'etag': self.etag,
+        }
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    Returns the process-wide inventory catalog, loading it on first use.
+
+    Returns:
+        InventoryCatalog: The shared catalog
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = InventoryCatalog()
+    return _catalog
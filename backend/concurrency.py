@@ -0,0 +1,217 @@
+"""
+Shared building blocks for running upstream lookups concurrently.
+
+``TokenBucket`` enforces a rate limit across every thread of the process and
+``SharedTokenBucket`` across every process using the same SQLite file (the
+pre-forked workers of one deployment); ``get_executor`` returns the bounded
+thread pool lookups run on and ``submit`` runs a call there in the caller's
+context.
+"""
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Args:
+        rate (float): Tokens added per second
+        capacity (float): Maximum tokens stored, i.e. the allowed burst
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.rejections = 0
+
+    def acquire(self, timeout=None):
+        """
+        Takes one token, waiting for the bucket to refill if needed.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. None waits indefinitely
+
+        Returns:
+            bool: True if a token was taken, False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    if waited:
+                        self.waits += 1
+                    return True
+                delay = (1 - self._tokens) / self.rate
+            if deadline is not None and now + delay > deadline:
+                self.rejections += 1
+                return False
+            waited = True
+            time.sleep(delay)
+
+
+class SharedTokenBucket:
+    """
+    Token bucket kept in a SQLite table, shared by every process opening the same file.
+
+    Each acquire refills and takes a token inside one write transaction, so
+    the bucket holds however many worker processes draw from it. Should the
+    database fail, the process falls back to a TokenBucket of its own and
+    reports the error.
+
+    Args:
+        path (str): SQLite file holding the bucket (created if missing)
+        name (str): Bucket name, one row per bucket
+        rate (float): Tokens added per second
+        capacity (float): Maximum tokens stored, i.e. the allowed burst
+    """
+
+    def __init__(self, path, name, rate, capacity=1):
+        self.path = path
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._fallback = None
+        self.waits = 0
+        self.rejections = 0
+
+    def _connection(self):
+        # A connection inherited through fork() must not be used by the child.
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._pid = os.getpid()
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                'updated REAL NOT NULL)')
+            self._conn.commit()
+        return self._conn
+
+    def _take(self):
+        """Refills the bucket and takes a token if one is there; returns (taken, tokens left)."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE name = ?', (self.name,)).fetchone()
+            now = time.time()
+            tokens = self.capacity if row is None else \
+                min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+            taken = tokens >= 1
+            if taken:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO rate_buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                         (self.name, tokens, now))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return taken, tokens
+
+    def acquire(self, timeout=None):
+        """
+        Takes one token, waiting for the bucket to refill if needed.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. None waits indefinitely
+
+        Returns:
+            bool: True if a token was taken, False if the timeout expired first
+        """
+        if self._fallback is not None:
+            return self._fallback.acquire(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._lock:
+                try:
+                    taken, tokens = self._take()
+                except sqlite3.Error as e:
+                    print(f"Shared rate limit {self.name} unavailable, limiting this process only: {e}")
+                    self._fallback = TokenBucket(self.rate, self.capacity)
+                    return self._fallback.acquire(timeout)
+            if taken:
+                if waited:
+                    self.waits += 1
+                return True
+            delay = (1 - tokens) / self.rate
+            if deadline is not None and time.monotonic() + delay > deadline:
+                self.rejections += 1
+                return False
+            waited = True
+            time.sleep(delay)
+
+    def close(self):
+        """Closes the database connection; it reopens on next use."""
+        with self._lock:
+            if self._conn is not None:
+                if self._pid == os.getpid():
+                    self._conn.close()
+                self._conn = None
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the process-wide thread pool used for geocoding and routing lookups.
+
+    Returns:
+        ThreadPoolExecutor: Pool with CARBON_LOOKUP_WORKERS threads
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=config.LOOKUP_WORKERS, thread_name_prefix='lookup')
+    return _executor
+
+
+def shutdown_executor():
+    """
+    Stops the lookup pool's threads once their tasks finish; the next submit starts a new pool.
+
+    Threads do not survive fork(), so a pool started before forking would
+    hang every lookup of the child processes.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Runs a call on the lookup pool inside a copy of the caller's context.
+
+    Context variables (such as the request's stage timers) are not passed to
+    pool threads by ThreadPoolExecutor itself.
+
+    Args:
+        fn (callable): Function to run
+        *args: Positional arguments for fn
+        **kwargs: Keyword arguments for fn
+
+    Returns:
+        concurrent.futures.Future: The pending call
+    """
+    return get_executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
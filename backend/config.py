@@ -0,0 +1,146 @@
+"""
+Runtime settings for the backend.
+
+Every setting can be overridden with an environment variable (or a line in
+the backend ``.env`` file) so the same code runs on a laptop, in tests and
+in an air-gapped deployment.
+"""
+import os
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DATABASE_DIR = os.path.join(BASE_DIR, 'database_py', 'database')
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+# Inventory database
+DB_PATH = os.environ.get('CARBON_DB_PATH', os.path.join(DATABASE_DIR, 'carbon.db'))
+
+# Persistent lookup cache (geocodes), kept out of carbon.db so cache writes
+# never touch the inventory file.
+CACHE_DB_PATH = os.environ.get('CARBON_CACHE_DB_PATH', os.path.join(DATABASE_DIR, 'cache.db'))
+
+# Geocoding
+GEOCODER = os.environ.get('CARBON_GEOCODER', 'nominatim')  # "nominatim" or "gazetteer"
+GAZETTEER_PATH = os.environ.get('CARBON_GAZETTEER_PATH', os.path.join(BASE_DIR, 'data', 'gazetteer.csv'))
+NOMINATIM_USER_AGENT = os.environ.get('CARBON_NOMINATIM_USER_AGENT', 'user1')
+NOMINATIM_DOMAIN = os.environ.get('CARBON_NOMINATIM_DOMAIN', 'nominatim.openstreetmap.org')
+NOMINATIM_SCHEME = os.environ.get('CARBON_NOMINATIM_SCHEME', 'https')
+NOMINATIM_TIMEOUT = _env_float('CARBON_NOMINATIM_TIMEOUT', 20)
+GEOCODE_TTL = _env_float('CARBON_GEOCODE_TTL', 30 * 24 * 3600)
+GEOCODE_NEGATIVE_TTL = _env_float('CARBON_GEOCODE_NEGATIVE_TTL', 24 * 3600)
+GEOCODE_MAX_ENTRIES = _env_int('CARBON_GEOCODE_MAX_ENTRIES', 10000)
+GEOCODE_SNAPSHOT_ENTRIES = _env_int('CARBON_GEOCODE_SNAPSHOT_ENTRIES', GEOCODE_MAX_ENTRIES)  # preloaded at startup
+
+# Road routing
+ROUTER = os.environ.get('CARBON_ROUTER', 'osrm')  # "osrm" or "estimate"
+OSRM_URL = os.environ.get('CARBON_OSRM_URL', 'http://router.project-osrm.org')
+OSRM_TIMEOUT = _env_float('CARBON_OSRM_TIMEOUT', 5)
+ROUTE_CIRCUITY_FACTOR = _env_float('CARBON_ROUTE_CIRCUITY_FACTOR', 1.3)
+ROAD_SPEED_KMH = _env_float('CARBON_ROAD_SPEED_KMH', 50)
+ROUTE_PRECISION = _env_int('CARBON_ROUTE_PRECISION', 4)  # decimal places of the cache key (~11 m)
+ROUTE_TTL = _env_float('CARBON_ROUTE_TTL', 7 * 24 * 3600)
+ROUTE_MEMORY_ENTRIES = _env_int('CARBON_ROUTE_MEMORY_ENTRIES', 4096)
+ROUTE_MAX_ENTRIES = _env_int('CARBON_ROUTE_MAX_ENTRIES', 100000)
+ROUTE_HEDGE_DEADLINE = _env_float('CARBON_ROUTE_HEDGE_DEADLINE', 0)  # seconds before a provisional estimate; 0 waits
+ROUTE_HEDGE_WORKERS = _env_int('CARBON_ROUTE_HEDGE_WORKERS', 8)  # threads finishing router calls in the background
+
+# Batch calculation
+BATCH_MAX_SIZE = _env_int('CARBON_BATCH_MAX_SIZE', 10000)
+BATCH_MAX_IN_FLIGHT = _env_int('CARBON_BATCH_MAX_IN_FLIGHT', 6)  # legs of one batch resolving at once, under one deadline
+STREAM_MAX_IN_FLIGHT = _env_int('CARBON_STREAM_MAX_IN_FLIGHT', BATCH_MAX_IN_FLIGHT)  # legs of one stream resolving at once
+
+# Asynchronous jobs
+JOBS_DB_PATH = os.environ.get('CARBON_JOBS_DB_PATH', os.path.join(DATABASE_DIR, 'jobs.db'))
+JOB_WORKERS = _env_int('CARBON_JOB_WORKERS', 2)
+JOB_MAX_SIZE = _env_int('CARBON_JOB_MAX_SIZE', 100000)  # shipments per job
+JOB_MAX_ACTIVE_PER_CLIENT = _env_int('CARBON_JOB_MAX_ACTIVE_PER_CLIENT', 4)  # queued plus running
+JOB_MAX_RUNNING_PER_CLIENT = _env_int('CARBON_JOB_MAX_RUNNING_PER_CLIENT', 1)
+JOB_MAX_IN_FLIGHT = _env_int('CARBON_JOB_MAX_IN_FLIGHT', 3)  # legs of one job resolving at once
+JOB_FLUSH_INTERVAL = _env_float('CARBON_JOB_FLUSH_INTERVAL', 0.5)  # seconds between progress writes
+JOB_TTL = _env_float('CARBON_JOB_TTL', 7 * 24 * 3600)  # finished jobs are deleted after this many seconds
+JOB_EVENTS_HEARTBEAT = _env_float('CARBON_JOB_EVENTS_HEARTBEAT', 15)  # seconds between SSE keep-alive comments
+JOB_POLL_INTERVAL = _env_float('CARBON_JOB_POLL_INTERVAL', 1.0)  # seconds between checks for other processes' changes
+JOB_STALE_AFTER = _env_float('CARBON_JOB_STALE_AFTER', 60)  # running jobs without a heartbeat this long are requeued
+
+# Multimodal routing
+HUBS_PATH = os.environ.get('CARBON_HUBS_PATH', os.path.join(BASE_DIR, 'data', 'hubs.json'))
+MULTIMODAL_ACCESS_HUBS = _env_int('CARBON_MULTIMODAL_ACCESS_HUBS', 3)  # nearest hubs joined to the pickup/delivery by road
+MULTIMODAL_ACCESS_MAX_KM = _env_float('CARBON_MULTIMODAL_ACCESS_MAX_KM', 1500)  # great-circle limit of those road legs
+MULTIMODAL_DIRECT_MAX_KM = _env_float('CARBON_MULTIMODAL_DIRECT_MAX_KM', 4500)  # longest pickup-delivery distance offered by road alone
+
+# What-if sweeps
+WHATIF_MAX_AXIS_POINTS = _env_int('CARBON_WHATIF_MAX_AXIS_POINTS', 10000)  # values per grid axis
+WHATIF_MAX_POINTS = _env_int('CARBON_WHATIF_MAX_POINTS', 5000000)  # break-even points: parts x grid without used hours
+WHATIF_MAX_DETAIL_POINTS = _env_int('CARBON_WHATIF_MAX_DETAIL_POINTS', 100000)  # break-even points returned with detail
+
+# Depots
+DEPOTS_PATH = os.environ.get('CARBON_DEPOTS_PATH', os.path.join(BASE_DIR, 'data', 'depots.csv'))
+DEPOTS_TABLE = os.environ.get('CARBON_DEPOTS_TABLE', '')  # read depots from this inventory table instead of the CSV
+DEPOT_CELL_KM = _env_float('CARBON_DEPOT_CELL_KM', 0)  # spatial index cube size; 0 picks one from the depot count
+DEPOTS_MAX_RESULTS = _env_int('CARBON_DEPOTS_MAX_RESULTS', 1000)
+
+# Distance matrix
+DISTANCE_MATRIX_MAX_POINTS = _env_int('CARBON_DISTANCE_MATRIX_MAX_POINTS', 10000)
+
+# Emission factors
+FACTORS_PATH = os.environ.get('CARBON_FACTORS_PATH', os.path.join(BASE_DIR, 'data', 'emission_factors.csv'))
+FACTORS_CHECK_INTERVAL = _env_float('CARBON_FACTORS_CHECK_INTERVAL', 1.0)  # seconds between mtime checks
+
+# Inventory database access
+DB_POOL_SIZE = _env_int('CARBON_DB_POOL_SIZE', 8)
+DB_MMAP_SIZE = _env_int('CARBON_DB_MMAP_SIZE', 256 * 1024 * 1024)
+DB_CACHE_SIZE_KIB = _env_int('CARBON_DB_CACHE_SIZE_KIB', 16 * 1024)
+DB_STATEMENT_CACHE = _env_int('CARBON_DB_STATEMENT_CACHE', 256)
+
+# Inventory catalog
+CATALOG_CHECK_INTERVAL = _env_float('CARBON_CATALOG_CHECK_INTERVAL', 1.0)
+
+# Columnar fleet model
+FLEET_SNAPSHOT_DIR = os.environ.get('CARBON_FLEET_SNAPSHOT_DIR', '')  # memory-mapped snapshot; '' keeps it in memory only
+FLEET_MAX_GROUPS = _env_int('CARBON_FLEET_MAX_GROUPS', 10000)  # groups returned by one fleet query
+
+# Concurrent lookups
+LOOKUP_WORKERS = _env_int('CARBON_LOOKUP_WORKERS', 16)
+LOOKUP_DEADLINE = _env_float('CARBON_LOOKUP_DEADLINE', 15)  # seconds for all lookups of one request
+NOMINATIM_RATE_LIMIT = _env_float('CARBON_NOMINATIM_RATE_LIMIT', 1.0)  # requests per second
+
+# Upstream HTTP clients (OSRM, Nominatim)
+UPSTREAM_MAX_CONCURRENCY = _env_int('CARBON_UPSTREAM_MAX_CONCURRENCY', 8)  # calls in flight per upstream host
+UPSTREAM_RETRIES = _env_int('CARBON_UPSTREAM_RETRIES', 2)
+UPSTREAM_RETRY_BACKOFF = _env_float('CARBON_UPSTREAM_RETRY_BACKOFF', 0.2)  # seconds before the first retry
+UPSTREAM_RETRY_BUDGET = _env_float('CARBON_UPSTREAM_RETRY_BUDGET', 0.2)  # retries allowed per call, on average
+UPSTREAM_BREAKER_FAILURES = _env_int('CARBON_UPSTREAM_BREAKER_FAILURES', 5)  # consecutive failures that open the breaker
+UPSTREAM_BREAKER_RESET = _env_float('CARBON_UPSTREAM_BREAKER_RESET', 30)  # seconds open before a probe
+
+# Maps
+MAP_CACHE_ENTRIES = _env_int('CARBON_MAP_CACHE_ENTRIES', 256)
+MAP_MAX_AGE = _env_int('CARBON_MAP_MAX_AGE', 24 * 3600)  # Cache-Control max-age of /api/map responses
+
+# Server-side reports
+REPORT_WORKERS = _env_int('CARBON_REPORT_WORKERS', 2)  # matplotlib render processes
+REPORT_TIMEOUT = _env_float('CARBON_REPORT_TIMEOUT', 30)  # seconds a request waits for one render
+REPORT_CACHE_ENTRIES = _env_int('CARBON_REPORT_CACHE_ENTRIES', 256)  # rendered charts and PDFs kept in memory
+
+# Calculate result cache
+RESULT_CACHE_SIZE = _env_int('CARBON_RESULT_CACHE_SIZE', 1024)  # 0 disables the cache
+RESULT_CACHE_TTL = _env_float('CARBON_RESULT_CACHE_TTL', 600)
+
+# Instrumentation
+METRICS_ENABLED = _env_int('CARBON_METRICS', 1)  # 0 turns off /metrics and histogram updates
+SERVER_TIMING = _env_int('CARBON_SERVER_TIMING', 1)  # 0 drops the Server-Timing response header
+
+# Production serving (gunicorn.conf.py, wsgi.py)
+BIND = os.environ.get('CARBON_BIND', '0.0.0.0:8000')
+WORKERS = _env_int('CARBON_WORKERS', min(os.cpu_count() or 1, 8))  # pre-forked worker processes
+THREADS = _env_int('CARBON_THREADS', 8)  # request threads per worker
+WORKER_TIMEOUT = _env_float('CARBON_WORKER_TIMEOUT', 120)  # seconds a silent worker lives before it is restarted
+WARM_UP = os.environ.get('CARBON_WARM_UP', 'catalog,fleet,factors,depots,geocode,hubs')  # state loaded before serving
@@ -1,6 +1,9 @@
 import sqlite3
 import os
 
+from importer import UPSERT_SQL
+from migrations import migrate
+
 # Define database path
 base_dir = os.path.abspath(os.path.dirname(__file__))
 db_path = os.path.join(base_dir, 'database', 'carbon.db')
@@ -12,26 +15,8 @@ os.makedirs(os.path.dirname(db_path), exist_ok=True)
 conn = sqlite3.connect(db_path)
 cursor = conn.cursor()
 
-# Create table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS inventory_parts (
-    manufacturer TEXT,
-    part_name TEXT,
-    serial_id TEXT,
-    weight REAL,
-    drive_type TEXT,
-    used_hours REAL,
-    fuel_type TEXT,
-    steel REAL,
-    aluminum REAL,
-    rubber REAL,
-    other_material REAL,
-    steel_emissions REAL,
-    aluminum_emissions REAL,
-    rubber_emissions REAL,
-    manufacturing_emission REAL
-)
-''')
+# Create or upgrade the schema
+migrate(conn)
 
 # Seed data
 data = [('Caterpillar','Mining Haul Truck','797F',400,'Mechanical',5000,'Diesel',313.6,34,12,40.4,580.16,374,27.6,981.76),
@@ -75,14 +60,8 @@ data = [('Caterpillar','Mining Haul Truck','797F',400,'Mechanical',5000,'Diesel'
     # ('Volvo', 'Drill Machine X', 'VX99', 180, 'Electric', 1000, 'Electric', 180, 15, 5, 10, 290, 165, 11.5, 466.5)
 ]
 
-# Insert data
-cursor.executemany('''
-INSERT INTO inventory_parts (
-    manufacturer, part_name, serial_id, weight, drive_type, used_hours, fuel_type,
-    steel, aluminum, rubber, other_material,
-    steel_emissions, aluminum_emissions, rubber_emissions, manufacturing_emission
-) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-''', data)
+# Upsert data; re-running the seed updates rows instead of duplicating them
+cursor.executemany(UPSERT_SQL, data)
 
 # Finalize
 conn.commit()
@@ -0,0 +1,204 @@
+"""
+Streaming bulk import into ``inventory_parts``.
+
+Rows are read one at a time from a CSV file (with a header row) or a JSON
+Lines file, so the whole input is never held in memory. They are written in
+chunks, one transaction per chunk, as upserts on the (manufacturer, part_name,
+serial_id) key: re-importing a file updates parts in place, it never
+duplicates them. Usage:
+
+    python importer.py parts.csv [--format csv|jsonl] [--chunk-size 5000] [--db path/to/carbon.db]
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from migrations import INVENTORY_COLUMNS, migrate
+
+KEY_COLUMNS = ('manufacturer', 'part_name', 'serial_id')
+TEXT_COLUMNS = KEY_COLUMNS + ('drive_type', 'fuel_type')
+DEFAULT_CHUNK_SIZE = 5000
+
+UPSERT_SQL = (
+    f"INSERT INTO inventory_parts ({', '.join(INVENTORY_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(INVENTORY_COLUMNS))}) "
+    f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET "
+    + ', '.join(f'{column} = excluded.{column}' for column in INVENTORY_COLUMNS if column not in KEY_COLUMNS)
+)
+
+
+def to_row(record):
+    """
+    Converts one input record to an inventory_parts row.
+
+    Args:
+        record (dict): Column name -> value; missing or blank values become NULL
+
+    Returns:
+        tuple: Values in INVENTORY_COLUMNS order
+
+    Raises:
+        ValueError: If a key column is missing or a numeric column is not a number
+    """
+    row = []
+    for column in INVENTORY_COLUMNS:
+        value = record.get(column)
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == '':
+            if column in KEY_COLUMNS:
+                raise ValueError(f"Missing {column}")
+            row.append(None)
+        elif column in TEXT_COLUMNS:
+            row.append(str(value))
+        else:
+            try:
+                row.append(float(value))
+            except (TypeError, ValueError):
+                raise ValueError(f"{column} is not a number: {value!r}")
+    return tuple(row)
+
+
+def read_records(f, fmt):
+    """
+    Streams records from an open file.
+
+    Args:
+        f (file): Text file opened for reading
+        fmt (str): "csv" or "jsonl"
+
+    Yields:
+        tuple: (line_number, record) where record is a dict, or an Exception for an unparseable line
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, ValueError(f"Invalid JSON: {e}")
+                continue
+            yield line_number, record if isinstance(record, dict) else ValueError("Line is not a JSON object")
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+
+
+def import_rows(conn, rows, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Upserts rows in chunked transactions.
+
+    Args:
+        conn (sqlite3.Connection): Connection to a migrated inventory database
+        rows (iterable): Row tuples in INVENTORY_COLUMNS order
+        chunk_size (int): Rows per transaction
+        progress (callable, optional): Called with (rows_written, seconds) after every chunk
+
+    Returns:
+        dict: "rows", "chunks", "seconds" and "rows_per_second"
+    """
+    started = time.perf_counter()
+    written = 0
+    chunks = 0
+    chunk = []
+
+    def flush():
+        nonlocal written, chunks
+        with conn:
+            conn.executemany(UPSERT_SQL, chunk)
+        written += len(chunk)
+        chunks += 1
+        chunk.clear()
+        if progress is not None:
+            progress(written, time.perf_counter() - started)
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    seconds = time.perf_counter() - started
+    return {
+        'rows': written,
+        'chunks': chunks,
+        'seconds': seconds,
+        'rows_per_second': written / seconds if seconds > 0 else 0.0,
+    }
+
+
+def import_file(db_path, path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None, max_errors=10):
+    """
+    Imports a CSV or JSON Lines file into the inventory database.
+
+    Invalid records are skipped and counted; the first ``max_errors`` are
+    printed with their line numbers.
+
+    Args:
+        db_path (str): Inventory database file (migrated first if needed)
+        path (str): Input file
+        fmt (str, optional): "csv" or "jsonl". Defaults to the file extension
+        chunk_size (int): Rows per transaction
+        progress (callable, optional): Called with (rows_written, seconds) after every chunk
+        max_errors (int): Number of rejected records to print
+
+    Returns:
+        dict: Import statistics, including "rejected"
+    """
+    fmt = fmt or ('jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv')
+    rejected = 0
+
+    def rows(f):
+        nonlocal rejected
+        for line_number, record in read_records(f, fmt):
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                yield to_row(record)
+            except ValueError as e:
+                rejected += 1
+                if rejected <= max_errors:
+                    print(f"Skipping line {line_number}: {e}")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        migrate(conn)
+        with open(path, newline='', encoding='utf-8') as f:
+            stats = import_rows(conn, rows(f), chunk_size=chunk_size, progress=progress)
+    finally:
+        conn.close()
+    stats['rejected'] = rejected
+    return stats
+
+
+def main(argv=None):
+    base_dir = os.path.abspath(os.path.dirname(__file__))
+    parser = argparse.ArgumentParser(description='Bulk import inventory parts from CSV or JSON Lines.')
+    parser.add_argument('path', help='Input file')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='Input format (default: from the file extension)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows per transaction')
+    parser.add_argument('--db', default=os.path.join(base_dir, 'database', 'carbon.db'), help='Database file')
+    args = parser.parse_args(argv)
+
+    def progress(written, seconds):
+        print(f"{written} rows, {written / seconds if seconds > 0 else 0.0:.0f} rows/s")
+
+    stats = import_file(args.db, args.path, fmt=args.format, chunk_size=args.chunk_size, progress=progress)
+    print(f"✅ Imported {stats['rows']} rows in {stats['seconds']:.2f}s "
+          f"({stats['rows_per_second']:.0f} rows/s), {stats['rejected']} rejected")
+    return 0 if stats['rows'] or not stats['rejected'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
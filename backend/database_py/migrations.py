@@ -0,0 +1,102 @@
+"""
+Schema migrations for the inventory database.
+
+Each migration runs once, in order, inside its own transaction; the schema
+version is kept in ``PRAGMA user_version``. Run this file directly to migrate
+a database by hand:
+
+    python migrations.py [path/to/carbon.db]
+"""
+import os
+import sqlite3
+import sys
+
+# Imported as database_py.migrations by the app and as a top-level module by the scripts here.
+if __package__:
+    from . import summary
+else:
+    import summary
+
+INVENTORY_COLUMNS = (
+    'manufacturer', 'part_name', 'serial_id', 'weight', 'drive_type', 'used_hours', 'fuel_type',
+    'steel', 'aluminum', 'rubber', 'other_material',
+    'steel_emissions', 'aluminum_emissions', 'rubber_emissions', 'manufacturing_emission',
+)
+
+MIGRATIONS = [
+    (1, 'create inventory_parts', [
+        '''
+        CREATE TABLE IF NOT EXISTS inventory_parts (
+            manufacturer TEXT,
+            part_name TEXT,
+            serial_id TEXT,
+            weight REAL,
+            drive_type TEXT,
+            used_hours REAL,
+            fuel_type TEXT,
+            steel REAL,
+            aluminum REAL,
+            rubber REAL,
+            other_material REAL,
+            steel_emissions REAL,
+            aluminum_emissions REAL,
+            rubber_emissions REAL,
+            manufacturing_emission REAL
+        )
+        ''',
+    ]),
+    (2, 'unique part key and lookup indexes', [
+        # Earlier seeding appended duplicates on every run; keep the first copy of each part.
+        '''
+        DELETE FROM inventory_parts WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM inventory_parts GROUP BY manufacturer, part_name, serial_id
+        )
+        ''',
+        # Also serves manufacturer lookups (leftmost prefix) and SELECT DISTINCT manufacturer.
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_inventory_parts_key ON inventory_parts (manufacturer, part_name, serial_id)',
+        'CREATE INDEX IF NOT EXISTS idx_inventory_parts_serial_id ON inventory_parts (serial_id)',
+    ]),
+    (3, 'inventory_summary roll-ups maintained by triggers', summary.SCHEMA + summary.REBUILD),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """
+    Brings a database up to the latest schema version.
+
+    Args:
+        conn (sqlite3.Connection): Connection with no transaction in progress
+
+    Returns:
+        list: Versions that were applied
+    """
+    if conn.in_transaction:
+        conn.commit()
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        print(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+if __name__ == '__main__':
+    base_dir = os.path.abspath(os.path.dirname(__file__))
+    db_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, 'database', 'carbon.db')
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+    conn.close()
+    print(f"✅ {db_path} is at schema version {SCHEMA_VERSION}")
@@ -0,0 +1,177 @@
+"""
+Pre-aggregated inventory totals.
+
+``inventory_summary`` holds one row per (dimension, value): every
+manufacturer, drive type and fuel type, plus the fleet total under dimension
+"all". Triggers on ``inventory_parts`` add or subtract each changed row, so
+reading the totals costs the same whatever the inventory size. ``rebuild``
+recomputes the table from scratch and reports any drift. Usage:
+
+    python summary.py [path/to/carbon.db] [--check]
+"""
+import argparse
+import os
+import sqlite3
+
+DIMENSIONS = ('manufacturer', 'drive_type', 'fuel_type')
+FLEET = 'all'
+
+# Output column -> expression over one inventory_parts row; {row} is "NEW.", "OLD." or "".
+MEASURES = {
+    'weight': '{row}weight',
+    'used_hours': '{row}used_hours',
+    'steel': '{row}steel',
+    'aluminum': '{row}aluminum',
+    'rubber': '{row}rubber',
+    'other_material': '{row}other_material',
+    'steel_emissions': '{row}steel_emissions',
+    'aluminum_emissions': '{row}aluminum_emissions',
+    'rubber_emissions': '{row}rubber_emissions',
+    'manufacturing_emission': '{row}manufacturing_emission',
+    'weighted_manufacturing_emission': '{row}manufacturing_emission * {row}weight',
+}
+
+COLUMNS = ('parts',) + tuple(MEASURES)
+
+# Rounding noise tolerated by check() between incremental and recomputed sums.
+TOLERANCE = 1e-6
+
+
+def _dimension_value(dimension, row=''):
+    return "''" if dimension == FLEET else f"IFNULL({row}{dimension}, '')"
+
+
+def _apply(row, sign):
+    """Trigger statements adding (sign=1) or removing (sign=-1) the NEW or OLD row."""
+    prefix = f'{row}.'
+    negate = '-' if sign < 0 else ''
+    measures = ', '.join(f"{negate}IFNULL({expression.format(row=prefix)}, 0)" for expression in MEASURES.values())
+    updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in COLUMNS)
+    statements = [
+        f"INSERT INTO inventory_summary (dimension, value, {', '.join(COLUMNS)}) "
+        f"VALUES ('{dimension}', {_dimension_value(dimension, prefix)}, {sign}, {measures}) "
+        f"ON CONFLICT (dimension, value) DO UPDATE SET {updates};"
+        for dimension in DIMENSIONS + (FLEET,)
+    ]
+    if sign < 0:
+        statements.append('DELETE FROM inventory_summary WHERE parts <= 0;')
+    return '\n'.join(statements)
+
+
+SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS inventory_summary (
+        dimension TEXT NOT NULL,
+        value TEXT NOT NULL,
+        {', '.join(f'{column} {"INTEGER" if column == "parts" else "REAL"} NOT NULL' for column in COLUMNS)},
+        PRIMARY KEY (dimension, value)
+    ) WITHOUT ROWID
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS inventory_summary_insert AFTER INSERT ON inventory_parts
+    BEGIN
+    {_apply('NEW', 1)}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS inventory_summary_delete AFTER DELETE ON inventory_parts
+    BEGIN
+    {_apply('OLD', -1)}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS inventory_summary_update AFTER UPDATE ON inventory_parts
+    BEGIN
+    {_apply('OLD', -1)}
+    {_apply('NEW', 1)}
+    END
+    ''',
+]
+
+SELECT_TOTALS = ' UNION ALL '.join(
+    f"SELECT '{dimension}', {_dimension_value(dimension)}, COUNT(*), "
+    + ', '.join(f"TOTAL({expression.format(row='')})" for expression in MEASURES.values())
+    + ' FROM inventory_parts GROUP BY 2'  # also for the fleet row, so an empty inventory yields no rows
+    for dimension in DIMENSIONS + (FLEET,)
+)
+
+REBUILD = [
+    'DELETE FROM inventory_summary',
+    f"INSERT INTO inventory_summary (dimension, value, {', '.join(COLUMNS)}) "
+    f"{SELECT_TOTALS}",
+]
+
+
+def check(conn):
+    """
+    Compares the summary table with totals recomputed from inventory_parts.
+
+    Args:
+        conn (sqlite3.Connection): Connection to a migrated inventory database
+
+    Returns:
+        list: (dimension, value, column, stored, expected) tuples for every mismatch
+    """
+    stored = {(row[0], row[1]): row[2:] for row in conn.execute(
+        f"SELECT dimension, value, {', '.join(COLUMNS)} FROM inventory_summary")}
+    expected = {(row[0], row[1]): row[2:] for row in conn.execute(SELECT_TOTALS)}
+    mismatches = []
+    for key in sorted(stored.keys() | expected.keys()):
+        have = stored.get(key, (0,) * len(COLUMNS))
+        want = expected.get(key, (0,) * len(COLUMNS))
+        for column, a, b in zip(COLUMNS, have, want):
+            if abs(a - b) > TOLERANCE * max(1.0, abs(b)):
+                mismatches.append((key[0], key[1], column, a, b))
+    return mismatches
+
+
+def rebuild(conn):
+    """
+    Recomputes the summary table from inventory_parts in one transaction.
+
+    Args:
+        conn (sqlite3.Connection): Connection to a migrated inventory database
+
+    Returns:
+        list: The mismatches check() found before the rebuild
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        mismatches = check(conn)
+        for statement in REBUILD:
+            conn.execute(statement)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return mismatches
+
+
+def main():
+    base_dir = os.path.abspath(os.path.dirname(__file__))
+    parser = argparse.ArgumentParser(description='Rebuild or check the inventory summary table.')
+    parser.add_argument('db', nargs='?', default=os.path.join(base_dir, 'database', 'carbon.db'), help='Database file')
+    parser.add_argument('--check', action='store_true', help='only report drift, do not rebuild')
+    args = parser.parse_args()
+
+    from migrations import migrate
+
+    conn = sqlite3.connect(args.db)
+    try:
+        migrate(conn)
+        mismatches = check(conn) if args.check else rebuild(conn)
+    finally:
+        conn.close()
+    for dimension, value, column, stored, expected in mismatches:
+        print(f"{dimension}={value!r} {column}: stored {stored!r}, expected {expected!r}")
+    if args.check:
+        print(f"{'✅' if not mismatches else '❌'} {len(mismatches)} mismatches")
+        return 1 if mismatches else 0
+    print(f"✅ Rebuilt inventory_summary ({len(mismatches)} mismatches fixed)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
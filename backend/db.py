@@ -0,0 +1,260 @@
+"""
+SQLite access layer for the inventory database.
+
+Read connections are opened once and pooled; each one is tuned with WAL
+journaling, a memory map and a larger page cache, and keeps Python's
+prepared-statement cache warm because queries are reused verbatim. Writes go
+through a single serialized writer connection. The layer records how long
+callers wait for a connection and how long queries take, so the database's
+share of request latency is visible at /api/stats.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+from database_py.migrations import migrate
+from timing import stage
+
+
+class DatabaseStats:
+    """Thread-safe counters for pool waits, queries and writes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.pool_waits = 0
+            self.pool_wait_seconds = 0.0
+            self.pool_wait_max = 0.0
+            self.queries = 0
+            self.query_seconds = 0.0
+            self.query_max = 0.0
+            self.writes = 0
+            self.write_seconds = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.pool_waits += 1
+            self.pool_wait_seconds += seconds
+            self.pool_wait_max = max(self.pool_wait_max, seconds)
+
+    def record_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+            self.query_max = max(self.query_max, seconds)
+
+    def record_write(self, seconds):
+        with self._lock:
+            self.writes += 1
+            self.write_seconds += seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'pool_waits': self.pool_waits,
+                'pool_wait_seconds': self.pool_wait_seconds,
+                'pool_wait_avg': self.pool_wait_seconds / self.pool_waits if self.pool_waits else 0.0,
+                'pool_wait_max': self.pool_wait_max,
+                'queries': self.queries,
+                'query_seconds': self.query_seconds,
+                'query_avg': self.query_seconds / self.queries if self.queries else 0.0,
+                'query_max': self.query_max,
+                'writes': self.writes,
+                'write_seconds': self.write_seconds,
+            }
+
+
+class Database:
+    """
+    Pooled read connections plus one serialized writer for a SQLite file.
+
+    Pending schema migrations are applied when the database is opened.
+
+    Args:
+        path (str): Database file
+        pool_size (int): Maximum number of read connections
+        mmap_size (int): Bytes of the file mapped into memory per connection
+        cache_size_kib (int): Page cache per connection, in KiB
+        statement_cache (int): Prepared statements cached per connection
+
+    Raises:
+        FileNotFoundError: If the database file does not exist
+    """
+
+    def __init__(self, path=config.DB_PATH, pool_size=config.DB_POOL_SIZE, mmap_size=config.DB_MMAP_SIZE,
+                 cache_size_kib=config.DB_CACHE_SIZE_KIB, statement_cache=config.DB_STATEMENT_CACHE):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Database not found at {path}")
+        self.path = path
+        self.pool_size = pool_size
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.statement_cache = statement_cache
+        self.stats = DatabaseStats()
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._pool_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+        # WAL is persistent in the file; switching once lets readers run alongside the writer.
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+            migrate(conn)
+        finally:
+            conn.close()
+
+    def _connect(self, readonly):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=self.statement_cache)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kib)}')
+        if readonly:
+            conn.execute('PRAGMA query_only = 1')
+        else:
+            conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if self._opened < self.pool_size:
+                self._opened += 1
+                try:
+                    return self._connect(readonly=True)
+                except sqlite3.Error:
+                    self._opened -= 1
+                    raise
+        started = time.perf_counter()
+        conn = self._pool.get()
+        self.stats.record_wait(time.perf_counter() - started)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """
+        Borrows a read connection from the pool.
+
+        Yields:
+            sqlite3.Connection: A read-only connection, returned to the pool afterwards
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def fetchall(self, sql, params=()):
+        """
+        Runs a read query and returns every row.
+
+        Args:
+            sql (str): Query text; keep it constant so its prepared statement is reused
+            params (tuple): Query parameters
+
+        Returns:
+            list: sqlite3.Row objects
+        """
+        with stage('db'), self.reader() as conn:
+            started = time.perf_counter()
+            rows = conn.execute(sql, params).fetchall()
+            self.stats.record_query(time.perf_counter() - started)
+        return rows
+
+    def fetchone(self, sql, params=()):
+        """
+        Runs a read query and returns the first row.
+
+        Args:
+            sql (str): Query text
+            params (tuple): Query parameters
+
+        Returns:
+            sqlite3.Row | None: The first row, or None if the query returned nothing
+        """
+        with stage('db'), self.reader() as conn:
+            started = time.perf_counter()
+            row = conn.execute(sql, params).fetchone()
+            self.stats.record_query(time.perf_counter() - started)
+        return row
+
+    @contextmanager
+    def writer(self):
+        """
+        Holds the writer connection for one transaction.
+
+        Commits when the block succeeds and rolls back when it raises. Only one
+        writer runs at a time.
+
+        Yields:
+            sqlite3.Connection: The writer connection
+        """
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect(readonly=False)
+            started = time.perf_counter()
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+            finally:
+                self.stats.record_write(time.perf_counter() - started)
+
+    def close(self):
+        """Closes every pooled connection and the writer; they reopen on next use."""
+        with self._pool_lock:
+            while True:
+                try:
+                    self._pool.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._opened = 0
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def stats_dict(self):
+        """
+        Returns pool and timing statistics.
+
+        Returns:
+            dict: Database statistics
+        """
+        stats = self.stats.as_dict()
+        stats['pool_size'] = self.pool_size
+        stats['pool_open'] = self._opened
+        stats['pool_idle'] = self._pool.qsize()
+        return stats
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database():
+    """
+    Returns the process-wide inventory database, creating it on first use.
+
+    Returns:
+        Database: The shared database
+    """
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database()
+    return _database
@@ -0,0 +1,145 @@
+"""
+Depot (distribution centre) registry with a spatial index.
+
+Depots are read once, from ``CARBON_DEPOTS_PATH`` (CSV with id, name, lat
+and lon columns) or, when ``CARBON_DEPOTS_TABLE`` is set, from that table of
+the inventory database, and indexed with ``spatial.SpatialIndex`` so finding
+the nearest of thousands of depots does not scan them all.
+"""
+import csv
+import hashlib
+import re
+import threading
+
+import config
+from spatial import SpatialIndex
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def load_depots_csv(path):
+    """
+    Reads depots from a CSV file.
+
+    Args:
+        path (str): CSV with id, name, lat and lon columns
+
+    Returns:
+        list: Depot dicts with id, name, lat and lon
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        return [
+            {'id': row['id'], 'name': row['name'], 'lat': float(row['lat']), 'lon': float(row['lon'])}
+            for row in csv.DictReader(f)
+        ]
+
+
+def load_depots_table(table):
+    """
+    Reads depots from a table of the inventory database.
+
+    Args:
+        table (str): Table with id, name, lat and lon columns
+
+    Returns:
+        list: Depot dicts with id, name, lat and lon
+
+    Raises:
+        ValueError: If the table name is not a plain identifier
+    """
+    if not _IDENTIFIER.match(table):
+        raise ValueError(f"Invalid depot table name: {table!r}")
+    from db import get_database
+
+    rows = get_database().fetchall(f'SELECT id, name, lat, lon FROM {table}')
+    return [{'id': str(row['id']), 'name': row['name'], 'lat': float(row['lat']), 'lon': float(row['lon'])}
+            for row in rows]
+
+
+class DepotIndex:
+    """
+    Depots plus their spatial index.
+
+    Args:
+        depots (list): Depot dicts with id, name, lat and lon
+        cell_km (float, optional): Grid cube size passed to SpatialIndex
+    """
+
+    def __init__(self, depots, cell_km=None):
+        self.depots = depots
+        self.index = SpatialIndex([d['lat'] for d in depots], [d['lon'] for d in depots], cell_km=cell_km)
+        digest = hashlib.sha1(repr([(d['id'], d['lat'], d['lon']) for d in depots]).encode('utf-8'))
+        self.version = digest.hexdigest()[:12]
+        self.queries = 0
+
+    def _depots(self, indices, distances):
+        self.queries += 1
+        return [dict(self.depots[i], distance=float(distance)) for i, distance in zip(indices.tolist(), distances)]
+
+    def nearest(self, lat, lon, k=1, radius_km=None):
+        """
+        Finds the depots closest to a location.
+
+        Args:
+            lat (float): Latitude in degrees
+            lon (float): Longitude in degrees
+            k (int): Maximum number of depots
+            radius_km (float, optional): Only depots within this great-circle distance
+
+        Returns:
+            list: Depot dicts with an added "distance" (km), nearest first
+        """
+        if radius_km is None:
+            return self._depots(*self.index.nearest(lat, lon, k))
+        return self._depots(*self.index.within(lat, lon, radius_km, limit=k))
+
+    def nearest_depot(self, lat, lon):
+        """
+        Returns the single closest depot.
+
+        Args:
+            lat (float): Latitude in degrees
+            lon (float): Longitude in degrees
+
+        Returns:
+            dict: Depot with "distance" (km)
+
+        Raises:
+            ValueError: If no depots are configured
+        """
+        found = self.nearest(lat, lon, 1)
+        if not found:
+            raise ValueError("No depots are configured")
+        return found[0]
+
+    def stats(self):
+        """
+        Returns the size, version and query count of the index.
+
+        Returns:
+            dict: Statistics
+        """
+        return {'depots': len(self.depots), 'version': self.version, 'queries': self.queries}
+
+
+_depot_index = None
+_depot_index_lock = threading.Lock()
+
+
+def get_depot_index():
+    """
+    Returns the process-wide depot index, loading the depots on first use.
+
+    Returns:
+        DepotIndex: The shared index
+    """
+    global _depot_index
+    if _depot_index is None:
+        with _depot_index_lock:
+            if _depot_index is None:
+                if config.DEPOTS_TABLE:
+                    depots = load_depots_table(config.DEPOTS_TABLE)
+                else:
+                    depots = load_depots_csv(config.DEPOTS_PATH)
+                _depot_index = DepotIndex(depots, cell_km=config.DEPOT_CELL_KM or None)
+    return _depot_index
@@ -0,0 +1,114 @@
+"""
+Emission formulas shared by the single and batch calculate endpoints.
+
+Every function works on plain floats and, unchanged, on NumPy arrays, so the
+batch endpoint evaluates a whole fleet with a handful of array operations.
+Factors come from an ``EmissionFactors`` snapshot (see ``factors.py``); a
+caller computing several figures of one result should take one snapshot and
+pass it to each function.
+"""
+import numpy as np
+
+from factors import current_factors
+
+
+def calc_emission(weight, distance, fuel_factor=None):
+    """
+    Calculates carbon emissions for a given weight and distance.
+    
+    Args:
+        weight (float): Weight of the cargo in kg
+        distance (float): Distance in kilometers
+        fuel_factor (float, optional): Fuel emission factor, e.g. factors.transport("Local").
+            Defaults to the current transport fuel factor
+        
+    Returns:
+        float: Total emissions in kg CO2
+    """
+    if fuel_factor is None:
+        fuel_factor = current_factors().fuel_factor
+    return weight * fuel_factor * distance
+
+
+def creation_fuel_factors(fuel_type, factors):
+    """
+    Looks up the CO2 factor of the fuel burnt building each part.
+
+    Args:
+        fuel_type (str | None | sequence): A part's fuel type, or one per part
+        factors (EmissionFactors): Factor snapshot
+
+    Returns:
+        float | ndarray: kg CO2 per unit of fuel, per part
+    """
+    if fuel_type is None or isinstance(fuel_type, str):
+        return factors.fuel(fuel_type)
+    by_type = {t: factors.fuel(t) for t in set(fuel_type)}
+    return np.array([by_type[t] for t in fuel_type], dtype=np.float64)
+
+
+def lifecycle_emissions(manufacturing_emission, weight, used_hours, factors=None, fuel_type=None):
+    """
+    Calculates creation emissions and the lifecycle totals for old and new equipment.
+
+    Args:
+        manufacturing_emission (float | ndarray): Manufacturing emission per unit of weight
+        weight (float | ndarray): Part weight
+        used_hours (float | ndarray): Hours the existing unit has been used
+        factors (EmissionFactors, optional): Factor snapshot. Defaults to the current factors
+        fuel_type (str | sequence, optional): Part fuel type (one per part for arrays); its
+            fuel factor prices the creation fuel. Defaults to the transport fuel
+
+    Returns:
+        tuple: (created_emissions, old_total_emissions, new_total_emissions), before logistics
+    """
+    if factors is None:
+        factors = current_factors()
+    constants = factors.constants
+    fuel_factor = creation_fuel_factors(fuel_type, factors)
+    created_emissions = (manufacturing_emission * weight) + (constants['creation_fuel'] * fuel_factor) - (constants['creation_fuel_credit'] * fuel_factor)
+    emissions_already_used = used_hours * constants['emission_rate_per_hour']
+    old_total_emissions = created_emissions - (constants['lifetime_emissions'] - emissions_already_used)
+    new_total_emissions = created_emissions
+    return created_emissions, old_total_emissions, new_total_emissions
+
+
+def fleet_emissions(manufacturing_emission, weight, used_hours, is_old, local_distance, global_distance, factors=None,
+                    fuel_type=None):
+    """
+    Evaluates the emission totals of many shipments at once.
+
+    Args:
+        manufacturing_emission (array-like): Manufacturing emission per unit of weight, per shipment
+        weight (array-like): Part weight, per shipment
+        used_hours (array-like): Used hours, per shipment
+        is_old (array-like): True where the shipment moves old equipment
+        local_distance (array-like): Local leg distance in km
+        global_distance (array-like): Global leg distance in km (0 when there is no global leg)
+        factors (EmissionFactors, optional): Factor snapshot. Defaults to the current factors
+        fuel_type (sequence, optional): Part fuel type, per shipment. Defaults to the transport fuel
+
+    Returns:
+        dict: Arrays keyed by result field (created_emission, old_total_emissions,
+        new_total_emissions, final_emission, local_emission, global_emission)
+    """
+    manufacturing_emission = np.asarray(manufacturing_emission, dtype=np.float64)
+    weight = np.asarray(weight, dtype=np.float64)
+    used_hours = np.asarray(used_hours, dtype=np.float64)
+    is_old = np.asarray(is_old, dtype=bool)
+    if factors is None:
+        factors = current_factors()
+
+    created, old_total, new_total = lifecycle_emissions(manufacturing_emission, weight, used_hours, factors, fuel_type)
+    local_emission = calc_emission(weight, np.asarray(local_distance, dtype=np.float64), factors.transport('Local'))
+    global_emission = calc_emission(weight, np.asarray(global_distance, dtype=np.float64), factors.transport('Global'))
+    total = np.where(is_old, old_total, new_total)
+
+    return {
+        'created_emission': created,
+        'old_total_emissions': old_total + local_emission + global_emission,
+        'new_total_emissions': new_total + local_emission + global_emission,
+        'final_emission': total + local_emission + global_emission,
+        'local_emission': local_emission,
+        'global_emission': global_emission,
+    }
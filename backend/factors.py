@@ -0,0 +1,259 @@
+"""
+Emission factor registry.
+
+Lifecycle constants, per-fuel factors and per-mode multipliers are read from
+``data/emission_factors.csv`` (``category,name,value,unit`` rows) into an
+immutable ``EmissionFactors`` snapshot. The registry checks the file's mtime
+at most once per ``check_interval`` seconds and, when it changed, parses the
+whole file into a new snapshot and swaps it in with a single assignment, so a
+calculation that took a snapshot keeps consistent factors to the end. A file
+that fails to parse (e.g. half-written) is reported and the previous snapshot
+stays in use.
+
+Every snapshot has a ``version`` (a hash of its values) that results are
+stamped with and cache keys include.
+"""
+import csv
+import hashlib
+import math
+import os
+import threading
+import time
+from types import MappingProxyType
+
+import config
+
+CATEGORIES = ('constant', 'fuel', 'mode')
+REQUIRED_CONSTANTS = ('creation_fuel', 'creation_fuel_credit', 'lifetime_emissions', 'emission_rate_per_hour')
+REQUIRED_MODES = ('Local', 'Global')
+
+# Fuel burnt by transport legs, and by building a part whose fuel type has no factor of its own.
+TRANSPORT_FUEL = 'Diesel'
+
+
+class EmissionFactors:
+    """
+    Read-only snapshot of the emission factors.
+
+    Args:
+        constants (dict): Lifecycle constant name -> value
+        fuels (dict): Fuel type -> kg CO2 per unit of fuel
+        modes (dict): Transport mode -> emission multiplier
+    """
+
+    __slots__ = ('constants', 'fuels', 'modes', 'version', 'fuel_factor')
+
+    def __init__(self, constants, fuels, modes):
+        missing = [f"constant {name}" for name in REQUIRED_CONSTANTS if name not in constants]
+        missing += [f"mode {name}" for name in REQUIRED_MODES if name not in modes]
+        if TRANSPORT_FUEL not in fuels:
+            missing.append(f"fuel {TRANSPORT_FUEL}")
+        if missing:
+            raise ValueError(f"Missing emission factors: {', '.join(missing)}")
+        setattr_ = super().__setattr__
+        setattr_('constants', MappingProxyType(dict(constants)))
+        setattr_('fuels', MappingProxyType(dict(fuels)))
+        setattr_('modes', MappingProxyType(dict(modes)))
+        setattr_('fuel_factor', fuels[TRANSPORT_FUEL])
+        canonical = repr([sorted(constants.items()), sorted(fuels.items()), sorted(modes.items())])
+        setattr_('version', hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:12])
+
+    def __setattr__(self, name, value):
+        raise AttributeError('EmissionFactors is immutable')
+
+    def fuel(self, fuel_type):
+        """
+        Returns the CO2 factor of a fuel type.
+
+        Args:
+            fuel_type (str): e.g. "Diesel" or "Diesel-electric"; None for an unrecorded type
+
+        Returns:
+            float: kg CO2 per unit of fuel; the transport fuel's factor for unknown types
+        """
+        return self.fuels.get(fuel_type, self.fuel_factor)
+
+    def transport(self, mode):
+        """
+        Returns the factor a leg's weight × distance is multiplied by.
+
+        Args:
+            mode (str): "Local", "Global" or a transport mode such as "road" or "sea"
+
+        Returns:
+            float: Transport fuel factor times the mode multiplier
+
+        Raises:
+            KeyError: If the mode has no multiplier
+        """
+        return self.fuel_factor * self.modes[mode]
+
+    def to_dict(self):
+        """
+        Returns the snapshot as plain dicts.
+
+        Returns:
+            dict: version plus constants, fuels and modes
+        """
+        return {
+            'version': self.version,
+            'constants': dict(self.constants),
+            'fuels': dict(self.fuels),
+            'modes': dict(self.modes),
+        }
+
+
+def load_factors(path):
+    """
+    Parses a factor CSV file.
+
+    Args:
+        path (str): CSV with category, name, value and unit columns
+
+    Returns:
+        EmissionFactors: The parsed snapshot
+
+    Raises:
+        ValueError: If a row is malformed, duplicated or a required factor is missing
+        OSError: If the file cannot be read
+    """
+    tables = {category: {} for category in CATEGORIES}
+    with open(path, newline='', encoding='utf-8') as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            category, name = (row.get('category') or '').strip(), (row.get('name') or '').strip()
+            if category not in tables:
+                raise ValueError(f"{path}:{line}: unknown category {category!r}")
+            try:
+                value = float(row.get('value'))
+            except (TypeError, ValueError):
+                raise ValueError(f"{path}:{line}: value of {name!r} is not a number") from None
+            if not math.isfinite(value) or value < 0:
+                raise ValueError(f"{path}:{line}: value of {name!r} must be a non-negative number")
+            if name in tables[category]:
+                raise ValueError(f"{path}:{line}: duplicate {category} {name!r}")
+            tables[category][name] = value
+    return EmissionFactors(tables['constant'], tables['fuel'], tables['mode'])
+
+
+class FactorRegistry:
+    """
+    Hot-reloading holder of the current EmissionFactors snapshot.
+
+    Args:
+        path (str): Factor CSV file
+        check_interval (float): Minimum seconds between mtime checks
+    """
+
+    def __init__(self, path=config.FACTORS_PATH, check_interval=config.FACTORS_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self.reload_errors = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._stat = self._file_stat()
+        self._factors = load_factors(path)
+        self.loaded_at = time.time()
+
+    def _file_stat(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def add_listener(self, callback):
+        """
+        Registers a callback run after every reload (not the initial load).
+
+        Args:
+            callback (callable): Called with the new EmissionFactors once they are in place
+        """
+        self._listeners.append(callback)
+
+    def refresh(self, force=False):
+        """
+        Reloads the factors if the file changed since the last load.
+
+        Args:
+            force (bool): Reload without comparing mtimes
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        with self._lock:
+            if not force and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                stat = self._file_stat()
+                if not force and stat == self._stat:
+                    return
+                # Remember the new stat first, so a broken file is reported once, not on every check.
+                self._stat = stat
+                factors = load_factors(self.path)
+            except (OSError, ValueError) as e:
+                self.reload_errors += 1
+                print(f"Error reloading emission factors, keeping version {self._factors.version}: {e}")
+                return
+            previous, self._factors = self._factors, factors
+            self.loaded_at = time.time()
+            self.reloads += 1
+        if factors.version != previous.version:
+            for listener in self._listeners:
+                listener(factors)
+
+    def current(self):
+        """
+        Returns the current snapshot, reloading it first if the file changed.
+
+        Take one snapshot per calculation and pass it along, so every figure
+        of a result comes from the same factors.
+
+        Returns:
+            EmissionFactors: The snapshot
+        """
+        self.refresh()
+        return self._factors
+
+    def stats(self):
+        """
+        Returns the loaded version and reload counters.
+
+        Returns:
+            dict: Statistics
+        """
+        return {
+            'version': self._factors.version,
+            'path': self.path,
+            'reloads': self.reloads,
+            'reload_errors': self.reload_errors,
+            'loaded_at': self.loaded_at,
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_factor_registry():
+    """
+    Returns the process-wide factor registry, loading the factor file on first use.
+
+    Returns:
+        FactorRegistry: The shared registry
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = FactorRegistry()
+    return _registry
+
+
+def current_factors():
+    """
+    Returns the current emission factors of the shared registry.
+
+    Returns:
+        EmissionFactors: The snapshot
+    """
+    return get_factor_registry().current()
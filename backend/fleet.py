@@ -0,0 +1,449 @@
+"""
+Columnar in-memory model of ``inventory_parts`` for fleet analytics.
+
+Every numeric column is one float64 NumPy array (NULL is NaN) and every text
+column is dictionary-encoded: an array of the smallest unsigned integer
+codes that fit, plus the list of distinct values. A part costs under 100
+bytes of arrays plus its share of the dictionaries (about a fifth of a
+fetched ``sqlite3.Row`` with its Python floats and strings), and a filter,
+group-by or aggregate over hundreds of thousands of parts is a handful of
+array operations.
+
+The table loads in one pass over the inventory, or from a snapshot directory
+(one ``.npy`` file per array plus ``manifest.json``) whose arrays are
+memory-mapped: pages are read on demand and shared through the page cache by
+every process mapping the same files. ``get_fleet`` keeps the snapshot at
+``CARBON_FLEET_SNAPSHOT_DIR`` in step with the catalog's ETag.
+"""
+import json
+import os
+import shutil
+import sys
+import threading
+
+import numpy as np
+
+import config
+from catalog import get_catalog
+from db import get_database
+
+NUMERIC_COLUMNS = (
+    'weight', 'used_hours', 'steel', 'aluminum', 'rubber', 'other_material',
+    'steel_emissions', 'aluminum_emissions', 'rubber_emissions', 'manufacturing_emission',
+)
+TEXT_COLUMNS = ('manufacturer', 'part_name', 'serial_id', 'drive_type', 'fuel_type')
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max')
+
+SNAPSHOT_FORMAT = 1
+MANIFEST = 'manifest.json'
+
+# Rows fetched per batch while loading.
+FETCH_SIZE = 10000
+
+
+def _code_dtype(size):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if size <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+class FleetTable:
+    """
+    Inventory parts stored column by column.
+
+    Args:
+        numeric (dict): Numeric column name -> float64 array
+        codes (dict): Text column name -> integer code array
+        dictionaries (dict): Text column name -> list of distinct values, indexed by code
+        etag (str, optional): Catalog ETag of the data
+        source (str): "database" or "snapshot"
+    """
+
+    def __init__(self, numeric, codes, dictionaries, etag=None, source='database'):
+        self.numeric = numeric
+        self.codes = codes
+        self.dictionaries = dictionaries
+        self.etag = etag
+        self.source = source
+        self._lookups = {}
+        self.queries = 0
+
+    def __len__(self):
+        return len(next(iter(self.numeric.values())))
+
+    @classmethod
+    def from_rows(cls, rows, etag=None):
+        """
+        Builds the table in one pass over rows.
+
+        Args:
+            rows (iterable): Batches (lists) of tuples ordered like TEXT_COLUMNS + NUMERIC_COLUMNS
+            etag (str, optional): Catalog ETag of the data
+
+        Returns:
+            FleetTable: The table
+        """
+        lookups = {name: {} for name in TEXT_COLUMNS}
+        numeric_chunks = {name: [] for name in NUMERIC_COLUMNS}
+        code_chunks = {name: [] for name in TEXT_COLUMNS}
+        for batch in rows:
+            if not batch:
+                continue
+            values = list(zip(*batch))
+            for name, column in zip(TEXT_COLUMNS, values):
+                lookup = lookups[name]
+                for value in dict.fromkeys(column):  # new values get codes in order of first appearance
+                    if value not in lookup:
+                        lookup[value] = len(lookup)
+                code_chunks[name].append(np.array(list(map(lookup.__getitem__, column)), dtype=np.int64))
+            for name, column in zip(NUMERIC_COLUMNS, values[len(TEXT_COLUMNS):]):
+                numeric_chunks[name].append(np.array(column, dtype=np.float64))
+
+        numeric = {name: np.concatenate(chunks) if chunks else np.empty(0) for name, chunks in numeric_chunks.items()}
+        codes = {}
+        for name, chunks in code_chunks.items():
+            merged = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+            codes[name] = merged.astype(_code_dtype(len(lookups[name])))
+        dictionaries = {name: list(lookup) for name, lookup in lookups.items()}
+        return cls(numeric, codes, dictionaries, etag)
+
+    @classmethod
+    def from_database(cls, database, etag=None):
+        """
+        Loads the table from the inventory database in one pass.
+
+        Args:
+            database (Database): Inventory database
+            etag (str, optional): Catalog ETag of the data
+
+        Returns:
+            FleetTable: The table
+        """
+        sql = f"SELECT {', '.join(TEXT_COLUMNS + NUMERIC_COLUMNS)} FROM inventory_parts ORDER BY rowid"
+        with database.reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None  # plain tuples: no Row object per part
+            cursor.execute(sql)
+            return cls.from_rows(iter(lambda: cursor.fetchmany(FETCH_SIZE), []), etag)
+
+    def save(self, path):
+        """
+        Writes the table as a snapshot directory, replacing any previous snapshot.
+
+        The files are written to a sibling directory first and swapped in with
+        renames; processes that mapped the previous files keep reading them.
+
+        Args:
+            path (str): Snapshot directory
+        """
+        path = path.rstrip(os.sep)
+        staging = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        manifest = {
+            'format': SNAPSHOT_FORMAT,
+            'rows': len(self),
+            'etag': self.etag,
+            'numeric': {},
+            'text': {},
+        }
+        for name, array in self.numeric.items():
+            np.save(os.path.join(staging, f'{name}.npy'), array)
+            manifest['numeric'][name] = str(array.dtype)
+        for name, array in self.codes.items():
+            np.save(os.path.join(staging, f'{name}.codes.npy'), array)
+            manifest['text'][name] = {'dtype': str(array.dtype), 'values': self.dictionaries[name]}
+        with open(os.path.join(staging, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+        previous = f'{path}.old-{os.getpid()}-{threading.get_ident()}'
+        if os.path.exists(path):
+            os.rename(path, previous)
+        os.rename(staging, path)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    @staticmethod
+    def read_manifest(path):
+        """
+        Reads a snapshot's manifest.
+
+        Args:
+            path (str): Snapshot directory
+
+        Returns:
+            dict | None: The manifest, or None if there is no snapshot
+        """
+        try:
+            with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Opens a snapshot directory.
+
+        Args:
+            path (str): Snapshot directory
+            mmap (bool): Memory-map the arrays read-only instead of reading them
+
+        Returns:
+            FleetTable: The table
+
+        Raises:
+            ValueError: If the snapshot is missing, of another format or inconsistent
+        """
+        manifest = cls.read_manifest(path)
+        if manifest is None or manifest.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"No fleet snapshot of format {SNAPSHOT_FORMAT} in {path}")
+        mode = 'r' if mmap else None
+        numeric = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode) for name in NUMERIC_COLUMNS}
+        codes = {name: np.load(os.path.join(path, f'{name}.codes.npy'), mmap_mode=mode) for name in TEXT_COLUMNS}
+        dictionaries = {name: manifest['text'][name]['values'] for name in TEXT_COLUMNS}
+        if any(len(array) != manifest['rows'] for array in list(numeric.values()) + list(codes.values())):
+            raise ValueError(f"Fleet snapshot in {path} has columns of different lengths")
+        return cls(numeric, codes, dictionaries, manifest.get('etag'), source='snapshot')
+
+    def _lookup(self, name):
+        """Value -> code of a text column, built on first use (it is as large as the dictionary)."""
+        lookup = self._lookups.get(name)
+        if lookup is None:
+            lookup = self._lookups[name] = {value: code for code, value in enumerate(self.dictionaries[name])}
+        return lookup
+
+    def mask(self, where=None):
+        """
+        Selects rows.
+
+        Args:
+            where (dict, optional): Column -> condition. A text column takes a value
+                (string, number or null) or a list of values; a numeric column takes a
+                number or {"min": ..., "max": ...} (inclusive, either optional)
+
+        Returns:
+            ndarray: Boolean array, True for the selected rows
+
+        Raises:
+            ValueError: If a column is unknown or a condition malformed
+        """
+        selected = np.ones(len(self), dtype=bool)
+        for name, condition in (where or {}).items():
+            if name in self.codes:
+                wanted = condition if isinstance(condition, list) else [condition]
+                if not all(value is None or isinstance(value, (str, int, float)) for value in wanted):
+                    raise ValueError(f"{name}: expected a string, a number or a list of them")
+                lookup = self._lookup(name)
+                found = [lookup[value] for value in wanted if value in lookup]
+                selected &= np.isin(self.codes[name], np.array(found, dtype=self.codes[name].dtype))
+            elif name in self.numeric:
+                column = self.numeric[name]
+                if isinstance(condition, dict) and set(condition) <= {'min', 'max'}:
+                    try:
+                        if condition.get('min') is not None:
+                            selected &= column >= float(condition['min'])
+                        if condition.get('max') is not None:
+                            selected &= column <= float(condition['max'])
+                    except (TypeError, ValueError):
+                        raise ValueError(f"{name}: min and max must be numbers")
+                elif isinstance(condition, (int, float)) and not isinstance(condition, bool):
+                    selected &= column == condition
+                else:
+                    raise ValueError(f"{name}: expected a number or {{min, max}}")
+            else:
+                raise ValueError(f"Unknown column: {name}")
+        return selected
+
+    def decode(self, name, codes):
+        """
+        Turns codes of a text column back into values.
+
+        Args:
+            name (str): Text column
+            codes (ndarray): Codes
+
+        Returns:
+            list: Values
+        """
+        values = self.dictionaries[name]
+        return [values[code] for code in codes.tolist()]
+
+    def query(self, where=None, group_by=(), aggregates=('count',), order_by=None, limit=None):
+        """
+        Filters, groups and aggregates the table.
+
+        Args:
+            where (dict | ndarray, optional): Row filter as for mask(), or a mask it returned
+            group_by (list): Text columns to group by; empty for one fleet-wide group
+            aggregates (list): "count" or "<function>:<numeric column>" with
+                function sum, mean, min or max. NULLs are skipped; "sum" of no
+                values is 0, "mean", "min" and "max" of no values are None
+            order_by (str, optional): Output field to sort groups by; prefix "-" for descending
+            limit (int, optional): Maximum number of groups
+
+        Returns:
+            list: One dict per group with the group_by values and one field per
+            aggregate ("count", "sum_weight", ...), largest groups first unless order_by is given
+
+        Raises:
+            ValueError: If a column, aggregate or order_by field is unknown
+        """
+        for name in group_by:
+            if name not in self.codes:
+                raise ValueError(f"Cannot group by {name}; use one of {', '.join(TEXT_COLUMNS)}")
+        specs = []
+        for aggregate in aggregates:
+            function, _, column = aggregate.partition(':')
+            if function not in AGGREGATES or (function == 'count') != (column == '') or \
+                    (column and column not in self.numeric):
+                raise ValueError(f"Unknown aggregate {aggregate!r}; use count or <sum|mean|min|max>:<numeric column>")
+            specs.append((function, column, function if function == 'count' else f'{function}_{column}'))
+
+        fields = [field for _, _, field in specs]
+        if order_by is not None and order_by.lstrip('-') not in fields and order_by.lstrip('-') not in group_by:
+            raise ValueError(f"Cannot order by {order_by.lstrip('-')}; use a group_by column or an aggregate")
+
+        self.queries += 1
+        rows = np.flatnonzero(where if isinstance(where, np.ndarray) else self.mask(where))
+
+        # One group id per row: the distinct combinations of its group codes, numbered.
+        if not group_by:
+            keys, group = np.zeros((0, 1), dtype=np.int64), np.zeros(rows.size, dtype=np.int64)
+        elif np.prod([float(len(self.dictionaries[name])) for name in group_by]) < 2 ** 62:
+            key = np.zeros(rows.size, dtype=np.int64)
+            for name in group_by:
+                key = key * len(self.dictionaries[name]) + self.codes[name][rows]
+            unique, group = np.unique(key, return_inverse=True)
+            keys = np.empty((len(group_by), unique.size), dtype=np.int64)
+            for i, name in reversed(list(enumerate(group_by))):
+                unique, keys[i] = np.divmod(unique, len(self.dictionaries[name]))
+        else:
+            stacked = np.stack([self.codes[name][rows].astype(np.int64) for name in group_by])
+            keys, group = np.unique(stacked, axis=1, return_inverse=True)
+        group = group.reshape(-1)
+        groups = keys.shape[1] if group_by else 1
+        order = np.argsort(group, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(group[order]) != 0]) if rows.size else None
+
+        counts = np.bincount(group, minlength=groups)
+        columns = {name: self.decode(name, keys[i]) for i, name in enumerate(group_by)}
+        for function, column, field in specs:
+            if function == 'count':
+                columns[field] = counts
+                continue
+            values = self.numeric[column][rows]
+            present = ~np.isnan(values)
+            if function in ('sum', 'mean'):
+                sums = np.bincount(group, weights=np.where(present, values, 0.0), minlength=groups)
+                if function == 'sum':
+                    columns[field] = sums
+                else:
+                    known = np.bincount(group, weights=present, minlength=groups)
+                    columns[field] = np.where(known > 0, sums / np.maximum(known, 1), np.nan)
+            elif starts is None:
+                columns[field] = np.full(groups, np.nan)
+            else:
+                reduce = np.fmin if function == 'min' else np.fmax
+                columns[field] = reduce.reduceat(values[order], starts)
+
+        if order_by is None:
+            ranking = np.argsort(-counts, kind='stable')  # largest groups first
+        else:
+            ranking = range(groups)
+        result = []
+        for i in ranking:
+            entry = {}
+            for field, values in columns.items():
+                value = values[i] if isinstance(values, list) else values[i].item()
+                entry[field] = None if isinstance(value, float) and np.isnan(value) else value
+            result.append(entry)
+
+        if order_by is not None:
+            field = order_by.lstrip('-')
+            present = [entry for entry in result if entry[field] is not None]
+            missing = [entry for entry in result if entry[field] is None]
+            result = sorted(present, key=lambda entry: entry[field], reverse=order_by.startswith('-')) + missing
+        return result[:limit] if limit is not None else result
+
+    def memory_bytes(self):
+        """
+        Returns the size of the arrays and dictionaries.
+
+        Returns:
+            int: Bytes; memory-mapped arrays count in full although they are paged in on demand
+        """
+        size = sum(array.nbytes for array in self.numeric.values())
+        size += sum(array.nbytes for array in self.codes.values())
+        size += sum(sys.getsizeof(value) for values in self.dictionaries.values() for value in values)
+        return size
+
+    def stats(self):
+        """
+        Returns the size, source and query count of the table.
+
+        Returns:
+            dict: Statistics
+        """
+        rows = len(self)
+        size = self.memory_bytes()
+        return {
+            'rows': rows,
+            'bytes': size,
+            'bytes_per_row': size / rows if rows else 0.0,
+            'source': self.source,
+            'etag': self.etag,
+            'queries': self.queries,
+        }
+
+
+def load_fleet(etag, snapshot_dir=None):
+    """
+    Opens the snapshot if it holds the given catalog version, else loads the
+    inventory and writes a new snapshot.
+
+    Args:
+        etag (str): Catalog ETag the table must match
+        snapshot_dir (str, optional): Snapshot directory; defaults to
+            CARBON_FLEET_SNAPSHOT_DIR, "" for no snapshot
+
+    Returns:
+        FleetTable: The table
+    """
+    snapshot_dir = config.FLEET_SNAPSHOT_DIR if snapshot_dir is None else snapshot_dir
+    if snapshot_dir:
+        try:
+            manifest = FleetTable.read_manifest(snapshot_dir)
+            if manifest is not None and manifest.get('etag') == etag:
+                return FleetTable.load(snapshot_dir)
+        except (OSError, ValueError) as e:
+            print(f"Error opening fleet snapshot {snapshot_dir}: {e}")
+    table = FleetTable.from_database(get_database(), etag)
+    if snapshot_dir:
+        try:
+            table.save(snapshot_dir)
+        except OSError as e:
+            print(f"Error writing fleet snapshot {snapshot_dir}: {e}")
+    return table
+
+
+_fleet = None
+_fleet_lock = threading.Lock()
+
+
+def get_fleet():
+    """
+    Returns the process-wide fleet table, reloading it when the catalog changed.
+
+    Returns:
+        FleetTable: The shared table
+    """
+    global _fleet
+    catalog = get_catalog()
+    catalog.refresh()
+    etag = catalog.etag
+    if _fleet is None or _fleet.etag != etag:
+        with _fleet_lock:
+            if _fleet is None or _fleet.etag != etag:
+                _fleet = load_fleet(etag)
+    return _fleet
@@ -0,0 +1,113 @@
+"""
+Great-circle geometry shared by the routing and emission code.
+
+The scalar ``haversine`` used on the per-request paths is plain ``math``:
+building NumPy arrays for a single pair costs more than the arithmetic.
+``haversine_matrix`` and the batch paths use a NumPy kernel with the same
+formula, so both agree to within floating-point rounding.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+# Cells computed per block; each block needs a few float64 temporaries of this size.
+MATRIX_BLOCK_CELLS = 1 << 20
+
+
+def _haversine_kernel(phi1, lam1, cos_phi1, phi2, lam2, cos_phi2):
+    """
+    Great-circle distance with NumPy broadcasting, on coordinates already in radians.
+
+    Args:
+        phi1, lam1, cos_phi1 (ndarray): Latitude, longitude and cos(latitude) of the first points
+        phi2, lam2, cos_phi2 (ndarray): The same for the second points, broadcastable against the first
+
+    Returns:
+        ndarray: Distances in kilometers
+    """
+    a = np.sin((phi2 - phi1) * 0.5)
+    np.square(a, out=a)
+    b = np.sin((lam2 - lam1) * 0.5)
+    np.square(b, out=b)
+    b *= cos_phi1
+    b *= cos_phi2
+    a += b
+    np.clip(a, 0.0, 1.0, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * EARTH_RADIUS_KM
+    return a
+
+
+def _prepare(lat, lon):
+    phi = np.radians(np.asarray(lat, dtype=np.float64).ravel())
+    lam = np.radians(np.asarray(lon, dtype=np.float64).ravel())
+    return phi, lam, np.cos(phi)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Calculates the great-circle distance between two points on the Earth's surface.
+
+    Args:
+        lat1 (float): Latitude of first point in degrees
+        lon1 (float): Longitude of first point in degrees
+        lat2 (float): Latitude of second point in degrees
+        lon2 (float): Longitude of second point in degrees
+
+    Returns:
+        float: Distance between points in kilometers
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) * 0.5) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) * 0.5) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def iter_haversine_matrix(lat1, lon1, lat2, lon2, block_cells=MATRIX_BLOCK_CELLS, dtype=np.float64):
+    """
+    Computes all-pairs distances block by block with bounded memory.
+
+    Args:
+        lat1, lon1 (array-like): Latitudes and longitudes of the N origins in degrees
+        lat2, lon2 (array-like): Latitudes and longitudes of the M destinations in degrees
+        block_cells (int): Approximate number of cells per block
+        dtype: dtype of the yielded blocks
+
+    Yields:
+        tuple: (row_start, block) where block is a (rows, M) ndarray of distances in km
+        for origins row_start .. row_start + rows - 1
+    """
+    phi1, lam1, cos_phi1 = (column[:, np.newaxis] for column in _prepare(lat1, lon1))
+    phi2, lam2, cos_phi2 = (row[np.newaxis, :] for row in _prepare(lat2, lon2))
+    rows_per_block = max(1, block_cells // max(1, phi2.shape[1]))
+    for start in range(0, phi1.shape[0], rows_per_block):
+        stop = start + rows_per_block
+        block = _haversine_kernel(phi1[start:stop], lam1[start:stop], cos_phi1[start:stop], phi2, lam2, cos_phi2)
+        yield start, block.astype(dtype, copy=False)
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2, dtype=np.float64):
+    """
+    Computes the N x M great-circle distance matrix.
+
+    The result is written block by block into one preallocated array, so peak
+    memory is the result plus one block of temporaries. Use float32 to halve
+    the size of very large matrices (10k x 10k is 400 MB instead of 800 MB).
+
+    Args:
+        lat1, lon1 (array-like): Latitudes and longitudes of the N origins in degrees
+        lat2, lon2 (array-like): Latitudes and longitudes of the M destinations in degrees
+        dtype: dtype of the result
+
+    Returns:
+        ndarray: (N, M) distances in kilometers
+    """
+    n = np.size(lat1)
+    m = np.size(lat2)
+    out = np.empty((n, m), dtype=dtype)
+    for start, block in iter_haversine_matrix(lat1, lon1, lat2, lon2, dtype=dtype):
+        out[start:start + block.shape[0]] = block
+    return out
@@ -0,0 +1,389 @@
+"""
+Geocoding with a persistent cache in front of a pluggable resolver.
+
+A resolver turns a place name into ``(latitude, longitude)`` or ``None`` when
+the name does not resolve. ``NominatimResolver`` asks OpenStreetMap's public
+service; ``GazetteerResolver`` reads a local CSV file and is meant for tests
+and air-gapped deployments. ``Geocoder`` puts a SQLite-backed ``GeocodeCache``
+in front of whichever resolver is configured, and answers from expired
+entries while the upstream is failing.
+"""
+import csv
+import os
+import sqlite3
+import threading
+import time
+
+import config
+from timing import stage
+from upstream import UpstreamError, get_upstream, record_fallback
+
+
+def normalize_query(name):
+    """
+    Normalizes a location name so trivially different spellings share a cache entry.
+
+    Args:
+        name (str): Location name as typed by the user
+
+    Returns:
+        str: Case-folded name with surrounding and repeated whitespace removed
+    """
+    return ' '.join(str(name).split()).casefold()
+
+
+class NominatimResolver:
+    """
+    Resolves names with the OpenStreetMap Nominatim service.
+
+    Lookups go through the shared "nominatim" ``upstream`` client
+    (``CARBON_NOMINATIM_SCHEME``/``CARBON_NOMINATIM_DOMAIN``), which keeps
+    connections alive, stays within Nominatim's rate limit across every
+    thread and worker process, and fails fast while the service is unhealthy.
+
+    Args:
+        client (UpstreamClient, optional): Defaults to the shared "nominatim" client
+    """
+
+    name = 'nominatim'
+
+    def __init__(self, client=None):
+        self.client = client or get_upstream('nominatim')
+
+    def resolve(self, name):
+        """
+        Geocodes a location name.
+
+        Args:
+            name (str): The name of the location to geocode
+
+        Returns:
+            tuple | None: (latitude, longitude), or None if the name does not resolve
+
+        Raises:
+            UpstreamError: If Nominatim cannot be reached, answers an error or garbage,
+                no rate-limit slot frees up in time, or its circuit breaker is open
+        """
+        response = self.client.get('/search', params={'q': name, 'format': 'json', 'limit': 1})
+        if response.status_code != 200:
+            raise UpstreamError(f"Nominatim answered HTTP {response.status_code}")
+        try:
+            places = response.json()
+            if not places:
+                return None
+            return (float(places[0]['lat']), float(places[0]['lon']))
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise UpstreamError(f"Nominatim answered garbage: {e}") from e
+
+
+class GazetteerResolver:
+    """
+    Resolves names from a local CSV gazetteer.
+
+    The file needs ``name``, ``lat`` and ``lon`` columns. Names are matched
+    after normalization, so "Port Hedland" and "  port  hedland" are the same.
+    """
+
+    name = 'gazetteer'
+
+    def __init__(self, path=config.GAZETTEER_PATH):
+        self.path = path
+        self._places = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                self._places[normalize_query(row['name'])] = (float(row['lat']), float(row['lon']))
+
+    def resolve(self, name):
+        """
+        Looks up a location name in the gazetteer.
+
+        Args:
+            name (str): The name of the location to geocode
+
+        Returns:
+            tuple | None: (latitude, longitude), or None if the name is not listed
+        """
+        return self._places.get(normalize_query(name))
+
+
+def create_resolver(kind=None):
+    """
+    Builds the resolver selected by ``CARBON_GEOCODER``.
+
+    Args:
+        kind (str, optional): "nominatim" or "gazetteer". Defaults to the configured geocoder
+
+    Returns:
+        NominatimResolver | GazetteerResolver: The resolver instance
+
+    Raises:
+        ValueError: If the resolver kind is unknown
+    """
+    kind = kind or config.GEOCODER
+    if kind == 'nominatim':
+        return NominatimResolver()
+    if kind == 'gazetteer':
+        return GazetteerResolver()
+    raise ValueError(f"Unknown geocoder: {kind}")
+
+
+class GeocodeCache:
+    """
+    Persistent geocode cache stored in a SQLite table.
+
+    Entries expire after ``ttl`` seconds (``negative_ttl`` for names that did
+    not resolve). When the table grows past ``max_entries`` the least recently
+    used entries are evicted.
+
+    ``preload`` copies the most recently used entries into a read-only
+    in-memory snapshot that answers lookups without touching the database;
+    loaded before forking, the snapshot is shared by every worker process.
+    """
+
+    def __init__(self, path=config.CACHE_DB_PATH, ttl=config.GEOCODE_TTL,
+                 negative_ttl=config.GEOCODE_NEGATIVE_TTL, max_entries=config.GEOCODE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._snapshot = {}  # query -> (lat, lon, found, created_at)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = None
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                query TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                found INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_geocode_cache_last_used ON geocode_cache (last_used)')
+        conn.commit()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        return self._conn
+
+    def close(self):
+        """Closes the database connection; it reopens on next use. The snapshot is kept."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def preload(self, limit=config.GEOCODE_SNAPSHOT_ENTRIES):
+        """
+        Loads the most recently used entries into the in-memory snapshot.
+
+        Args:
+            limit (int): Maximum number of entries
+
+        Returns:
+            int: Number of entries loaded
+        """
+        with self._lock:
+            rows = self._connection().execute(
+                'SELECT query, lat, lon, found, created_at FROM geocode_cache ORDER BY last_used DESC LIMIT ?',
+                (limit,)).fetchall()
+        self._snapshot = {row[0]: row[1:] for row in rows}
+        return len(self._snapshot)
+
+    def get(self, query):
+        """
+        Looks up a normalized query.
+
+        Args:
+            query (str): Normalized location name
+
+        Returns:
+            tuple: (found_in_cache, coordinates). coordinates is None for a
+            cached negative result.
+        """
+        now = time.time()
+        row = self._snapshot.get(query)
+        if row is not None and now - row[3] <= (self.ttl if row[2] else self.negative_ttl):
+            # Snapshot hits stay read-only: no last_used write, no page copied in a forked worker.
+            with self._lock:
+                if row[2]:
+                    self.hits += 1
+                    return True, (row[0], row[1])
+                self.negative_hits += 1
+                return True, None
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                'SELECT lat, lon, found, created_at FROM geocode_cache WHERE query = ?', (query,)
+            ).fetchone()
+            if row is not None:
+                lat, lon, found, created_at = row
+                if now - created_at <= (self.ttl if found else self.negative_ttl):
+                    conn.execute('UPDATE geocode_cache SET last_used = ? WHERE query = ?', (now, query))
+                    conn.commit()
+                    if found:
+                        self.hits += 1
+                        return True, (lat, lon)
+                    self.negative_hits += 1
+                    return True, None
+            self.misses += 1
+            return False, None
+
+    def get_stale(self, query):
+        """
+        Looks up a normalized query ignoring expiry, for when the resolver is failing.
+
+        Args:
+            query (str): Normalized location name
+
+        Returns:
+            tuple: (found_in_cache, coordinates), like get()
+        """
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT lat, lon, found FROM geocode_cache WHERE query = ?', (query,)).fetchone()
+        if row is None:
+            return False, None
+        return True, ((row[0], row[1]) if row[2] else None)
+
+    def put(self, query, coordinates):
+        """
+        Stores a resolver answer, evicting least recently used entries if needed.
+
+        Args:
+            query (str): Normalized location name
+            coordinates (tuple | None): (latitude, longitude), or None for a name that did not resolve
+        """
+        now = time.time()
+        lat, lon = coordinates if coordinates is not None else (None, None)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO geocode_cache (query, lat, lon, found, created_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (query, lat, lon, int(coordinates is not None), now, now)
+            )
+            count = conn.execute('SELECT COUNT(*) FROM geocode_cache').fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                conn.execute(
+                    'DELETE FROM geocode_cache WHERE query IN '
+                    '(SELECT query FROM geocode_cache ORDER BY last_used LIMIT ?)', (excess,)
+                )
+                self.evictions += excess
+            conn.commit()
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the current number of entries.
+
+        Returns:
+            dict: Cache statistics
+        """
+        with self._lock:
+            size = self._connection().execute('SELECT COUNT(*) FROM geocode_cache').fetchone()[0]
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': size,
+            'snapshot_size': len(self._snapshot),
+            'hit_ratio': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+class Geocoder:
+    """
+    Cached geocoder: answers from the cache and falls back to the resolver.
+
+    Resolver exceptions (timeouts, HTTP errors) are not cached, so a transient
+    outage does not poison the cache; they are counted in ``resolver_errors``.
+    While the upstream fails, a name with an expired cache entry gets that entry
+    (counted in ``stale_hits`` and reported with ``upstream.record_fallback``)
+    rather than an error.
+    """
+
+    def __init__(self, resolver, cache):
+        self.resolver = resolver
+        self.cache = cache
+        self.resolver_calls = 0
+        self.resolver_errors = 0
+        self.stale_hits = 0
+
+    def geocode(self, name):
+        """
+        Converts a location name to coordinates.
+
+        Args:
+            name (str): The name of the location to geocode
+
+        Returns:
+            tuple | None: (latitude, longitude), or None if the name does not resolve
+
+        Raises:
+            UpstreamError: If the resolver failed and the name was never cached
+        """
+        query = normalize_query(name)
+        cached, coordinates = self.cache.get(query)
+        if cached:
+            return coordinates
+        self.resolver_calls += 1
+        try:
+            with stage('geocode_upstream'):
+                coordinates = self.resolver.resolve(name)
+        except UpstreamError:
+            self.resolver_errors += 1
+            cached, coordinates = self.cache.get_stale(query)
+            if not cached:
+                raise
+            self.stale_hits += 1
+            record_fallback('geocode')
+            return coordinates
+        except Exception:
+            self.resolver_errors += 1
+            raise
+        self.cache.put(query, coordinates)
+        return coordinates
+
+    def stats(self):
+        """
+        Returns cache statistics together with the resolver in use.
+
+        Returns:
+            dict: Geocoder statistics
+        """
+        stats = self.cache.stats()
+        stats['resolver'] = self.resolver.name
+        stats['resolver_calls'] = self.resolver_calls
+        stats['resolver_errors'] = self.resolver_errors
+        stats['stale_hits'] = self.stale_hits
+        return stats
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    """
+    Returns the process-wide geocoder, creating it on first use.
+
+    Returns:
+        Geocoder: The shared geocoder
+    """
+    global _geocoder
+    if _geocoder is None:
+        with _geocoder_lock:
+            if _geocoder is None:
+                _geocoder = Geocoder(create_resolver(), GeocodeCache())
+    return _geocoder
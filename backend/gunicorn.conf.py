@@ -0,0 +1,21 @@
+"""
+Gunicorn settings: ``gunicorn -c gunicorn.conf.py wsgi:app`` from this directory.
+
+Workers are forked from a master that has imported and warmed up the app
+(``preload_app``), so the catalog, factors, depots, hub graph and geocode
+snapshot are loaded once and shared copy-on-write. Threaded workers keep
+long requests (streams, job events) from holding a whole process.
+"""
+import config as carbon_config  # gunicorn reads "config" as one of its own settings
+import serving
+
+bind = carbon_config.BIND
+workers = carbon_config.WORKERS
+worker_class = 'gthread'
+threads = carbon_config.THREADS
+timeout = carbon_config.WORKER_TIMEOUT
+preload_app = True
+
+
+def post_fork(server, worker):
+    serving.after_fork()
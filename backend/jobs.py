@@ -0,0 +1,599 @@
+"""
+Asynchronous calculation jobs.
+
+A job is a list of shipments priced in the background: ``submit`` stores it
+in SQLite (``CARBON_JOBS_DB_PATH``) and returns at once, and a fixed pool of
+``CARBON_JOB_WORKERS`` threads works through queued jobs with
+``batch.stream_batch``. Results are written to the database in chunks as
+they complete, so progress can be polled or followed and a restart resumes
+an interrupted job where it stopped instead of starting over.
+
+Each client (its remote address) may have
+``CARBON_JOB_MAX_ACTIVE_PER_CLIENT`` unfinished jobs and
+``CARBON_JOB_MAX_RUNNING_PER_CLIENT`` of them running; the scheduler takes
+the oldest queued job of a client under its running limit, so one client's
+backlog cannot hold every worker. A running job keeps at most
+``CARBON_JOB_MAX_IN_FLIGHT`` legs resolving, and a leg has at most two
+tasks on the lookup pool. The pool is first come, first served, so the
+limit is lowered if need be to keep ``CARBON_JOB_WORKERS`` times twice
+that below ``CARBON_LOOKUP_WORKERS``: jobs never hold every pool thread
+and an interactive request never queues behind a job's whole backlog.
+
+The database is the queue: jobs are claimed, limited and cancelled with
+transactions on it, so every worker process of a production server can run
+a queue of its own over the same file. A process stamps a heartbeat on the
+jobs it runs every ``CARBON_JOB_POLL_INTERVAL`` seconds; a running job whose
+heartbeat is older than ``CARBON_JOB_STALE_AFTER`` belonged to a process that
+died and is queued again.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+
+import config
+from batch import stream_batch
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobLimitError(Exception):
+    """Raised when a client already has the maximum number of unfinished jobs."""
+
+
+class JobStore:
+    """
+    SQLite persistence of jobs, their shipments and their results.
+
+    Args:
+        path (str): Database file
+    """
+
+    def __init__(self, path=config.JOBS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                client TEXT NOT NULL,
+                state TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                completed INTEGER NOT NULL DEFAULT 0,
+                errors INTEGER NOT NULL DEFAULT 0,
+                shipments TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at);
+            CREATE INDEX IF NOT EXISTS idx_jobs_client ON jobs (client, state);
+            CREATE TABLE IF NOT EXISTS job_results (
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                PRIMARY KEY (job_id, idx)
+            );
+        ''')
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        if 'heartbeat_at' not in columns:
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat_at REAL')
+        self._conn.commit()
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def create(self, client, shipments, max_active=None):
+        """
+        Stores a new queued job.
+
+        Args:
+            client (str): Submitting client
+            shipments (list): Shipment records
+            max_active (int, optional): Unfinished jobs the client may have, this one included
+
+        Returns:
+            str: Job id
+
+        Raises:
+            JobLimitError: If the client already has max_active unfinished jobs
+        """
+        job_id = uuid.uuid4().hex
+        payload = json.dumps(shipments)
+        with self._lock:
+            # IMMEDIATE takes the write lock first, so processes cannot both pass the limit check.
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if max_active is not None:
+                    active = self._conn.execute(
+                        'SELECT COUNT(*) FROM jobs WHERE client = ? AND state IN (?, ?)',
+                        (client, QUEUED, RUNNING)).fetchone()[0]
+                    if active >= max_active:
+                        raise JobLimitError(f"At most {max_active} unfinished jobs per client")
+                self._conn.execute(
+                    'INSERT INTO jobs (id, client, state, total, shipments, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    (job_id, client, QUEUED, len(shipments), payload, time.time()))
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return job_id
+
+    def claim(self, max_running_per_client):
+        """
+        Marks the oldest queued job of a client under its running limit as running.
+
+        Args:
+            max_running_per_client (int): Jobs of one client running at once, across processes
+
+        Returns:
+            tuple | None: (job id, client), or None if no job may start
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT id, client FROM jobs AS j WHERE state = ? AND '
+                    '(SELECT COUNT(*) FROM jobs WHERE client = j.client AND state = ?) < ? '
+                    'ORDER BY created_at LIMIT 1', (QUEUED, RUNNING, max_running_per_client)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        'UPDATE jobs SET state = ?, started_at = COALESCE(started_at, ?), heartbeat_at = ? '
+                        'WHERE id = ?', (RUNNING, now, now, row[0]))
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return tuple(row) if row is not None else None
+
+    def status(self, job_id):
+        """
+        Returns a job's state and progress.
+
+        Args:
+            job_id (str): Job id
+
+        Returns:
+            dict | None: id, client, state, total, completed, errors, error and
+            timestamps, or None for an unknown job
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT id, client, state, total, completed, errors, error, created_at, started_at, finished_at '
+                'FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ('id', 'client', 'state', 'total', 'completed', 'errors', 'error',
+                'created_at', 'started_at', 'finished_at')
+        return dict(zip(keys, row))
+
+    def states(self, job_ids):
+        """
+        Returns the current state of several jobs.
+
+        Args:
+            job_ids (list): Job ids
+
+        Returns:
+            dict: Job id -> state, for the jobs that exist
+        """
+        if not job_ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, state FROM jobs WHERE id IN ({', '.join('?' * len(job_ids))})", job_ids).fetchall()
+        return dict(rows)
+
+    def counts(self):
+        """
+        Returns the number of jobs in each state.
+
+        Returns:
+            dict: State -> count
+        """
+        with self._lock:
+            return dict(self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+    def shipments(self, job_id):
+        """
+        Returns the shipments of a job that have no stored result yet.
+
+        Args:
+            job_id (str): Job id
+
+        Returns:
+            list: (index, shipment) pairs in input order
+        """
+        with self._lock:
+            shipments = json.loads(self._conn.execute(
+                'SELECT shipments FROM jobs WHERE id = ?', (job_id,)).fetchone()[0])
+            done = {row[0] for row in self._conn.execute('SELECT idx FROM job_results WHERE job_id = ?', (job_id,))}
+        return [(index, shipment) for index, shipment in enumerate(shipments) if index not in done]
+
+    def results(self, job_id):
+        """
+        Returns the stored results of a job.
+
+        Args:
+            job_id (str): Job id
+
+        Returns:
+            list: Result dicts in input order
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT result FROM job_results WHERE job_id = ? ORDER BY idx', (job_id,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def add_results(self, job_id, results):
+        """
+        Stores a chunk of results and advances the job's progress counters.
+
+        A result replacing one already stored (a chunk re-run after the job was
+        requeued) does not count again, so completed never passes total.
+
+        Args:
+            job_id (str): Job id
+            results (list): Result dicts carrying "index"
+        """
+        results = list({result['index']: result for result in results}.values())
+        indexes = [result['index'] for result in results]
+        wanted = set(indexes)
+        with self._lock:
+            # IMMEDIATE: another process storing the same indexes must not interleave with the check.
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                replaced = {}
+                if indexes:
+                    for idx, stored in self._conn.execute(
+                            'SELECT idx, result FROM job_results WHERE job_id = ? AND idx BETWEEN ? AND ?',
+                            (job_id, min(indexes), max(indexes))):
+                        if idx in wanted:
+                            replaced[idx] = 'error' in json.loads(stored)
+                added = sum(1 for idx in indexes if idx not in replaced)
+                errors = sum(1 for result in results if 'error' in result) - \
+                    sum(1 for idx in indexes if replaced.get(idx))
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO job_results (job_id, idx, result) VALUES (?, ?, ?)',
+                    [(job_id, result['index'], json.dumps(result)) for result in results])
+                self._conn.execute(
+                    'UPDATE jobs SET completed = completed + ?, errors = errors + ?, heartbeat_at = ? WHERE id = ?',
+                    (added, errors, time.time(), job_id))
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def heartbeat(self, job_ids):
+        """
+        Stamps running jobs as alive.
+
+        Args:
+            job_ids (list): Ids of jobs this process runs
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany('UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND state = ?',
+                                   [(now, job_id, RUNNING) for job_id in job_ids])
+            self._conn.commit()
+
+    def finish(self, job_id, state, error=None):
+        """
+        Moves a running job to a finished state.
+
+        A job cancelled or requeued meanwhile keeps the state it has.
+
+        Args:
+            job_id (str): Job id
+            state (str): DONE, FAILED or CANCELLED
+            error (str, optional): Reason of a failure
+
+        Returns:
+            bool: True if the job was still running
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE id = ? AND state = ?',
+                (state, error, time.time(), job_id, RUNNING))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job.
+
+        Args:
+            job_id (str): Job id
+
+        Returns:
+            bool: True if the job was unfinished
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET state = ?, finished_at = ? WHERE id = ? AND state IN (?, ?)',
+                (CANCELLED, time.time(), job_id, QUEUED, RUNNING))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def requeue_stale(self, older_than):
+        """
+        Queues running jobs again whose process stopped stamping them.
+
+        Args:
+            older_than (float): Unix time; running jobs last stamped before it are requeued
+
+        Returns:
+            int: Number of jobs requeued
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET state = ? WHERE state = ? AND COALESCE(heartbeat_at, started_at, 0) < ?',
+                (QUEUED, RUNNING, older_than))
+            self._conn.commit()
+        return cursor.rowcount
+
+    def purge(self, older_than):
+        """
+        Deletes finished jobs and their results.
+
+        Args:
+            older_than (float): Unix time; jobs finished before it are deleted
+
+        Returns:
+            int: Number of jobs deleted
+        """
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute(
+                'SELECT id FROM jobs WHERE finished_at < ?', (older_than,))]
+            self._conn.executemany('DELETE FROM job_results WHERE job_id = ?', [(i,) for i in ids])
+            self._conn.executemany('DELETE FROM jobs WHERE id = ?', [(i,) for i in ids])
+            self._conn.commit()
+        return len(ids)
+
+
+class JobQueue:
+    """
+    Runs stored jobs on a fixed pool of worker threads.
+
+    Args:
+        store (JobStore): Job persistence
+        workers (int): Worker threads, i.e. jobs this process runs at once
+        max_active_per_client (int): Unfinished jobs one client may have
+        max_running_per_client (int): Jobs of one client running at once, across processes
+        max_in_flight (int): Legs of one job resolving at once; lowered so the
+            workers' jobs leave lookup pool threads free for interactive requests
+        flush_interval (float): Seconds between progress writes of a running job
+        poll_interval (float): Seconds between heartbeats and checks for jobs
+            queued or cancelled by other processes
+        stale_after (float): Seconds without a heartbeat after which a running job is requeued
+    """
+
+    def __init__(self, store, workers=config.JOB_WORKERS,
+                 max_active_per_client=config.JOB_MAX_ACTIVE_PER_CLIENT,
+                 max_running_per_client=config.JOB_MAX_RUNNING_PER_CLIENT,
+                 max_in_flight=config.JOB_MAX_IN_FLIGHT, flush_interval=config.JOB_FLUSH_INTERVAL,
+                 poll_interval=config.JOB_POLL_INTERVAL, stale_after=config.JOB_STALE_AFTER):
+        self.store = store
+        self.max_active_per_client = max_active_per_client
+        self.max_running_per_client = max_running_per_client
+        # A leg has at most two tasks on the lookup pool; keep at least one thread for interactive lookups.
+        self.max_in_flight = max(1, min(max_in_flight, (config.LOOKUP_WORKERS - 1) // (2 * max(1, workers))))
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self._changed = threading.Condition()
+        self._versions = Counter()  # job id -> number of progress updates, for waiters
+        self._wakeups = 0  # bumped whenever a queued job may have become claimable
+        self._running = {}  # job id -> client, of the jobs this process runs
+        self._cancelled = set()
+
+        self.resumed = store.requeue_stale(time.time() - stale_after)
+        store.purge(time.time() - config.JOB_TTL)
+
+        self._workers = [threading.Thread(target=self._work, name=f'job-{i}', daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+        threading.Thread(target=self._monitor, name='job-monitor', daemon=True).start()
+
+    def submit(self, client, shipments):
+        """
+        Queues a job.
+
+        Args:
+            client (str): Submitting client
+            shipments (list): Shipment records
+
+        Returns:
+            str: Job id
+
+        Raises:
+            JobLimitError: If the client already has max_active_per_client unfinished jobs
+        """
+        try:
+            job_id = self.store.create(client, shipments, self.max_active_per_client)
+        except JobLimitError:
+            with self._changed:
+                self.rejected += 1
+            raise
+        with self._changed:
+            self.submitted += 1
+            self._wake()
+        return job_id
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job; a running job stops at its next progress write.
+
+        Args:
+            job_id (str): Job id
+
+        Returns:
+            bool: True if the job was unfinished
+        """
+        if not self.store.cancel(job_id):
+            return False
+        with self._changed:
+            if job_id in self._running:
+                self._cancelled.add(job_id)
+            self._bump(job_id)
+        return True
+
+    def wait(self, job_id, version, timeout):
+        """
+        Blocks until this process changes a job's progress.
+
+        Jobs run by other worker processes never wake the caller; poll the
+        store for those.
+
+        Args:
+            job_id (str): Job id
+            version (int): Version the caller has seen, from a previous call (start with 0)
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            int: The current version; equal to ``version`` if the timeout expired
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._versions[job_id] != version, timeout)
+            return self._versions[job_id]
+
+    def _bump(self, job_id):
+        self._versions[job_id] += 1
+        self._changed.notify_all()
+
+    def _wake(self):
+        self._wakeups += 1
+        self._changed.notify_all()
+
+    def _next(self):
+        """Claims the next job that may start; waits while there is none."""
+        while True:
+            with self._changed:
+                seen = self._wakeups
+            claimed = self.store.claim(self.max_running_per_client)
+            if claimed is not None:
+                job_id, client = claimed
+                with self._changed:
+                    self._running[job_id] = client
+                return job_id
+            with self._changed:
+                self._changed.wait_for(lambda: self._wakeups != seen)
+
+    def _work(self):
+        while True:
+            try:
+                job_id = self._next()
+            except sqlite3.Error as e:
+                print(f"Error claiming a job: {e}")
+                time.sleep(self.poll_interval)
+                continue
+            try:
+                state, error = self._run(job_id)
+            except Exception as e:
+                print(f"Error running job {job_id}: {e}")
+                state, error = FAILED, str(e)
+            finished = self.store.finish(job_id, state, error)
+            with self._changed:
+                del self._running[job_id]
+                self._cancelled.discard(job_id)
+                if finished and state == DONE:
+                    self.completed += 1
+                elif finished and state == FAILED:
+                    self.failed += 1
+                self._bump(job_id)
+                self._wake()
+
+    def _run(self, job_id):
+        with self._changed:
+            self._bump(job_id)
+        pending = []
+        flushed = time.monotonic()
+        results = stream_batch(self.store.shipments(job_id), max_in_flight=self.max_in_flight)
+        try:
+            for result in results:
+                pending.append(result)
+                if time.monotonic() - flushed >= self.flush_interval:
+                    self.store.add_results(job_id, pending)
+                    pending, flushed = [], time.monotonic()
+                    with self._changed:
+                        self._bump(job_id)
+                        if job_id in self._cancelled:
+                            return CANCELLED, None
+        finally:
+            results.close()
+            if pending:
+                self.store.add_results(job_id, pending)
+        return DONE, None
+
+    def _monitor(self):
+        """Stamps this process's jobs, stops those cancelled or requeued elsewhere and picks up new work."""
+        while True:
+            time.sleep(self.poll_interval)
+            with self._changed:
+                running = list(self._running)
+            try:
+                self.store.heartbeat(running)
+                lost = [job_id for job_id, state in self.store.states(running).items() if state != RUNNING]
+                resumed = self.store.requeue_stale(time.time() - self.stale_after)
+            except sqlite3.Error as e:
+                print(f"Error checking jobs: {e}")
+                continue
+            with self._changed:
+                self._cancelled.update(lost)
+                self.resumed += resumed
+                self._wake()
+
+    def stats(self):
+        """
+        Returns job counts and this process's job counters.
+
+        Returns:
+            dict: Statistics; "queued" and "running" count every process's jobs
+        """
+        counts = self.store.counts()
+        with self._changed:
+            return {
+                'queued': counts.get(QUEUED, 0),
+                'running': counts.get(RUNNING, 0),
+                'running_here': len(self._running),
+                'workers': len(self._workers),
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'resumed': self.resumed,
+            }
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Returns the process-wide job queue, starting its workers on first use.
+
+    Returns:
+        JobQueue: The shared queue
+    """
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue(JobStore())
+    return _job_queue
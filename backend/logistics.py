@@ -0,0 +1,349 @@
+"""
+Location and leg resolution: place names to coordinates, distance and duration.
+"""
+import contextvars
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+import config
+from concurrency import submit
+from depots import get_depot_index
+from geo import haversine
+from geocode import get_geocoder, normalize_query
+from routing import get_route_service
+from timing import stage
+
+
+def geography(name):
+    """
+    Converts a location name to its geographical coordinates.
+    
+    Args:
+        name (str): The name of the location to geocode
+        
+    Returns:
+        tuple: A tuple containing (latitude, longitude)
+        
+    Raises:
+        ValueError: If the location does not resolve
+        Exception: If the geocoding service fails
+    """
+    with stage('geocode'):
+        coordinates = get_geocoder().geocode(name)
+    if coordinates is None:
+        raise ValueError(f"Location not found: {name}")
+    return coordinates
+
+
+def geography_or_depot(name):
+    """
+    Geocodes a location name, leaving an omitted delivery for leg_info() to fill in.
+
+    Args:
+        name (str): The name of the location, or None
+
+    Returns:
+        tuple: (latitude, longitude), or None when name is None
+    """
+    return None if name is None else geography(name)
+
+
+def distribution_centre(pickup, delivery=None, mode=""):
+    """
+    Calculates distribution information between pickup and delivery locations.
+    
+    Args:
+        pickup (str): Name of the pickup location
+        delivery (str, optional): Name of the delivery location. Defaults to the
+            depot nearest the pickup
+        mode (str): Transport mode - "local" or "global"
+        
+    Returns:
+        dict: Dictionary containing:
+            - Olat: Origin latitude
+            - Olon: Origin longitude
+            - Dlat: Destination latitude
+            - Dlon: Destination longitude
+            - distance: Distance in kilometers
+            - duration: Duration in hours
+            - route_source: "osrm" or "estimate" (local mode only)
+            - provisional: True if the router missed CARBON_ROUTE_HEDGE_DEADLINE and the
+              distance is an estimate while the real route is fetched (local mode only)
+            - depot: The depot chosen as delivery (only when delivery is omitted)
+            
+    Raises:
+        ValueError: If mode is not "local" or "global", or no depot is configured
+    """
+    return leg_info(geography(pickup), geography_or_depot(delivery), mode)
+
+
+def leg_info(origin, destination, mode):
+    """
+    Calculates distance and duration of a leg whose endpoints are already geocoded.
+
+    Args:
+        origin (tuple): (latitude, longitude) of the pickup
+        destination (tuple): (latitude, longitude) of the delivery, or None for the
+            depot nearest the origin
+        mode (str): Transport mode - "local" or "global"
+
+    Returns:
+        dict: Same fields as distribution_centre()
+
+    Raises:
+        ValueError: If mode is not "local" or "global", or no depot is configured
+    """
+    depot = None
+    if destination is None:
+        with stage('depot_lookup'):
+            depot = get_depot_index().nearest_depot(*origin)
+        destination = (depot['lat'], depot['lon'])
+
+    result = {
+        "Olat": origin[0],
+        "Olon": origin[1],
+        "Dlat": destination[0],
+        "Dlon": destination[1],
+        "distance": None,
+        "duration": None
+    }
+
+    if mode == "local":
+        with stage('route'):
+            route = get_route_service().route(origin, destination)
+        result["distance"] = route["distance"]
+        result["duration"] = route["duration"]
+        result["route_source"] = route["source"]
+        if route.get("provisional"):
+            result["provisional"] = True
+    elif mode == "global":
+        result["distance"] = haversine(*origin, *destination)
+        result["duration"] = result["distance"] / 830
+    else:
+        raise ValueError("Invalid transport mode")
+
+    if depot is not None:
+        result["depot"] = depot
+    return result
+
+
+def resolve_legs(legs, timeout=config.LOOKUP_DEADLINE):
+    """
+    Resolves several legs concurrently.
+
+    Every distinct location name is geocoded in parallel on the shared lookup
+    pool, and each leg is routed as soon as both of its endpoints are known.
+    The whole resolution shares one deadline, so a slow upstream fails only
+    the legs that depend on it. Lookups still queued at the deadline are
+    cancelled rather than left to run for a request that has already failed.
+
+    Args:
+        legs (list): (pickup, delivery, mode) tuples; a None delivery is the depot
+            nearest the pickup
+        timeout (float): Seconds allowed for all lookups together
+
+    Returns:
+        list: One entry per leg, in order: the distribution_centre() dict, or the
+        exception that prevented resolving it (TimeoutError past the deadline)
+    """
+    with stage('lookups'):
+        return _resolve_legs(legs, time.monotonic() + timeout)
+
+
+def _resolve_legs(legs, deadline):
+    names = dict.fromkeys(name for pickup, delivery, _ in legs for name in (pickup, delivery))
+    geocodes = {name: submit(geography_or_depot, name) for name in names}
+    results = [None] * len(legs)
+    routing = {}
+    waiting = set(range(len(legs)))
+
+    while waiting:
+        for index in list(waiting):
+            pickup, delivery, mode = legs[index]
+            endpoints = (geocodes[pickup], geocodes[delivery])
+            if not all(future.done() for future in endpoints):
+                continue
+            waiting.discard(index)
+            failed = next((f.exception() for f in endpoints if f.exception() is not None), None)
+            if failed is not None:
+                results[index] = failed
+            else:
+                routing[index] = submit(leg_info, endpoints[0].result(), endpoints[1].result(), mode)
+        if not waiting:
+            break
+        pending = [geocodes[name] for index in waiting for name in legs[index][:2] if not geocodes[name].done()]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not wait(pending, timeout=remaining, return_when=FIRST_COMPLETED).done:
+            for index in waiting:
+                slow = next(name for name in legs[index][:2] if not geocodes[name].done())
+                results[index] = TimeoutError(f"Geocoding {slow!r} timed out")
+            # Lookups still queued would otherwise hold pool threads and upstream tokens after we answered.
+            for future in pending:
+                future.cancel()
+            break
+
+    wait(list(routing.values()), timeout=max(0.0, deadline - time.monotonic()))
+    for index, future in routing.items():
+        if not future.done():
+            future.cancel()
+            results[index] = TimeoutError(f"Routing {legs[index][0]!r} -> {legs[index][1]!r} timed out")
+        elif future.exception() is not None:
+            results[index] = future.exception()
+        else:
+            results[index] = future.result()
+    return results
+
+
+class LegFuture(Future):
+    """
+    Future of one leg started by submit_leg().
+
+    ``abandon()`` gives up on the leg: its lookups that have not started are
+    cancelled and no route is requested. The future still completes, with a
+    TimeoutError, but only once the lookups already running have finished,
+    so a caller can keep counting them against its limits until then.
+    """
+
+    def __init__(self, abandon):
+        super().__init__()
+        self._abandon = abandon
+
+    def abandon(self):
+        """Cancels the leg's lookups that have not started."""
+        self._abandon()
+
+
+# Guards the holder counts of geocodes shared through submit_leg(geocodes=...).
+_shared_geocodes = threading.Lock()
+
+
+def submit_leg(pickup, delivery, mode, geocodes=None):
+    """
+    Starts resolving one leg without blocking the caller.
+
+    Both names are geocoded on the lookup pool; once both are known the leg
+    is routed there too. No pool thread waits on another task, so any number
+    of legs can be in flight at once, and each leg has at most two tasks on
+    the pool at a time.
+
+    Args:
+        pickup (str): Pickup location name
+        delivery (str): Delivery location name, or None for the depot nearest the pickup
+        mode (str): "local" or "global"
+        geocodes (LRUCache, optional): Geocode lookups by normalized name, shared
+            between calls from one thread so a name in flight is geocoded once.
+            A shared lookup is only cancelled once every leg using it is abandoned.
+
+    Returns:
+        LegFuture: Resolves to the distribution_centre() dict, or fails with the
+        geocoding or routing exception
+    """
+    shared = []  # (key, [future, holders]) entries of ``geocodes`` this leg uses
+    state = {'abandoned': False, 'routed': None}
+    lock = threading.Lock()
+
+    def geocode(name):
+        if geocodes is None or name is None:
+            return submit(geography_or_depot, name)
+        key = normalize_query(name)
+        with _shared_geocodes:
+            entry = geocodes.get(key)
+            if entry is None:
+                entry = [submit(geography, name), 0]
+                geocodes.set(key, entry)
+            entry[1] += 1
+        shared.append((key, entry))
+        return entry[0]
+
+    def abandon():
+        with lock:
+            if state['abandoned']:
+                return
+            state['abandoned'] = True
+            routed = state['routed']
+        owned = [future for future in endpoints if all(future is not entry[0] for _, entry in shared)]
+        with _shared_geocodes:
+            for key, entry in shared:
+                entry[1] -= 1
+                if not entry[1] and entry[0].cancel() and geocodes.get(key) is entry:
+                    geocodes.pop(key)
+        for future in owned:
+            future.cancel()
+        if routed is not None:
+            routed.cancel()
+
+    def abandoned():
+        return TimeoutError(f"Lookups for {pickup!r} -> {delivery!r} were abandoned")
+
+    endpoints = (geocode(pickup), geocode(delivery))
+    leg = LegFuture(abandon)
+    context = contextvars.copy_context()
+    pending = [len(endpoints)]
+
+    def route(_):
+        with lock:
+            pending[0] -= 1
+            if pending[0]:
+                return
+            if state['abandoned'] or any(f.cancelled() for f in endpoints):
+                leg.set_exception(abandoned())
+                return
+            failed = next((f.exception() for f in endpoints if f.exception() is not None), None)
+            if failed is not None:
+                leg.set_exception(failed)
+                return
+            try:
+                routed = state['routed'] = context.run(
+                    submit, leg_info, endpoints[0].result(), endpoints[1].result(), mode)
+            except RuntimeError as e:  # the pool is shutting down
+                leg.set_exception(e)
+                return
+        routed.add_done_callback(settle)
+
+    def settle(routed):
+        if routed.cancelled() or state['abandoned']:
+            leg.set_exception(abandoned())
+        elif routed.exception() is not None:
+            leg.set_exception(routed.exception())
+        else:
+            leg.set_result(routed.result())
+
+    for future in endpoints:
+        future.add_done_callback(route)
+    return leg
+
+
+def resolve_points(points):
+    """
+    Converts a list of locations into latitude and longitude lists.
+
+    Args:
+        points (list): Location names, [lat, lon] pairs or {"lat": ..., "lon": ...} objects
+
+    Returns:
+        tuple: (latitudes, longitudes) as lists of floats
+
+    Raises:
+        ValueError: If a point is malformed, out of range or a name does not resolve
+    """
+    lats, lons = [], []
+    for point in points:
+        if isinstance(point, str):
+            lat, lon = geography(point)
+        elif isinstance(point, dict):
+            lat, lon = point.get('lat'), point.get('lon')
+        elif isinstance(point, (list, tuple)) and len(point) == 2:
+            lat, lon = point
+        else:
+            raise ValueError(f"Invalid point: {point!r}")
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid point: {point!r}")
+        if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"Invalid point: {point!r} (lat must be in [-90, 90] and lon in [-180, 180])")
+        lats.append(lat)
+        lons.append(lon)
+    return lats, lons
@@ -0,0 +1,187 @@
+"""
+Route map rendering.
+
+folium (and the Jinja/branca stack behind it) is imported the first time a map
+is rendered, so processes that never draw a map never pay for it.
+
+A calculate response can carry the route as compact GeoJSON plus a map id
+instead of the full folium document. The id encodes the stop coordinates
+themselves, so any worker can render ``/api/map/<id>`` without shared state, and
+rendered documents are kept in an LRU keyed by that id. Stop labels are never
+part of the id: they follow from each stop's position in the route, so a
+crafted id cannot put markup into the served page.
+"""
+import base64
+import html
+import json
+import math
+
+import config
+from lru import LRUCache
+from timing import stage
+
+MAP_ID_PRECISION = 5  # decimal places kept in a map id (~1 m)
+
+# Stop labels by position in the route: the local leg, then the optional global leg.
+ROUTE_LABELS = ("Local Pickup", "Local Delivery", "Global Pickup", "Global Delivery")
+
+_rendered = LRUCache(config.MAP_CACHE_ENTRIES)
+
+
+def route_locations(logistics_info, G_logistics_info=None):
+    """
+    Lists the labelled stops of a shipment in travel order.
+
+    Args:
+        logistics_info (dict): Local leg from distribution_centre()
+        G_logistics_info (dict, optional): Global leg from distribution_centre()
+
+    Returns:
+        list: (latitude, longitude, label) tuples
+    """
+    locations = [
+        (logistics_info["Olat"], logistics_info["Olon"], ROUTE_LABELS[0]),
+        (logistics_info["Dlat"], logistics_info["Dlon"], ROUTE_LABELS[1])
+    ]
+
+    if G_logistics_info:
+        locations.extend([
+            (G_logistics_info["Olat"], G_logistics_info["Olon"], ROUTE_LABELS[2]),
+            (G_logistics_info["Dlat"], G_logistics_info["Dlon"], ROUTE_LABELS[3])
+        ])
+    return locations
+
+
+def render_map_html(locations):
+    """
+    Renders a folium map with a marker per stop and the route polyline.
+
+    Args:
+        locations (list): (latitude, longitude, label) tuples, the first one centres the map
+
+    Returns:
+        str: Self-contained HTML (an iframe document) for the map
+    """
+    import folium
+
+    map_object = folium.Map([locations[0][0], locations[0][1]], zoom_start=5)
+    kw = {"opacity": 1.0, "weight": 6}
+
+    for lat, lon, label in locations:
+        folium.Marker(
+            location=[lat, lon],
+            popup=html.escape(label),
+            icon=folium.Icon(color="blue" if "Pickup" in label else "green")
+        ).add_to(map_object)
+
+    folium.PolyLine(
+        locations=[(lat, lon) for lat, lon, _ in locations],
+        tooltip="Route",
+        color="red",
+        line_cap="round",
+        **kw,
+    ).add_to(map_object)
+
+    return map_object._repr_html_()
+
+
+def to_geojson(locations):
+    """
+    Converts stops into a GeoJSON FeatureCollection: one Point per stop and the route LineString.
+
+    Args:
+        locations (list): (latitude, longitude, label) tuples
+
+    Returns:
+        dict: GeoJSON FeatureCollection (coordinates in [longitude, latitude] order)
+    """
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"label": label},
+        }
+        for lat, lon, label in locations
+    ]
+    features.append({
+        "type": "Feature",
+        "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat, lon, _ in locations]},
+        "properties": {"label": "Route"},
+    })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def encode_map_id(locations):
+    """
+    Builds the URL-safe id of a location set.
+
+    Only the coordinates are encoded; labels are restored from ROUTE_LABELS.
+
+    Args:
+        locations (list): (latitude, longitude, label) tuples, as route_locations() returns them
+
+    Returns:
+        str: Map id usable in /api/map/<id>
+    """
+    compact = [[round(lat, MAP_ID_PRECISION), round(lon, MAP_ID_PRECISION)] for lat, lon, _ in locations]
+    payload = json.dumps(compact, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_map_id(map_id):
+    """
+    Recovers the location set from a map id.
+
+    Args:
+        map_id (str): Id built by encode_map_id()
+
+    Returns:
+        list: (latitude, longitude, label) tuples, labelled by position from ROUTE_LABELS
+
+    Raises:
+        ValueError: If the id is malformed
+    """
+    try:
+        payload = base64.urlsafe_b64decode(map_id + '=' * (-len(map_id) % 4))
+        compact = json.loads(payload)
+        coordinates = [(float(lat), float(lon)) for lat, lon in compact]
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid map id") from e
+    if len(coordinates) not in (2, len(ROUTE_LABELS)):
+        raise ValueError("Invalid map id: wrong number of locations")
+    if not all(math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180
+               for lat, lon in coordinates):
+        raise ValueError("Invalid map id: coordinates out of range")
+    return [(lat, lon, label) for (lat, lon), label in zip(coordinates, ROUTE_LABELS)]
+
+
+def get_map_html(map_id):
+    """
+    Returns the rendered map of a map id, rendering it on a cache miss.
+
+    Args:
+        map_id (str): Id built by encode_map_id()
+
+    Returns:
+        str: Map HTML document
+
+    Raises:
+        ValueError: If the id is malformed
+    """
+    html = _rendered.get(map_id)
+    if html is None:
+        locations = decode_map_id(map_id)
+        with stage('map_render'):
+            html = render_map_html(locations)
+        _rendered.set(map_id, html)
+    return html
+
+
+def map_cache_stats():
+    """
+    Returns statistics of the rendered-map LRU.
+
+    Returns:
+        dict: Cache statistics
+    """
+    return _rendered.stats()
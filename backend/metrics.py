@@ -0,0 +1,176 @@
+"""
+Prometheus metrics in the text exposition format.
+
+Request and stage durations are aggregated into histograms when a request
+finishes. Everything else (upstream calls and errors, cache hits and ratios,
+database timings) is read from the subsystems' ``stats()`` dicts when
+``/metrics`` is scraped, so it costs nothing between scrapes.
+"""
+import threading
+
+# Upper bounds in seconds; sub-millisecond for cache hits up to the lookup deadline.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Stats keys that only ever grow; exported as counters, the rest as gauges.
+COUNTER_KEYS = {
+    'hits', 'misses', 'negative_hits', 'evictions', 'disk_hits', 'disk_evictions', 'invalidations', 'reloads',
+    'resolver_calls', 'resolver_errors', 'router_calls', 'router_errors', 'fallbacks', 'provisional', 'samples',
+    'calls', 'failures', 'retries', 'short_circuits', 'rejected', 'opens', 'stale_hits',
+    'renders', 'render_errors', 'pool_restarts',
+    'queries', 'query_seconds', 'writes', 'write_seconds', 'pool_waits', 'pool_wait_seconds',
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Thread-safe labelled histogram with fixed buckets.
+
+    Args:
+        name (str): Metric name
+        help_text (str): HELP line
+        labelnames (tuple): Label names; observe() takes their values in the same order
+        buckets (tuple): Increasing bucket upper bounds
+    """
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def observe(self, labels, value):
+        """
+        Records one value.
+
+        Args:
+            labels (tuple): Label values
+            value (float): Observed value
+        """
+        with self._lock:
+            self._observe(labels, value)
+
+    def observe_many(self, observations):
+        """
+        Records several values under one lock acquisition.
+
+        Args:
+            observations (iterable): (labels, value) pairs
+        """
+        with self._lock:
+            for labels, value in observations:
+                self._observe(labels, value)
+
+    def render(self):
+        """
+        Returns the histogram in the text exposition format.
+
+        Returns:
+            list: Lines
+        """
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'carbon_request_duration_seconds', 'Wall time of API requests.', ('endpoint', 'status'))
+STAGE_SECONDS = Histogram(
+    'carbon_stage_duration_seconds', 'Time spent in each request stage, per call.', ('stage',))
+UPSTREAM_SECONDS = Histogram(
+    'carbon_upstream_duration_seconds', 'Latency of upstream HTTP attempts.', ('upstream', 'outcome'))
+
+
+def observe_request(endpoint, status, total, timings):
+    """
+    Aggregates one finished request.
+
+    Args:
+        endpoint (str): Flask endpoint name
+        status (int): Response status code
+        total (float): Wall time in seconds
+        timings (list): (stage, seconds) tuples from timing.current_timings()
+    """
+    REQUEST_SECONDS.observe((endpoint, str(status)), total)
+    if timings:
+        STAGE_SECONDS.observe_many(((name,), seconds) for name, seconds in timings)
+
+
+def _stats_lines(prefix, stats):
+    lines = []
+    info = {}
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            lines.extend(_stats_lines(name, value))
+        elif isinstance(value, bool):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {int(value)}")
+        elif isinstance(value, (int, float)):
+            if key in COUNTER_KEYS:
+                lines.append(f"# TYPE {name}_total counter")
+                lines.append(f"{name}_total {_number(value)}")
+            else:
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(value)}")
+        elif isinstance(value, str):
+            info[key] = value
+    if info:
+        lines.append(f"# TYPE {prefix}_info gauge")
+        lines.append(f"{prefix}_info{_labels(tuple(info), tuple(info.values()))} 1")
+    return lines
+
+
+def render(stats):
+    """
+    Renders every metric in the Prometheus text exposition format.
+
+    Args:
+        stats (dict): Subsystem name -> stats() dict, as served at /api/stats
+
+    Returns:
+        str: The exposition, ending with a newline
+    """
+    lines = REQUEST_SECONDS.render() + STAGE_SECONDS.render() + UPSTREAM_SECONDS.render()
+    for subsystem, values in stats.items():
+        lines.extend(_stats_lines(f"carbon_{subsystem}", values))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,305 @@
+"""
+Lowest-emission multimodal routing over a graph of hubs.
+
+``data/hubs.json`` lists hubs (ports, rail terminals, airports, towns), the
+links between them with their transport mode, and per-mode speed and
+circuity. When the graph is loaded every link's distance is computed once:
+road links through the cached route service, other links from an explicit
+``distance_km`` or the great-circle distance times the mode's circuity. A
+query then never leaves memory: the pickup and delivery are joined to their
+nearest hubs by estimated road legs, and A* finds the path with the lowest
+sum of distance × mode multiplier (from the emission factor registry), with
+the great-circle distance to the delivery times the smallest multiplier as
+its admissible heuristic.
+"""
+import functools
+import hashlib
+import heapq
+import json
+import threading
+
+import numpy as np
+
+import config
+from concurrency import submit
+from emissions import calc_emission
+from geo import haversine, haversine_matrix
+from timing import stage
+
+ACCESS_MODE = 'road'  # first and last mile, and the direct alternative
+
+
+class HubGraph:
+    """
+    Hubs, precomputed links and per-mode settings.
+
+    Args:
+        hubs (list): Hub dicts with id, name, lat and lon
+        links (list): (from index, to index, mode, distance km, duration h) tuples, one per direction
+        modes (dict): Mode -> {"speed_kmh", "circuity"}
+        version (str): Hash of the graph file
+    """
+
+    def __init__(self, hubs, links, modes, version):
+        self.hubs = hubs
+        self.modes = modes
+        self.version = version
+        self.index = {hub['id']: i for i, hub in enumerate(hubs)}
+        self.lat = np.array([hub['lat'] for hub in hubs], dtype=np.float64)
+        self.lon = np.array([hub['lon'] for hub in hubs], dtype=np.float64)
+        self.adjacency = [[] for _ in hubs]
+        for a, b, mode, distance, duration in links:
+            self.adjacency[a].append((b, mode, distance, duration))
+        self.link_count = len(links)
+
+    def distances_from(self, lat, lon):
+        """
+        Returns the great-circle distance from a point to every hub.
+
+        Args:
+            lat (float): Latitude in degrees
+            lon (float): Longitude in degrees
+
+        Returns:
+            ndarray: Distances in km, in hub order
+        """
+        return haversine_matrix(self.lat, self.lon, [lat], [lon])[:, 0]
+
+    def access_leg(self, distance):
+        """
+        Estimates a road leg from its great-circle distance.
+
+        Args:
+            distance (float): Great-circle distance in km
+
+        Returns:
+            tuple: (road distance km, duration h)
+        """
+        settings = self.modes[ACCESS_MODE]
+        road = distance * settings['circuity']
+        return road, road / settings['speed_kmh']
+
+
+def load_hub_graph(path=config.HUBS_PATH, route=None):
+    """
+    Loads a hub graph file and precomputes every link's distance and duration.
+
+    Args:
+        path (str): JSON file with "modes", "hubs" and "links"
+        route (callable, optional): (origin, destination) -> {"distance", "duration"} for
+            road links. Defaults to the shared route service (cached, OSRM or estimate),
+            waiting for the router rather than settling for provisional estimates
+
+    Returns:
+        HubGraph: The graph
+
+    Raises:
+        ValueError: If a link names an unknown hub or mode
+    """
+    if route is None:
+        from routing import get_route_service
+        route = functools.partial(get_route_service().route, hedge=False)
+
+    with open(path, 'rb') as f:
+        raw = f.read()
+    data = json.loads(raw)
+    modes = data['modes']
+    hubs = data['hubs']
+    index = {hub['id']: i for i, hub in enumerate(hubs)}
+
+    pending = []
+    for link in data['links']:
+        a, b, mode = index.get(link['from']), index.get(link['to']), link['mode']
+        if a is None or b is None:
+            raise ValueError(f"Link {link['from']} -> {link['to']} names an unknown hub")
+        if mode not in modes:
+            raise ValueError(f"Link {link['from']} -> {link['to']} has unknown mode {mode!r}")
+        origin, destination = (hubs[a]['lat'], hubs[a]['lon']), (hubs[b]['lat'], hubs[b]['lon'])
+        great_circle = haversine(*origin, *destination)
+        if 'distance_km' in link:
+            leg = float(link['distance_km'])
+        elif mode == ACCESS_MODE:
+            leg = submit(route, origin, destination)
+        else:
+            leg = great_circle * modes[mode]['circuity']
+        pending.append((a, b, mode, great_circle, leg))
+
+    links = []
+    for a, b, mode, great_circle, leg in pending:
+        if isinstance(leg, float):
+            distance, duration = leg, leg / modes[mode]['speed_kmh']
+        else:
+            answer = leg.result()
+            distance, duration = answer['distance'], answer['duration']
+        # Never shorter than the great circle, which keeps the A* heuristic admissible.
+        distance = max(distance, great_circle)
+        links.append((a, b, mode, distance, duration))
+        links.append((b, a, mode, distance, duration))
+
+    version = hashlib.sha1(raw).hexdigest()[:12]
+    return HubGraph(hubs, links, modes, version)
+
+
+def _leg(name_from, point_from, name_to, point_to, mode, distance, duration, weight, factors):
+    return {
+        'from': name_from,
+        'to': name_to,
+        'mode': mode,
+        'Olat': point_from[0],
+        'Olon': point_from[1],
+        'Dlat': point_to[0],
+        'Dlon': point_to[1],
+        'distance': distance,
+        'duration': duration,
+        'emission': calc_emission(weight, distance, factors.transport(mode)),
+    }
+
+
+def plan_route(graph, origin, destination, weight, factors, modes=None,
+               access_hubs=config.MULTIMODAL_ACCESS_HUBS, access_max_km=config.MULTIMODAL_ACCESS_MAX_KM,
+               direct_max_km=config.MULTIMODAL_DIRECT_MAX_KM):
+    """
+    Finds the lowest-emission path between two points.
+
+    Args:
+        graph (HubGraph): Hub graph from load_hub_graph()
+        origin (tuple): (latitude, longitude) of the pickup
+        destination (tuple): (latitude, longitude) of the delivery
+        weight (float): Cargo weight
+        factors (EmissionFactors): Factor snapshot providing the mode multipliers
+        modes (iterable, optional): Modes allowed between hubs. Defaults to every mode of the graph
+        access_hubs (int): Nearest hubs the pickup and delivery connect to by road
+        access_max_km (float): Great-circle limit of those road connections
+        direct_max_km (float): Great-circle limit of the all-road alternative; the graph
+            does not know which places share a landmass, so farther ones need hubs
+
+    Returns:
+        dict: legs (from, to, mode, coordinates, distance, duration, emission), their
+        distance, duration and emission totals, and "direct", the all-road alternative
+        (None beyond direct_max_km)
+
+    Raises:
+        ValueError: If an allowed mode has no emission factor, or no path connects the places
+    """
+    allowed = set(graph.modes if modes is None else modes) | {ACCESS_MODE}
+    multiplier = {}
+    for mode in allowed & set(graph.modes):
+        if mode not in factors.modes:
+            raise ValueError(f"No emission factor for mode {mode!r}")
+        multiplier[mode] = factors.modes[mode]
+    cheapest = min(multiplier.values())
+
+    n = len(graph.hubs)
+    source, target = n, n + 1
+    from_origin = graph.distances_from(*origin)
+    to_target = graph.distances_from(*destination)
+    great_circle = haversine(*origin, *destination)
+    direct_distance, direct_duration = graph.access_leg(great_circle)
+
+    def access_edges(distances):
+        nearest = np.argsort(distances)[:access_hubs]
+        return [(int(i), *graph.access_leg(float(distances[i]))) for i in nearest if distances[i] <= access_max_km]
+
+    # Hubs reachable from the pickup, and hubs the delivery is reachable from.
+    first_mile = access_edges(from_origin)
+    last_mile = {i: (distance, duration) for i, distance, duration in access_edges(to_target)}
+    road_multiplier = multiplier[ACCESS_MODE]
+
+    def heuristic(node):
+        return 0.0 if node == target else float(to_target[node]) * cheapest
+
+    # The pickup's outgoing edges: the direct road leg and the first-mile legs.
+    best = {source: 0.0}
+    edges = {}
+    queue = []
+    if great_circle <= direct_max_km:
+        best[target] = direct_distance * road_multiplier
+        edges[(source, target)] = (ACCESS_MODE, direct_distance, direct_duration)
+        queue.append((best[target], best[target], target, source))
+    for i, distance, duration in first_mile:
+        best[i] = distance * road_multiplier
+        edges[(source, i)] = (ACCESS_MODE, distance, duration)
+        queue.append((best[i] + heuristic(i), best[i], i, source))
+    heapq.heapify(queue)
+    previous = {}
+
+    while queue:
+        _, cost, node, parent = heapq.heappop(queue)
+        if node in previous:
+            continue
+        previous[node] = parent
+        if node == target:
+            break
+        neighbours = [(b, mode, distance, duration) for b, mode, distance, duration in graph.adjacency[node]
+                      if mode in multiplier]
+        if node in last_mile:
+            neighbours.append((target, ACCESS_MODE, *last_mile[node]))
+        for b, mode, distance, duration in neighbours:
+            step = cost + distance * multiplier[mode]
+            if b not in previous and step < best.get(b, float('inf')):
+                best[b] = step
+                edges[(node, b)] = (mode, distance, duration)
+                heapq.heappush(queue, (step + heuristic(b), step, b, node))
+
+    def describe(node):
+        if node == source:
+            return 'Pickup', origin
+        if node == target:
+            return 'Delivery', destination
+        hub = graph.hubs[node]
+        return hub['name'], (hub['lat'], hub['lon'])
+
+    if target not in previous:
+        raise ValueError("No route found: the pickup or delivery is too far from every hub")
+    path = [target]
+    while path[-1] != source:
+        path.append(previous[path[-1]])
+    path.reverse()
+
+    legs = []
+    for a, b in zip(path, path[1:]):
+        mode, distance, duration = edges[(a, b)]
+        if distance == 0 and mode == ACCESS_MODE:
+            continue  # the pickup or delivery is the hub itself
+        legs.append(_leg(*describe(a), *describe(b), mode, distance, duration, weight, factors))
+
+    return {
+        'legs': legs,
+        'distance': sum(leg['distance'] for leg in legs),
+        'duration': sum(leg['duration'] for leg in legs),
+        'emission': sum(leg['emission'] for leg in legs),
+        'direct': _leg('Pickup', origin, 'Delivery', destination, ACCESS_MODE,
+                       direct_distance, direct_duration, weight, factors) if (source, target) in edges else None,
+    }
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_hub_graph():
+    """
+    Returns the process-wide hub graph, loading and precomputing it on first use.
+
+    Returns:
+        HubGraph: The shared graph
+    """
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                with stage('hub_graph_load'):
+                    _graph = load_hub_graph()
+    return _graph
+
+
+def hub_graph_stats():
+    """
+    Returns the size and version of the hub graph, if it is loaded.
+
+    Returns:
+        dict: Statistics
+    """
+    if _graph is None:
+        return {'loaded': False}
+    return {'loaded': True, 'version': _graph.version, 'hubs': len(_graph.hubs), 'links': _graph.link_count}
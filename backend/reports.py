@@ -0,0 +1,354 @@
+"""
+Server-side report rendering.
+
+The material breakdown and global/local charts are drawn with matplotlib's Agg
+backend and assembled into a one-page PDF, so clients only download finished
+files instead of capturing charts in the browser.
+
+matplotlib keeps global state (pyplot's figure registry, font cache) and holds
+the GIL while drawing, so rendering runs in a separate pool of worker
+processes: request threads only wait on a future. Rendered files are kept in
+an LRU keyed by a hash of the data they show, which is also their ETag.
+"""
+import base64
+import hashlib
+import io
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+from lru import LRUCache
+from timing import stage
+
+CHART_TITLES = {
+    'material': 'Material Emissions Breakdown',
+    'delivery': 'Delivery Method Distribution',
+}
+
+# Calculate result field -> chart it feeds.
+CHART_FIELDS = {
+    'material': 'component_chart',
+    'delivery': 'chart_data',
+}
+
+SUMMARY_FIELDS = ('final_emission', 'weight', 'old_total_emissions', 'new_total_emissions')
+IDENTITY_FIELDS = ('manufacturer', 'part_name', 'serial_id', 'equipment_type')
+
+CHART_SIZE = (6, 4)  # inches
+CHART_DPI = 150
+
+
+class ReportUnavailableError(Exception):
+    """Raised when the render pool cannot produce a file in time."""
+
+
+# Worker side: these run in the render processes.
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _figure_bytes(fig, fmt):
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, dpi=CHART_DPI)
+    return buf.getvalue()
+
+
+def _draw_chart(ax, kind, chart):
+    labels, values, colors = chart['labels'], chart['values'], chart['colors']
+    if kind == 'material':
+        ax.bar(labels, values, color=colors or None)
+        ax.set_ylabel('t CO2e')
+    elif any(values):
+        ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=90, colors=colors or None)
+        ax.axis('equal')
+    else:
+        ax.text(0.5, 0.5, 'No transport emissions', ha='center', va='center')
+        ax.axis('off')
+    ax.set_title(CHART_TITLES[kind])
+
+
+def render_chart(kind, chart):
+    """
+    Draws one chart as a PNG. Runs in a render worker.
+
+    Args:
+        kind (str): 'material' (bar chart) or 'delivery' (pie chart)
+        chart (dict): Normalized chart data from chart_spec()
+
+    Returns:
+        bytes: PNG image
+    """
+    from matplotlib.figure import Figure
+
+    # Figure() instead of pyplot: nothing is registered globally, nothing to close.
+    fig = Figure(figsize=CHART_SIZE, tight_layout=True)
+    _draw_chart(fig.subplots(), kind, chart)
+    return _figure_bytes(fig, 'png')
+
+
+def render_pdf(summary, charts):
+    """
+    Lays out the A4 emissions report. Runs in a render worker.
+
+    Args:
+        summary (dict): Normalized summary from report_summary()
+        charts (dict): Chart kind -> normalized chart data
+
+    Returns:
+        bytes: PDF document
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8.27, 11.69))  # A4 portrait
+    saved = summary['new_total_emissions'] - summary['old_total_emissions']
+    lines = [
+        f"Total Emissions: {summary['final_emission']:,.2f} t CO2e",
+        f"Equipment Type: {summary['equipment_type']}",
+        f"Manufacturer: {summary['manufacturer']}",
+        f"Part Name: {summary['part_name']}   Serial ID: {summary['serial_id']}",
+        f"Weight: {summary['weight']:g} t",
+        f"Emissions Saved: {saved:,.2f} t CO2e",
+    ]
+    fig.text(0.5, 0.95, 'Emissions Report', ha='center', fontsize=20, weight='bold')
+    fig.text(0.08, 0.90, 'Summary', fontsize=14, weight='bold')
+    fig.text(0.08, 0.88, '\n'.join(lines), fontsize=11, va='top', linespacing=1.6)
+    # Vector charts rather than the cached PNGs: they stay sharp when printed.
+    for kind, bottom in (('material', 0.40), ('delivery', 0.05)):
+        _draw_chart(fig.add_axes((0.12, bottom, 0.76, 0.28)), kind, charts[kind])
+    return _figure_bytes(fig, 'pdf')
+
+
+# Request side.
+
+def _float_list(values, name):
+    try:
+        return [float(value) for value in values]
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"{name}.values must be numbers") from e
+
+
+def chart_spec(data, kind):
+    """
+    Extracts and validates the data of one chart from a calculate result.
+
+    Args:
+        data (dict): /api/calculate response (or any dict with the chart field)
+        kind (str): 'material' or 'delivery'
+
+    Returns:
+        dict: labels, values and colors lists
+
+    Raises:
+        ValueError: If the chart kind is unknown or its data is malformed
+    """
+    if kind not in CHART_FIELDS:
+        raise ValueError(f"Unknown chart {kind!r}; choose from {', '.join(CHART_FIELDS)}")
+    name = CHART_FIELDS[kind]
+    chart = data.get(name)
+    if not isinstance(chart, dict) or not isinstance(chart.get('labels'), list):
+        raise ValueError(f"Missing or invalid {name}")
+    labels = [str(label) for label in chart['labels']]
+    values = _float_list(chart.get('values') or [], name)
+    colors = [str(color) for color in chart.get('colors') or []]
+    if len(values) != len(labels) or (colors and len(colors) != len(labels)):
+        raise ValueError(f"{name} labels, values and colors must have the same length")
+    return {'labels': labels, 'values': values, 'colors': colors}
+
+
+def report_summary(data):
+    """
+    Extracts and validates the summary figures of a calculate result.
+
+    Args:
+        data (dict): /api/calculate response
+
+    Returns:
+        dict: Numeric summary fields as floats and identity fields as strings
+
+    Raises:
+        ValueError: If a summary figure is missing or not a number
+    """
+    summary = {}
+    for field in SUMMARY_FIELDS:
+        try:
+            summary[field] = float(data[field])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Missing or invalid {field}") from e
+    for field in IDENTITY_FIELDS:
+        summary[field] = str(data.get(field) or '')
+    return summary
+
+
+def content_hash(kind, payload):
+    """
+    Hashes what a rendered file shows; equal data always maps to the same file.
+
+    Args:
+        kind (str): File kind ('material', 'delivery' or 'pdf')
+        payload: JSON-serializable data drawn into the file
+
+    Returns:
+        str: Hex digest, usable as an ETag
+    """
+    canonical = json.dumps([kind, payload], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+
+
+class ReportRenderer:
+    """
+    Render worker pool plus the cache of rendered files.
+
+    Args:
+        workers (int): Render processes
+        timeout (float): Seconds a request waits for one render
+        cache_entries (int): Rendered files kept in memory
+    """
+
+    def __init__(self, workers=config.REPORT_WORKERS, timeout=config.REPORT_TIMEOUT,
+                 cache_entries=config.REPORT_CACHE_ENTRIES):
+        self.workers = workers
+        self.timeout = timeout
+        self._rendered = LRUCache(cache_entries)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.render_errors = 0
+        self.pool_restarts = 0
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # spawn, not fork: forking a process that runs lookup threads can copy held locks.
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_worker,
+                    )
+        return self._pool
+
+    def _discard_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self.pool_restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _render(self, etag, fn, *args):
+        content = self._rendered.get(etag)
+        if content is not None:
+            return content
+        pool = self._get_pool()
+        with stage('report_render'):
+            try:
+                content = pool.submit(fn, *args).result(timeout=self.timeout)
+            except FutureTimeout as e:
+                self.render_errors += 1
+                raise ReportUnavailableError(f"Rendering took longer than {self.timeout:g} s") from e
+            except BrokenProcessPool as e:
+                # A worker died (e.g. killed for memory); start a fresh pool on the next render.
+                self.render_errors += 1
+                self._discard_pool(pool)
+                raise ReportUnavailableError("Render worker crashed") from e
+        self.renders += 1
+        self._rendered.set(etag, content)
+        return content
+
+    def chart(self, data, kind):
+        """
+        Returns one chart of a calculate result as a PNG.
+
+        Args:
+            data (dict): /api/calculate response
+            kind (str): 'material' or 'delivery'
+
+        Returns:
+            tuple: (PNG bytes, ETag)
+
+        Raises:
+            ValueError: If the chart data is malformed
+            ReportUnavailableError: If rendering timed out or the worker crashed
+        """
+        chart = chart_spec(data, kind)
+        etag = content_hash(kind, chart)
+        return self._render(etag, render_chart, kind, chart), etag
+
+    def pdf(self, data):
+        """
+        Returns the PDF report of a calculate result.
+
+        Args:
+            data (dict): /api/calculate response
+
+        Returns:
+            tuple: (PDF bytes, ETag)
+
+        Raises:
+            ValueError: If the summary or chart data is malformed
+            ReportUnavailableError: If rendering timed out or the worker crashed
+        """
+        summary = report_summary(data)
+        charts = {kind: chart_spec(data, kind) for kind in CHART_FIELDS}
+        etag = content_hash('pdf', [summary, charts])
+        return self._render(etag, render_pdf, summary, charts), etag
+
+    def chart_data_uris(self, data):
+        """
+        Renders every chart of a calculate result as a base64 data URI.
+
+        Args:
+            data (dict): /api/calculate response
+
+        Returns:
+            dict: Chart kind -> {'etag', 'image'}, ready for an <img src>
+        """
+        charts = {}
+        for kind in CHART_FIELDS:
+            png, etag = self.chart(data, kind)
+            charts[kind] = {
+                'etag': etag,
+                'image': 'data:image/png;base64,' + base64.b64encode(png).decode('ascii'),
+            }
+        return charts
+
+    def stats(self):
+        """
+        Returns render and cache counters.
+
+        Returns:
+            dict: Statistics
+        """
+        return {
+            'workers': self.workers,
+            'renders': self.renders,
+            'render_errors': self.render_errors,
+            'pool_restarts': self.pool_restarts,
+            'cache': self._rendered.stats(),
+        }
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_report_renderer():
+    """
+    Returns the process-wide report renderer, created on first use.
+
+    The worker processes themselves start on the first render.
+
+    Returns:
+        ReportRenderer: Shared renderer
+    """
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = ReportRenderer()
+    return _renderer
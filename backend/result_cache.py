@@ -0,0 +1,121 @@
+"""
+Memoization of /api/calculate responses.
+
+A result is keyed by the normalized request body together with the inventory
+catalog version and the emission factors version, so a change to either
+never serves a stale figure. The cache is also cleared outright when the
+catalog or the factors reload, to release entries that can no longer be hit.
+"""
+import hashlib
+import json
+import threading
+
+import config
+from catalog import get_catalog
+from factors import get_factor_registry
+from geocode import normalize_query
+from lru import LRUCache
+
+LOCATION_FIELDS = ('pickup', 'delivery', 'G_pickup', 'G_delivery')
+IDENTITY_FIELDS = ('manufacturer', 'part_name', 'serial_id', 'equipment_type')
+
+
+def normalize_request(data):
+    """
+    Reduces a calculate request body to the fields that determine its result.
+
+    Location names are normalized like geocode queries, and empty optional
+    fields are dropped, so equivalent requests share one key.
+
+    Args:
+        data (dict): Request body
+
+    Returns:
+        dict: Canonical request
+    """
+    canonical = {field: data.get(field) for field in IDENTITY_FIELDS}
+    for field in LOCATION_FIELDS:
+        if data.get(field):
+            canonical[field] = normalize_query(data[field])
+    canonical['map'] = data.get('map', 'html')
+    return canonical
+
+
+class ResultCache:
+    """
+    LRU of calculate results with TTL expiry and version-aware keys.
+
+    Args:
+        maxsize (int): Maximum number of cached results
+        ttl (float): Seconds a result stays valid
+    """
+
+    def __init__(self, maxsize=config.RESULT_CACHE_SIZE, ttl=config.RESULT_CACHE_TTL):
+        self._entries = LRUCache(maxsize, ttl=ttl)
+        self.invalidations = 0
+
+    def make_key(self, data, *versions):
+        """
+        Builds the cache key of a request.
+
+        Args:
+            data (dict): Request body
+            *versions (str): Versions of the data the result depends on
+
+        Returns:
+            str: Cache key
+        """
+        payload = json.dumps([normalize_request(data), versions], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached result for a key, or None.
+        """
+        return self._entries.get(key)
+
+    def set(self, key, result):
+        """
+        Caches a result.
+        """
+        self._entries.set(key, result)
+
+    def invalidate(self):
+        """Drops every cached result."""
+        self._entries.clear()
+        self.invalidations += 1
+
+    def stats(self):
+        """
+        Returns hit ratio, size and invalidation count.
+
+        Returns:
+            dict: Cache statistics
+        """
+        stats = self._entries.stats()
+        stats['invalidations'] = self.invalidations
+        stats['enabled'] = self._entries.maxsize > 0
+        return stats
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Returns the process-wide calculate result cache.
+
+    Returns:
+        ResultCache: The shared cache
+    """
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                cache = ResultCache()
+                # Cached results embed inventory rows and factors; drop them as soon as either changes.
+                get_catalog().add_listener(lambda catalog: cache.invalidate())
+                get_factor_registry().add_listener(lambda factors: cache.invalidate())
+                _result_cache = cache
+    return _result_cache
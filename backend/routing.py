@@ -0,0 +1,503 @@
+"""
+Road routing with a two-level route cache and pluggable router backends.
+
+``OSRMRouter`` queries an OSRM server (the public demo server by default, or
+a self-hosted one through ``CARBON_OSRM_URL``). ``EstimateRouter`` works
+offline and estimates road distance as the great-circle distance times a
+circuity factor. ``RouteService`` caches router answers in memory and in
+SQLite so repeated legs never reach the network.
+
+With ``CARBON_ROUTE_HEDGE_DEADLINE`` set, a router call that has not
+answered by the deadline is not waited for: the estimate is returned flagged
+``provisional`` and the call finishes in the background, filling the cache
+for the next request. Every router answer is also compared with the
+estimate, so the circuity factor can be calibrated from real routes.
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import config
+from geo import haversine
+from lru import LRUCache
+from timing import stage
+from upstream import UpstreamError, get_upstream, record_fallback
+
+
+class RoutingError(Exception):
+    """Raised when a router backend cannot answer (timeout, HTTP or payload error)."""
+
+
+class OSRMRouter:
+    """
+    Routes with the OSRM HTTP API.
+
+    Calls go through the shared ``upstream`` client, which reuses connections,
+    retries, and fails fast while OSRM is unhealthy.
+
+    Args:
+        client (UpstreamClient, optional): Defaults to the shared "osrm" client
+            (``CARBON_OSRM_URL``, ``CARBON_OSRM_TIMEOUT``)
+    """
+
+    name = 'osrm'
+
+    def __init__(self, client=None):
+        self.client = client or get_upstream('osrm')
+
+    def route(self, origin, destination, profile='driving'):
+        """
+        Asks OSRM for the fastest route between two points.
+
+        Args:
+            origin (tuple): (latitude, longitude) of the start
+            destination (tuple): (latitude, longitude) of the end
+            profile (str): OSRM profile. Defaults to "driving"
+
+        Returns:
+            dict | None: {"distance": km, "duration": hours}, or None if OSRM found no route
+
+        Raises:
+            RoutingError: If the server cannot be reached in time, answers garbage,
+                or its circuit breaker is open
+        """
+        origin_str = f"{origin[1]},{origin[0]}"
+        destination_str = f"{destination[1]},{destination[0]}"
+        try:
+            response = self.client.get(f"/route/v1/{profile}/{origin_str};{destination_str}",
+                                       params={'overview': 'false'})
+            data = response.json()
+        except (UpstreamError, ValueError) as e:
+            raise RoutingError(f"OSRM request failed: {e}") from e
+
+        if 'routes' in data and len(data['routes']) > 0:
+            route = data['routes'][0]
+            return {"distance": route['distance'] / 1000, "duration": route['duration'] / 3600}
+        return None
+
+
+class EstimateRouter:
+    """
+    Offline road-distance estimate: great-circle distance times a circuity factor.
+
+    Args:
+        circuity (float): Ratio of road distance to great-circle distance
+        speed_kmh (float): Average road speed used for the duration
+    """
+
+    name = 'estimate'
+
+    def __init__(self, circuity=config.ROUTE_CIRCUITY_FACTOR, speed_kmh=config.ROAD_SPEED_KMH):
+        self.circuity = circuity
+        self.speed_kmh = speed_kmh
+
+    def route(self, origin, destination, profile='driving'):
+        """
+        Estimates the road distance and duration between two points.
+
+        Args:
+            origin (tuple): (latitude, longitude) of the start
+            destination (tuple): (latitude, longitude) of the end
+            profile (str): Ignored; kept for interface compatibility
+
+        Returns:
+            dict: {"distance": km, "duration": hours}
+        """
+        distance = haversine(*origin, *destination) * self.circuity
+        return {"distance": distance, "duration": distance / self.speed_kmh}
+
+
+def create_router(kind=None):
+    """
+    Builds the router selected by ``CARBON_ROUTER``.
+
+    Args:
+        kind (str, optional): "osrm" or "estimate". Defaults to the configured router
+
+    Returns:
+        OSRMRouter | EstimateRouter: The router instance
+
+    Raises:
+        ValueError: If the router kind is unknown
+    """
+    kind = kind or config.ROUTER
+    if kind == 'osrm':
+        return OSRMRouter()
+    if kind == 'estimate':
+        return EstimateRouter()
+    raise ValueError(f"Unknown router: {kind}")
+
+
+def route_key(origin, destination, profile='driving', precision=config.ROUTE_PRECISION):
+    """
+    Builds the cache key of a leg from rounded coordinates.
+
+    Args:
+        origin (tuple): (latitude, longitude) of the start
+        destination (tuple): (latitude, longitude) of the end
+        profile (str): Routing profile
+        precision (int): Decimal places kept for each coordinate
+
+    Returns:
+        str: Cache key such as "driving:-31.9523,115.8613;-20.3107,118.6065"
+    """
+    o_lat, o_lon = (round(c, precision) for c in origin)
+    d_lat, d_lon = (round(c, precision) for c in destination)
+    return f"{profile}:{o_lat},{o_lon};{d_lat},{d_lon}"
+
+
+class RouteCache:
+    """
+    Route cache with an in-memory LRU in front of a SQLite table.
+
+    Args:
+        path (str): SQLite file holding the ``route_cache`` table
+        memory_entries (int): Size of the in-memory LRU
+        max_entries (int): Rows kept on disk before least recently used ones are evicted
+        ttl (float): Seconds a route stays valid
+    """
+
+    def __init__(self, path=config.CACHE_DB_PATH, memory_entries=config.ROUTE_MEMORY_ENTRIES,
+                 max_entries=config.ROUTE_MAX_ENTRIES, ttl=config.ROUTE_TTL):
+        self.path = path
+        self.memory = LRUCache(memory_entries, ttl=ttl)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_hits = 0
+        self.disk_evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = None
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS route_cache (
+                key TEXT PRIMARY KEY,
+                distance REAL NOT NULL,
+                duration REAL NOT NULL,
+                source TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_route_cache_last_used ON route_cache (last_used)')
+        conn.commit()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        return self._conn
+
+    def close(self):
+        """Closes the database connection; it reopens on next use. The in-memory LRU is kept."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get(self, key):
+        """
+        Looks up a route, promoting disk hits into memory.
+
+        Args:
+            key (str): Key built by ``route_key``
+
+        Returns:
+            dict | None: The cached route, or None on a miss
+        """
+        route = self.memory.get(key)
+        if route is not None:
+            return route
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                'SELECT distance, duration, source, created_at FROM route_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or now - row[3] > self.ttl:
+                return None
+            conn.execute('UPDATE route_cache SET last_used = ? WHERE key = ?', (now, key))
+            conn.commit()
+            self.disk_hits += 1
+        route = {"distance": row[0], "duration": row[1], "source": row[2]}
+        self.memory.set(key, route)
+        return route
+
+    def put(self, key, route):
+        """
+        Stores a route in memory and on disk.
+
+        Args:
+            key (str): Key built by ``route_key``
+            route (dict): Route with "distance", "duration" and "source"
+        """
+        self.memory.set(key, route)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO route_cache (key, distance, duration, source, created_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, route['distance'], route['duration'], route['source'], now, now)
+            )
+            count = conn.execute('SELECT COUNT(*) FROM route_cache').fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                conn.execute(
+                    'DELETE FROM route_cache WHERE key IN '
+                    '(SELECT key FROM route_cache ORDER BY last_used LIMIT ?)', (excess,)
+                )
+                self.disk_evictions += excess
+            conn.commit()
+
+    def stats(self):
+        """
+        Returns memory and disk cache statistics.
+
+        Returns:
+            dict: Cache statistics
+        """
+        with self._lock:
+            size = self._connection().execute('SELECT COUNT(*) FROM route_cache').fetchone()[0]
+        return {
+            'memory': self.memory.stats(),
+            'disk_hits': self.disk_hits,
+            'disk_evictions': self.disk_evictions,
+            'disk_size': size,
+        }
+
+
+class Calibration:
+    """
+    Running comparison of router answers with the great-circle estimate.
+
+    Args:
+        circuity (float): Circuity factor the estimates are made with
+    """
+
+    def __init__(self, circuity):
+        self.circuity = circuity
+        self.samples = 0
+        self._great_circle = 0.0
+        self._road = 0.0
+        self._error = 0.0
+        self._abs_error = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, great_circle, road):
+        """
+        Records one router answer.
+
+        Args:
+            great_circle (float): Great-circle distance of the leg in km
+            road (float): Road distance the router answered in km
+        """
+        if great_circle <= 0 or road <= 0:
+            return
+        error = (great_circle * self.circuity - road) / road
+        with self._lock:
+            self.samples += 1
+            self._great_circle += great_circle
+            self._road += road
+            self._error += error
+            self._abs_error += abs(error)
+
+    def stats(self):
+        """
+        Returns the estimate's mean error and the circuity the samples suggest.
+
+        Returns:
+            dict: samples, circuity in use, observed circuity (total road over total
+            great-circle distance), and mean signed and absolute relative error of the estimate
+        """
+        with self._lock:
+            samples = self.samples
+            return {
+                'samples': samples,
+                'circuity': self.circuity,
+                'observed_circuity': self._road / self._great_circle if samples else None,
+                'mean_error': self._error / samples if samples else None,
+                'mean_abs_error': self._abs_error / samples if samples else None,
+            }
+
+
+class RouteService:
+    """
+    Cached road routing with an offline fallback.
+
+    Router answers are cached. When the router finds no route the estimate is
+    cached in its place; when the router fails (timeout, outage) the estimate
+    is returned but not cached, so the leg is retried next time, and reported
+    with ``upstream.record_fallback``.
+
+    Args:
+        router: Router backend
+        cache (RouteCache): Route cache
+        estimator (EstimateRouter, optional): Fallback estimate
+        hedge_deadline (float): Seconds to wait for the router before answering with a
+            provisional estimate; 0 always waits
+        hedge_workers (int): Threads running hedged router calls
+    """
+
+    def __init__(self, router, cache, estimator=None, hedge_deadline=config.ROUTE_HEDGE_DEADLINE,
+                 hedge_workers=config.ROUTE_HEDGE_WORKERS):
+        self.router = router
+        self.cache = cache
+        self.estimator = estimator or EstimateRouter()
+        self.hedge_deadline = hedge_deadline if router.name != self.estimator.name else 0
+        self.calibration = Calibration(self.estimator.circuity)
+        self.router_calls = 0
+        self.router_errors = 0
+        self.fallbacks = 0
+        self.provisional = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}  # cache key -> future of a hedged router call
+        self._executor = None
+        if self.hedge_deadline > 0:
+            # Hedged calls get their own threads: lookups already run on the shared
+            # pool, and a pool thread must never wait on another pool task.
+            self._executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix='route-hedge')
+
+    def _estimate(self, origin, destination, profile):
+        return dict(self.estimator.route(origin, destination, profile), source=self.estimator.name)
+
+    def _fetch(self, key, origin, destination, profile):
+        """Asks the router, caches its answer and returns the route; None if the router failed."""
+        self.router_calls += 1
+        try:
+            with stage('route_upstream'):
+                answer = self.router.route(origin, destination, profile)
+        except RoutingError as e:
+            print("Routing error:", e)
+            self.router_errors += 1
+            return None
+
+        if answer is None:
+            self.fallbacks += 1
+            route = self._estimate(origin, destination, profile)
+        else:
+            route = dict(answer, source=self.router.name)
+            self.calibration.add(haversine(*origin, *destination), route['distance'])
+        self.cache.put(key, route)
+        return route
+
+    def route(self, origin, destination, profile='driving', hedge=True):
+        """
+        Returns the road distance and duration between two points.
+
+        Args:
+            origin (tuple): (latitude, longitude) of the start
+            destination (tuple): (latitude, longitude) of the end
+            profile (str): Routing profile. Defaults to "driving"
+            hedge (bool): Answer with a provisional estimate if the router misses
+                the hedge deadline. False always waits for the router
+
+        Returns:
+            dict: {"distance": km, "duration": hours, "source": "osrm" | "estimate"},
+            plus "provisional": True when the router is still working on the leg
+        """
+        key = route_key(origin, destination, profile)
+        route = self.cache.get(key)
+        if route is not None:
+            return route
+
+        if not hedge or self._executor is None:
+            route = self._fetch(key, origin, destination, profile)
+            if route is None:
+                self.fallbacks += 1
+                record_fallback('route')
+                return self._estimate(origin, destination, profile)
+            return route
+
+        started = False
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._executor.submit(self._fetch, key, origin, destination, profile)
+                self._in_flight[key] = future
+                started = True
+        if started:
+            # Outside the lock: an already finished future runs the callback right here.
+            future.add_done_callback(lambda _: self._finish(key))
+        try:
+            route = future.result(timeout=self.hedge_deadline)
+        except FutureTimeoutError:
+            self.provisional += 1
+            return dict(self._estimate(origin, destination, profile), provisional=True)
+        if route is None:
+            self.fallbacks += 1
+            record_fallback('route')
+            return self._estimate(origin, destination, profile)
+        return route
+
+    def _finish(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def refined(self, origin, destination, profile='driving', timeout=0):
+        """
+        Returns the router's answer for a leg that was answered provisionally.
+
+        Args:
+            origin (tuple): (latitude, longitude) of the start
+            destination (tuple): (latitude, longitude) of the end
+            profile (str): Routing profile
+            timeout (float): Seconds to wait for a router call still in flight
+
+        Returns:
+            dict | None: The cached route, or None if the router has not answered
+            (still running past the timeout, or failed)
+        """
+        key = route_key(origin, destination, profile)
+        with self._lock:
+            future = self._in_flight.get(key)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except FutureTimeoutError:
+                return None
+        return self.cache.get(key)
+
+    def stats(self):
+        """
+        Returns router, hedging, calibration and cache statistics.
+
+        Returns:
+            dict: Routing statistics
+        """
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {
+            'router': self.router.name,
+            'router_calls': self.router_calls,
+            'router_errors': self.router_errors,
+            'fallbacks': self.fallbacks,
+            'hedge': {
+                'deadline': self.hedge_deadline,
+                'provisional': self.provisional,
+                'in_flight': in_flight,
+            },
+            'calibration': self.calibration.stats(),
+            'cache': self.cache.stats(),
+        }
+
+
+_route_service = None
+_route_service_lock = threading.Lock()
+
+
+def get_route_service():
+    """
+    Returns the process-wide route service, creating it on first use.
+
+    Returns:
+        RouteService: The shared route service
+    """
+    global _route_service
+    if _route_service is None:
+        with _route_service_lock:
+            if _route_service is None:
+                _route_service = RouteService(create_router(), RouteCache())
+    return _route_service
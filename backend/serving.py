@@ -0,0 +1,144 @@
+"""
+Startup warm-up, readiness and pre-fork worker support.
+
+``warm_up`` loads the read-only state requests depend on (the inventory
+catalog and fleet model, the emission factors, the depot index, the hub
+graph and a snapshot of the geocode cache) and then marks the process ready; /readyz
+answers 503 until it has. Under gunicorn (``wsgi.py`` with ``preload_app``)
+it runs once in the master process, and ``before_fork`` then closes every
+database connection, upstream connection pool and thread pool the warm-up
+opened, so the forked workers share the loaded data copy-on-write while each
+opens its own connections on first use. ``after_fork`` starts a worker's job
+queue.
+"""
+import gc
+import os
+import threading
+import time
+
+import config
+from catalog import get_catalog
+from concurrency import shutdown_executor
+from db import get_database
+from depots import get_depot_index
+from factors import current_factors
+from fleet import get_fleet
+from geocode import get_geocoder
+from jobs import get_job_queue
+from multimodal import get_hub_graph
+from routing import get_route_service
+from upstream import close_upstreams
+
+# Warm-up steps by name, each returning a size for the readiness report.
+STEPS = {
+    'catalog': lambda: get_catalog().stats()['parts'],
+    'fleet': lambda: len(get_fleet()),
+    'factors': lambda: len(current_factors().fuels),
+    'depots': lambda: len(get_depot_index().depots),
+    'geocode': lambda: get_geocoder().cache.preload(),
+    'hubs': lambda: len(get_hub_graph().hubs),
+}
+
+_ready = threading.Event()
+_lock = threading.Lock()
+_started = False
+_status = {'state': 'pending', 'steps': {}, 'error': None, 'seconds': None}
+
+
+def warm_up(steps=None):
+    """
+    Loads the shared read-only state and marks the process ready.
+
+    A failing step is reported and the others still run, but the process
+    stays not ready.
+
+    Args:
+        steps (list, optional): Step names, defaults to CARBON_WARM_UP
+
+    Returns:
+        dict: The readiness status, as status() returns it
+    """
+    if steps is None:
+        steps = [name.strip() for name in config.WARM_UP.split(',') if name.strip()]
+    with _lock:
+        _status['state'] = 'warming'
+    started = time.perf_counter()
+    errors = []
+    for name in steps:
+        step_started = time.perf_counter()
+        try:
+            size = STEPS[name]()
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+            errors.append(f"{name}: {e}")
+            continue
+        with _lock:
+            _status['steps'][name] = {'seconds': time.perf_counter() - step_started, 'size': size}
+    with _lock:
+        _status['seconds'] = time.perf_counter() - started
+        _status['error'] = '; '.join(errors) or None
+        _status['state'] = 'failed' if errors else 'ready'
+    if not errors:
+        _ready.set()
+    return status()
+
+
+def start_warm_up():
+    """Runs warm_up on a background thread, once per process, so the server starts answering at once."""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+def before_fork():
+    """
+    Releases what must not be shared with forked workers.
+
+    SQLite connections and pooled sockets must not be used by two processes,
+    and threads do not survive fork(). Everything closed here reopens on first
+    use. The loaded objects are then frozen out of the garbage collector, so
+    collections in the workers do not write to (and copy) their pages.
+    """
+    get_database().close()
+    get_catalog().close()
+    get_geocoder().cache.close()
+    get_route_service().cache.close()
+    close_upstreams()
+    shutdown_executor()
+    gc.freeze()
+
+
+def after_fork():
+    """Starts the job queue of a freshly forked worker, so queued jobs run without waiting for a request."""
+    get_job_queue()
+
+
+def is_ready():
+    """
+    Tells whether warm-up finished without errors.
+
+    Returns:
+        bool: True once the process may receive traffic
+    """
+    return _ready.is_set()
+
+
+def status():
+    """
+    Returns the warm-up state, per-step timings and sizes, and the process id.
+
+    Returns:
+        dict: ready, state ("pending", "warming", "ready" or "failed"), steps, error, seconds and pid
+    """
+    with _lock:
+        return {
+            'ready': _ready.is_set(),
+            'state': _status['state'],
+            'steps': {name: dict(step) for name, step in _status['steps'].items()},
+            'error': _status['error'],
+            'seconds': _status['seconds'],
+            'pid': os.getpid(),
+        }
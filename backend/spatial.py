@@ -0,0 +1,165 @@
+"""
+Great-circle nearest-neighbour and radius search.
+
+Points are stored as 3D unit vectors, bucketed into a uniform grid of cubes
+and sorted by cube, so a query only measures the points in the cubes around
+it. On the unit sphere the straight-line (chord) distance grows with the
+great-circle distance, so a radius in km is a radius in chord units and
+every query is exact: a cube that cannot hold a match is never opened, and
+every point of an opened cube is measured. Returned distances come from the
+vectorized haversine kernel of ``geo.haversine_matrix``.
+"""
+import math
+
+import numpy as np
+
+from geo import EARTH_RADIUS_KM, haversine_matrix
+
+# Target average of points per occupied cube when the cube size is picked automatically.
+POINTS_PER_CELL = 8
+
+
+def to_unit_vectors(lat, lon):
+    """
+    Converts coordinates to unit vectors.
+
+    Args:
+        lat (array-like): Latitudes in degrees
+        lon (array-like): Longitudes in degrees
+
+    Returns:
+        ndarray: (N, 3) x, y, z coordinates
+    """
+    phi = np.radians(np.asarray(lat, dtype=np.float64).ravel())
+    lam = np.radians(np.asarray(lon, dtype=np.float64).ravel())
+    cos_phi = np.cos(phi)
+    return np.column_stack((cos_phi * np.cos(lam), cos_phi * np.sin(lam), np.sin(phi)))
+
+
+def chord_length(distance_km):
+    """
+    Converts a great-circle distance to the straight-line distance on the unit sphere.
+
+    Args:
+        distance_km (float): Great-circle distance
+
+    Returns:
+        float: Chord length, 2 for antipodes and beyond
+    """
+    return 2 * math.sin(min(distance_km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+class SpatialIndex:
+    """
+    Exact k-nearest and within-radius queries over fixed points.
+
+    Args:
+        lat (array-like): Latitudes of the points in degrees
+        lon (array-like): Longitudes of the points in degrees
+        cell_km (float, optional): Edge of the grid cubes, in km along the surface.
+            Defaults to a size giving about POINTS_PER_CELL points per occupied cube
+    """
+
+    def __init__(self, lat, lon, cell_km=None):
+        self.lat = np.asarray(lat, dtype=np.float64).ravel()
+        self.lon = np.asarray(lon, dtype=np.float64).ravel()
+        n = self.lat.size
+        if cell_km:
+            cell = chord_length(cell_km)
+        else:
+            # A uniform spread over the sphere's 4*pi area; clustered points simply fill fewer cubes.
+            cell = math.sqrt(4 * math.pi * POINTS_PER_CELL / max(n, 1))
+        self.cell = min(max(cell, 1e-4), 2.0)
+        self.cells_per_axis = int(2 / self.cell) + 2
+
+        xyz = to_unit_vectors(self.lat, self.lon)
+        keys = self._cell_keys(self._cell_coords(xyz))
+        order = np.argsort(keys, kind='stable')
+        self._order = order
+        self._xyz = xyz[order]
+        self._keys, self._starts, self._counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    def __len__(self):
+        return self.lat.size
+
+    def _cell_coords(self, xyz):
+        return np.floor((xyz + 1.0) / self.cell).astype(np.int64)
+
+    def _cell_keys(self, coords):
+        m = self.cells_per_axis
+        return (coords[..., 0] * m + coords[..., 1]) * m + coords[..., 2]
+
+    def _candidates(self, q, chord):
+        """Positions (in sorted order) of every point in the cubes a chord-radius ball around q touches."""
+        lo = np.maximum(np.floor((q - chord + 1.0) / self.cell).astype(np.int64), 0)
+        hi = np.minimum(np.floor((q + chord + 1.0) / self.cell).astype(np.int64), self.cells_per_axis - 1)
+        spans = hi - lo + 1
+        if int(np.prod(spans)) >= self._keys.size:
+            return np.arange(self._xyz.shape[0])
+        m = self.cells_per_axis
+        grid = ((np.arange(lo[0], hi[0] + 1)[:, None, None] * m + np.arange(lo[1], hi[1] + 1)[None, :, None]) * m
+                + np.arange(lo[2], hi[2] + 1)[None, None, :]).ravel()
+        # grid is ascending, so the occupied cubes come out ascending and distinct.
+        slots = np.minimum(np.searchsorted(self._keys, grid), self._keys.size - 1)
+        slots = slots[self._keys[slots] == grid]
+        lengths = self._counts[slots]
+        total = int(lengths.sum())
+        ends = np.cumsum(lengths)
+        return np.repeat(self._starts[slots] - ends + lengths, lengths) + np.arange(total)
+
+    def _query(self, lat, lon, chord):
+        q = to_unit_vectors(lat, lon)[0]
+        positions = self._candidates(q, chord)
+        d2 = np.square(self._xyz[positions] - q).sum(axis=1)
+        keep = d2 <= chord * chord
+        return positions[keep], d2[keep]
+
+    def _result(self, positions, d2, lat, lon, limit=None):
+        order = np.argsort(d2, kind='stable')
+        if limit is not None:
+            order = order[:limit]
+        indices = self._order[positions[order]]
+        distances = haversine_matrix(self.lat[indices], self.lon[indices], [lat], [lon])[:, 0]
+        return indices, distances
+
+    def within(self, lat, lon, radius_km, limit=None):
+        """
+        Finds every point within a great-circle radius.
+
+        Args:
+            lat (float): Query latitude in degrees
+            lon (float): Query longitude in degrees
+            radius_km (float): Search radius
+            limit (int, optional): Return only the closest ``limit`` points
+
+        Returns:
+            tuple: (indices into the input points, distances in km), nearest first
+        """
+        positions, d2 = self._query(lat, lon, chord_length(radius_km))
+        return self._result(positions, d2, lat, lon, limit)
+
+    def nearest(self, lat, lon, k=1):
+        """
+        Finds the k points closest to a location.
+
+        The search radius starts at one cube and doubles until it holds k
+        points; everything inside it has been measured, so the k closest of
+        those are the k closest overall.
+
+        Args:
+            lat (float): Query latitude in degrees
+            lon (float): Query longitude in degrees
+            k (int): Number of points
+
+        Returns:
+            tuple: (indices into the input points, distances in km), nearest first
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        chord = self.cell
+        while True:
+            positions, d2 = self._query(lat, lon, chord)
+            if positions.size >= k or chord >= 2.0:
+                return self._result(positions, d2, lat, lon, k)
+            chord = min(chord * 2, 2.0)
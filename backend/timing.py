@@ -0,0 +1,103 @@
+"""
+Per-request stage timers.
+
+A request calls ``start_request()`` (and ``end_request()`` when it is done)
+and the code it runs wraps its stages in ``with stage('geocode'):``. Timings
+go to a list held in a context variable, so lookups running on the shared
+pool (submitted through ``concurrency.submit``, which copies the caller's
+context) land in the request that started them. Outside a request ``stage``
+only checks the context variable and does nothing else.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+_timings = contextvars.ContextVar('carbon_timings', default=None)
+
+
+def start_request():
+    """
+    Starts collecting stage timings for the current request.
+
+    Returns:
+        list: The list the request's (stage, seconds) tuples are appended to
+    """
+    timings = []
+    _timings.set(timings)
+    return timings
+
+
+def end_request():
+    """Stops collecting stage timings in the current context."""
+    _timings.set(None)
+
+
+def current_timings():
+    """
+    Returns the stage timings of the current request.
+
+    Returns:
+        list | None: (stage, seconds) tuples in completion order, or None outside a request
+    """
+    return _timings.get()
+
+
+@contextmanager
+def stage(name):
+    """
+    Times a block as one stage of the current request.
+
+    Args:
+        name (str): Stage name; repeated and parallel stages with the same name are summed
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append((name, time.perf_counter() - started))
+
+
+def summarize(timings):
+    """
+    Totals stage timings by name.
+
+    Args:
+        timings (list): (stage, seconds) tuples
+
+    Returns:
+        dict: Stage -> (total seconds, count), in order of first completion
+    """
+    totals = {}
+    for name, seconds in timings:
+        total, count = totals.get(name, (0.0, 0))
+        totals[name] = (total + seconds, count + 1)
+    return totals
+
+
+def server_timing(timings, total=None):
+    """
+    Formats stage timings as a Server-Timing header value.
+
+    Stages nest (a route lookup contains its upstream call) and lookups run in
+    parallel, so the stage durations do not add up to the total.
+
+    Args:
+        timings (list): (stage, seconds) tuples
+        total (float, optional): Wall time of the whole request in seconds
+
+    Returns:
+        str: e.g. 'geocode;dur=12.4;desc="3 calls", total;dur=20.1'
+    """
+    entries = []
+    for name, (seconds, count) in summarize(timings).items():
+        entry = f"{name};dur={seconds * 1000:.1f}"
+        if count > 1:
+            entry += f';desc="{count} calls"'
+        entries.append(entry)
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
@@ -0,0 +1,388 @@
+"""
+Shared HTTP clients for the upstream services (OSRM, Nominatim).
+
+Each upstream gets one ``UpstreamClient`` for the whole process: a
+``requests.Session`` whose connection pool keeps connections alive between
+calls, a semaphore bounding the calls in flight to that host, retries with
+jittered exponential backoff drawn from a retry budget (so retries cannot
+multiply the load on a struggling server), and a ``CircuitBreaker`` that
+stops calling an upstream after repeated failures. While the breaker is
+open calls fail at once with ``CircuitOpenError`` and callers take their
+fallback path (the route estimate, a stale geocode) instead of waiting for
+timeouts. Fallback answers are reported with ``record_fallback`` so a
+caller inside ``collect_fallbacks()`` can tell a degraded result from a
+good one, even when the lookups ran on the shared pool.
+"""
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import config
+from concurrency import SharedTokenBucket
+from metrics import UPSTREAM_SECONDS
+
+# Statuses worth retrying: the upstream is overloaded or briefly unavailable.
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Latencies kept per upstream for the percentiles in stats().
+LATENCY_WINDOW = 512
+
+_fallbacks = contextvars.ContextVar('carbon_upstream_fallbacks', default=None)
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream call fails after its retries, or cannot be made."""
+
+
+class CircuitOpenError(UpstreamError):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Closed, it lets every call through and opens after ``failure_threshold``
+    failures in a row. Open, it rejects calls for ``reset_timeout`` seconds,
+    then half-opens and lets a single probe through: a success closes it, a
+    failure opens it again.
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the breaker
+        reset_timeout (float): Seconds the breaker stays open before probing
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=config.UPSTREAM_BREAKER_FAILURES,
+                 reset_timeout=config.UPSTREAM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opens = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Tells whether a call may go to the upstream now.
+
+        Returns:
+            bool: False while open, and while a half-open probe is in flight
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def cancel(self):
+        """Gives back a call allow() let through that was never made."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, success):
+        """
+        Records the outcome of a call that allow() let through.
+
+        Args:
+            success (bool): Whether the upstream answered usefully
+        """
+        with self._lock:
+            self._probing = False
+            if success:
+                self.failures = 0
+                self.state = self.CLOSED
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opens += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of calls.
+
+    Every call deposits ``ratio`` tokens (up to ``capacity``) and every retry
+    spends one, so while an upstream fails everything, retries add at most
+    ``ratio`` extra load instead of multiplying it.
+
+    Args:
+        ratio (float): Retries allowed per call, on average
+        capacity (float): Tokens saved up for bursts
+    """
+
+    def __init__(self, ratio=config.UPSTREAM_RETRY_BUDGET, capacity=10.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._tokens = capacity
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Adds one call's share of retry tokens."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """
+        Takes a token for one retry.
+
+        Returns:
+            bool: False if the budget is spent
+        """
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class UpstreamClient:
+    """
+    Pooled, bounded, retrying and circuit-broken HTTP client of one upstream.
+
+    Args:
+        name (str): Upstream name used in stats and metrics
+        base_url (str): Scheme and host, e.g. "http://router.project-osrm.org"
+        timeout (float): Seconds allowed for connecting and for reading each attempt
+        max_concurrency (int): Calls in flight to the host at once; also the connection pool size
+        retries (int): Extra attempts after a connection error or a RETRY_STATUSES answer
+        backoff (float): Base delay before the first retry; doubles per retry, with ±50% jitter
+        headers (dict, optional): Headers sent with every call (e.g. User-Agent)
+        rate_limiter (TokenBucket | SharedTokenBucket, optional): Bucket every attempt draws a token from
+        breaker (CircuitBreaker, optional): Defaults to a breaker with the configured settings
+    """
+
+    def __init__(self, name, base_url, timeout, max_concurrency=config.UPSTREAM_MAX_CONCURRENCY,
+                 retries=config.UPSTREAM_RETRIES, backoff=config.UPSTREAM_RETRY_BACKOFF,
+                 headers=None, rate_limiter=None, breaker=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = RetryBudget()
+
+        self._requests = requests
+        self._session = requests.Session()
+        self._session.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.failures = 0
+        self.retried = 0
+        self.short_circuits = 0
+        self.rejected = 0
+
+    def _attempt(self, url, params):
+        """One HTTP call; returns (response, retryable error message or None)."""
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(timeout=self.timeout):
+            raise UpstreamError(f"{self.name}: rate limit, no request slot available")
+        started = time.perf_counter()
+        try:
+            response = self._session.get(url, params=params, timeout=self.timeout)
+        except self._requests.RequestException as e:
+            response, error = None, f"{type(e).__name__}: {e}"
+        else:
+            error = f"HTTP {response.status_code}" if response.status_code in RETRY_STATUSES or \
+                response.status_code >= 500 else None
+        elapsed = time.perf_counter() - started
+        UPSTREAM_SECONDS.observe((self.name, 'error' if error else 'ok'), elapsed)
+        with self._lock:
+            self._latencies.append(elapsed)
+        return response, error
+
+    def get(self, path, params=None):
+        """
+        Makes a GET call.
+
+        Args:
+            path (str): Path below base_url, starting with "/"
+            params (dict, optional): Query parameters
+
+        Returns:
+            requests.Response: The answer; any status but 5xx and 429, which are retried
+
+        Raises:
+            CircuitOpenError: If the breaker is open; the upstream is not called
+            UpstreamError: If every attempt failed, no slot freed up within the
+                timeout, or the rate limit left no request slot
+        """
+        if not self.breaker.allow():
+            with self._lock:
+                self.short_circuits += 1
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            self.breaker.cancel()
+            raise UpstreamError(f"{self.name}: {self.max_concurrency} calls already in flight")
+
+        url = self.base_url + path
+        self.budget.deposit()
+        try:
+            attempt = 0
+            while True:
+                with self._lock:
+                    self.calls += 1
+                try:
+                    response, error = self._attempt(url, params)
+                except UpstreamError:
+                    self.breaker.cancel()  # rate limited before calling: no verdict on the upstream
+                    raise
+                self.breaker.record(error is None)
+                if error is None:
+                    return response
+                with self._lock:
+                    self.failures += 1
+                if attempt >= self.retries or not self.budget.withdraw() or not self.breaker.allow():
+                    raise UpstreamError(f"{self.name} request failed: {error}")
+                with self._lock:
+                    self.retried += 1
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+                attempt += 1
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Closes the pooled connections (and the rate limiter's database, if any); they reopen on the next call."""
+        self._session.close()
+        if hasattr(self.rate_limiter, 'close'):
+            self.rate_limiter.close()
+
+    def stats(self):
+        """
+        Returns call counters, breaker state and recent latency percentiles.
+
+        Returns:
+            dict: Statistics
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'base_url': self.base_url,
+                'state': self.breaker.state,
+                'open': self.breaker.state != CircuitBreaker.CLOSED,
+                'calls': self.calls,
+                'failures': self.failures,
+                'retries': self.retried,
+                'short_circuits': self.short_circuits,
+                'rejected': self.rejected,
+                'opens': self.breaker.opens,
+            }
+        for label, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            stats[f'latency_{label}_ms'] = latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1e3 \
+                if latencies else None
+        return stats
+
+
+def _create(name):
+    if name == 'osrm':
+        return UpstreamClient('osrm', config.OSRM_URL, config.OSRM_TIMEOUT)
+    if name == 'nominatim':
+        # Nominatim's usage policy allows one request per second from the whole application,
+        # so the bucket lives in cache.db and is shared by every worker process.
+        return UpstreamClient(
+            'nominatim', f"{config.NOMINATIM_SCHEME}://{config.NOMINATIM_DOMAIN}", config.NOMINATIM_TIMEOUT,
+            headers={'User-Agent': config.NOMINATIM_USER_AGENT},
+            rate_limiter=SharedTokenBucket(config.CACHE_DB_PATH, 'nominatim', rate=config.NOMINATIM_RATE_LIMIT))
+    raise ValueError(f"Unknown upstream: {name}")
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_upstream(name):
+    """
+    Returns the process-wide client of an upstream, creating it on first use.
+
+    Args:
+        name (str): "osrm" or "nominatim"
+
+    Returns:
+        UpstreamClient: The shared client
+
+    Raises:
+        ValueError: If the upstream is unknown
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = _create(name)
+    return client
+
+
+def close_upstreams():
+    """Closes the pooled connections of every upstream client created so far."""
+    for client in list(_clients.values()):
+        client.close()
+
+
+def upstream_stats():
+    """
+    Returns the statistics of every upstream client created so far.
+
+    Returns:
+        dict: Upstream name -> statistics
+    """
+    return {name: client.stats() for name, client in list(_clients.items())}
+
+
+@contextmanager
+def collect_fallbacks():
+    """
+    Collects the fallback answers given to the code run inside the block.
+
+    Lookups submitted through ``concurrency.submit`` copy the caller's
+    context, so their fallbacks land in the same list.
+
+    Yields:
+        list: Names of the upstreams ("geocode", "route") that were answered by a fallback
+    """
+    fallbacks = []
+    token = _fallbacks.set(fallbacks)
+    try:
+        yield fallbacks
+    finally:
+        _fallbacks.reset(token)
+
+
+def record_fallback(kind):
+    """
+    Notes that a failed upstream was answered by a fallback (stale entry, estimate).
+
+    Args:
+        kind (str): What was answered, e.g. "geocode" or "route"
+    """
+    fallbacks = _fallbacks.get()
+    if fallbacks is not None:
+        fallbacks.append(kind)
@@ -0,0 +1,133 @@
+"""
+What-if sweeps of the reuse-or-replace decision.
+
+``lifecycle_emissions`` prices one part at today's constants. A sweep varies
+the used hours, the lifetime emissions, the emission rate per hour and the
+transport distance of the old and of the new unit over grids, for many
+parts at once. Reusing an old unit totals
+
+    created - (lifetime - used_hours * rate) + weight * f * old_distance
+
+and buying new totals ``created + weight * f * new_distance`` (f is the
+transport factor), so reuse emits less exactly when used_hours is below the
+break-even
+
+    used_hours* = (lifetime + weight * f * (new_distance - old_distance)) / rate
+
+``sweep`` broadcasts used_hours* over parts x lifetime x rate x old distance
+x new distance. The used-hours axis is never materialized: a cell's verdict
+is a comparison with used_hours*, so counting the winning cells of a whole
+used-hours grid is a sorted search, and millions of cells cost milliseconds.
+"""
+import numpy as np
+
+# Grid axes in broadcast order; used_hours is handled separately (see sweep).
+AXES = ('used_hours', 'lifetime', 'rate', 'old_distance', 'new_distance')
+
+
+def parse_axis(name, spec, max_points):
+    """
+    Reads one grid axis from a request.
+
+    Args:
+        name (str): Axis name, for error messages
+        spec (list | dict): Values, or {"start", "stop", "num"} for evenly spaced values
+        max_points (int): Largest accepted number of values
+
+    Returns:
+        ndarray: The axis values
+
+    Raises:
+        ValueError: If the spec is malformed, empty, too long or holds negative or non-finite values
+    """
+    if isinstance(spec, dict):
+        try:
+            start, stop, num = float(spec['start']), float(spec['stop']), int(spec['num'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"{name} must be a list of numbers or {{start, stop, num}}")
+        if not 1 <= num <= max_points:
+            raise ValueError(f"{name}: num must be between 1 and {max_points}")
+        values = np.linspace(start, stop, num)
+    elif isinstance(spec, list) and 0 < len(spec) <= max_points:
+        try:
+            values = np.array(spec, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a list of numbers")
+    else:
+        raise ValueError(f"{name} must be a list of 1 to {max_points} numbers or {{start, stop, num}}")
+    if values.ndim != 1 or not np.all(np.isfinite(values)) or np.any(values < 0):
+        raise ValueError(f"{name} values must be finite, non-negative numbers")
+    if name == 'rate' and np.any(values == 0):
+        raise ValueError("rate values must be positive")
+    return values
+
+
+def break_even_hours(weight, lifetime, rate, old_distance, new_distance, transport_factor):
+    """
+    Calculates the used hours below which reusing the old unit emits less than buying new.
+
+    Works on floats and, broadcasting, on arrays.
+
+    Args:
+        weight (float | ndarray): Part weight
+        lifetime (float | ndarray): Lifetime emissions of a unit
+        rate (float | ndarray): Emissions per hour of use; must be positive
+        old_distance (float | ndarray): Transport distance of the old unit in km
+        new_distance (float | ndarray): Transport distance of the new unit in km
+        transport_factor (float): Factor weight x distance is multiplied by
+
+    Returns:
+        float | ndarray: Break-even used hours; negative where buying new always wins
+    """
+    return (lifetime + weight * transport_factor * (new_distance - old_distance)) / rate
+
+
+def sweep(weight, used_hours, axes, transport_factor):
+    """
+    Evaluates the reuse verdict of every part over every grid cell.
+
+    Args:
+        weight (ndarray): Part weights, shape (parts,)
+        used_hours (ndarray): The parts' own used hours, shape (parts,); compared
+            instead of a grid when axes has no "used_hours"
+        axes (dict): Axis name -> values, for lifetime, rate, old_distance,
+            new_distance and optionally used_hours
+        transport_factor (float): Factor weight x distance is multiplied by
+
+    Returns:
+        dict: "break_even" (parts, lifetime, rate, old_distance, new_distance)
+        array; "reuse_cells" per part; "cells_per_part"; and with a used-hours
+        grid "reuse_by_used_hours", the cells reuse wins at each grid value
+    """
+    weight = np.asarray(weight, dtype=np.float64)
+    lifetime, rate = axes['lifetime'], axes['rate']
+    old_distance, new_distance = axes['old_distance'], axes['new_distance']
+    break_even = break_even_hours(
+        weight[:, None, None, None, None],
+        lifetime[None, :, None, None, None],
+        rate[None, None, :, None, None],
+        old_distance[None, None, None, :, None],
+        new_distance[None, None, None, None, :],
+        transport_factor)
+    per_part = break_even.reshape(weight.size, -1)
+
+    grid = axes.get('used_hours')
+    if grid is None:
+        own = np.asarray(used_hours, dtype=np.float64)[:, None]
+        return {
+            'break_even': break_even,
+            'reuse_cells': np.count_nonzero(own < per_part, axis=1),
+            'cells_per_part': per_part.shape[1],
+        }
+
+    # Grid values strictly below each break-even are the cells where reuse wins.
+    hours = np.sort(grid)
+    reuse_cells = np.searchsorted(hours, per_part, side='left').sum(axis=1)
+    ordered = np.sort(break_even, axis=None)
+    reuse_by_used_hours = ordered.size - np.searchsorted(ordered, grid, side='right')
+    return {
+        'break_even': break_even,
+        'reuse_cells': reuse_cells,
+        'cells_per_part': per_part.shape[1] * grid.size,
+        'reuse_by_used_hours': reuse_by_used_hours,
+    }
@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production serving.
+
+Run from this directory with ``gunicorn -c gunicorn.conf.py wsgi:app``. The
+app is built with ``preload``: the master process warms up once, before
+forking the workers, and every worker starts ready.
+"""
+from app import create_app
+
+app = create_app(preload=True)